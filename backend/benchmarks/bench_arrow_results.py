@@ -0,0 +1,73 @@
+# Row path vs Arrow path for /clients result conversion
+#
+# Builds a synthetic clients_for_advisor result in both shapes - a list of
+# bigquery.Row objects and the equivalent Arrow table - and times turning each
+# into the /clients response records. Network transfer and the client library's
+# own page decoding are not included.
+#
+#   python -m backend.benchmarks.bench_arrow_results [rows ...]
+
+import datetime
+import decimal
+import sys
+import time
+
+import pyarrow as pa
+from google.cloud.bigquery.table import Row
+
+from backend.main import _clients_from_rows, _clients_from_table
+
+FIELDS = [
+    "client_id", "name", "email", "phone", "location", "client_tier", "net_worth",
+    "portfolio_value", "risk_tolerance", "investment_objective", "total_holdings",
+    "asset_classes", "onboarding_date", "last_contact_date",
+]
+
+
+def make_rows(count):
+    field_to_index = {field: i for i, field in enumerate(FIELDS)}
+    rows = []
+    for i in range(count):
+        rows.append(Row((
+            f"CL{i:06d}", f"Client {i}", f"client{i}@example.com", "555-0100", "New York, NY",
+            ["Platinum", "Gold", "Silver"][i % 3],
+            decimal.Decimal("1250000.50") if i % 7 else None,
+            decimal.Decimal(100000 + i * 1337).scaleb(-2),
+            "Moderate", "Growth", i % 40, i % 6,
+            datetime.date(2020, 1, 1) + datetime.timedelta(days=i % 1500),
+            datetime.date(2024, 6, 1) + datetime.timedelta(days=i % 90) if i % 5 else None,
+        ), field_to_index))
+    return rows
+
+
+def make_table(rows):
+    columns = {field: [row[field] for row in rows] for field in FIELDS}
+    return pa.table({
+        **{field: pa.array(values) for field, values in columns.items()},
+        "net_worth": pa.array(columns["net_worth"], pa.decimal128(38, 9)),
+        "portfolio_value": pa.array(columns["portfolio_value"], pa.decimal128(38, 9)),
+    })
+
+
+def timed(fn, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def main(sizes):
+    print(f"{'rows':>8} {'row path ms':>12} {'arrow path ms':>14} {'speedup':>8}")
+    for size in sizes:
+        rows = make_rows(size)
+        table = make_table(rows)
+        row_time, from_rows = timed(lambda: _clients_from_rows(rows))
+        arrow_time, from_table = timed(lambda: _clients_from_table(table))
+        assert from_rows == from_table, "Row and Arrow paths disagree"
+        print(f"{size:>8} {row_time * 1000:>12.1f} {arrow_time * 1000:>14.1f} {row_time / arrow_time:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main([int(n) for n in sys.argv[1:]] or [100, 1000, 10000, 100000])
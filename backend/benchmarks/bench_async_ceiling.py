@@ -0,0 +1,108 @@
+# Concurrency ceiling of the dashboard data endpoints, before and after async
+#
+# /clients, /todo, /nba, /dashboard-metrics, /aggregation and /ai-insights used
+# to be plain def handlers, so each request held one of Starlette's ~40
+# threadpool threads for its whole BigQuery-plus-Gemini wait. The "threadpool"
+# column reproduces that: the same handlers are mounted as sync routes that
+# block a pool thread until the handler finishes. The "async" column calls the
+# handlers as they are now.
+#
+# Runs in-process with FAKE_BACKENDS=true and the result and response caches
+# off, so every request waits on the injected query and model latency. N
+# requests for /todo and /nba (one query and one Gemini call each, spread over
+# the fixture advisors) are fired at once; past the pool size the threadpool
+# run queues in waves while the async run finishes in about one request's time,
+# until LLM_MAX_ASYNC_CONCURRENCY Gemini calls are in flight and the rest wait
+# for a slot (without a thread).
+#
+#   python -m backend.benchmarks.bench_async_ceiling [concurrency ...]
+
+import os
+import sys
+import tempfile
+
+os.environ.setdefault("FAKE_BACKENDS", "true")
+os.environ.setdefault("LOCAL_ENGINE_DATA_DIR", os.path.join(tempfile.gettempdir(), "advisor-fake-fixtures"))
+os.environ.setdefault("QUERY_CACHE_ENABLED", "false")
+os.environ.setdefault("LLM_CACHE_ENABLED", "false")
+os.environ.setdefault("FAKE_LLM_LATENCY_MS", "500")
+os.environ.setdefault("FAKE_LLM_JITTER_MS", "0")
+os.environ.setdefault("FAKE_QUERY_LATENCY_MS", "200")
+os.environ.setdefault("FAKE_QUERY_JITTER_MS", "0")
+
+import asyncio
+import functools
+import inspect
+import statistics
+import time
+
+import anyio.from_thread
+import httpx
+from fastapi import FastAPI
+
+from backend import data_access, fakes, llm, main, warmup
+
+ADVISORS = [f"ADV{a:03d}" for a in range(1, fakes.FAKE_FIXTURE_ADVISORS + 1)]
+PATHS = ["/todo", "/nba"]
+
+
+def threadpool_route(handler):
+    """Sync route around an async handler: the request holds a pool thread until it finishes"""
+    def route(**kwargs):
+        return anyio.from_thread.run(functools.partial(handler, **kwargs))
+    # Same query parameters as the handler, but a plain function, so FastAPI runs it on the pool
+    route.__signature__ = inspect.signature(handler)
+    return route
+
+
+def threadpool_app():
+    app = FastAPI()
+    for path, handler in [
+        ("/clients", main.get_clients),
+        ("/todo", main.get_todo),
+        ("/nba", main.get_nba),
+        ("/dashboard-metrics", main.get_dashboard_metrics),
+        ("/aggregation", main.aggregation),
+        ("/ai-insights", main.get_ai_insights),
+    ]:
+        app.get(path)(threadpool_route(handler))
+    return app
+
+
+async def fire(app, concurrency):
+    """Seconds until concurrency simultaneous requests all finish, and their median latency"""
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=600) as client:
+        async def one(i):
+            started = time.perf_counter()
+            response = await client.get(PATHS[i % len(PATHS)], params={"advisor_id": ADVISORS[i % len(ADVISORS)]})
+            assert response.status_code == 200
+            return time.perf_counter() - started
+
+        started = time.perf_counter()
+        latencies = await asyncio.gather(*(one(i) for i in range(concurrency)))
+        return time.perf_counter() - started, statistics.median(latencies)
+
+
+async def run(levels):
+    legacy = threadpool_app()
+    async with main.app.router.lifespan_context(main.app):
+        # Measure a warmed instance, as traffic only arrives once /ready says so
+        await asyncio.get_running_loop().run_in_executor(None, warmup.wait)
+        print(f"{'concurrent':>10} {'threadpool s':>13} {'p50 s':>7} {'req/s':>7}   {'async s':>8} {'p50 s':>7} {'req/s':>7}")
+        for concurrency in levels:
+            before, before_p50 = await fire(legacy, concurrency)
+            after, after_p50 = await fire(main.app, concurrency)
+            print(f"{concurrency:>10} {before:>13.2f} {before_p50:>7.2f} {concurrency / before:>7.0f}   "
+                  f"{after:>8.2f} {after_p50:>7.2f} {concurrency / after:>7.0f}")
+
+
+def main_(levels):
+    print(f"fake query {fakes.FAKE_QUERY_LATENCY_MS:.0f} ms, fake Gemini {fakes.FAKE_LLM_LATENCY_MS:.0f} ms, "
+          f"caches off, {' and '.join(PATHS)}, Gemini async slots {llm.LLM_MAX_ASYNC_CONCURRENCY}")
+    asyncio.run(run(levels))
+    data_access.shutdown()
+
+
+if __name__ == "__main__":
+    main_([int(n) for n in sys.argv[1:]] or [10, 40, 100, 200, 400])
@@ -0,0 +1,81 @@
+# Concurrency check for the async endpoints
+#
+# Fires N concurrent /chat requests at the app in-process, with Gemini replaced by
+# a fake model that takes MODEL_LATENCY seconds and BigQuery by a fake that takes
+# QUERY_LATENCY seconds. With the blocking calls offloaded, N chats finish in
+# about the time of one; the "blocking" run calls the model inline on the event
+# loop, the way the endpoint used to, and serializes them. The assertion lives
+# in backend/tests/test_chat_concurrency.py.
+#
+#   python -m backend.benchmarks.bench_chat_concurrency [concurrency ...]
+
+import asyncio
+import sys
+import time
+from unittest import mock
+
+import httpx
+
+from backend import data_access, llm, snapshots
+from backend.main import app
+
+MODEL_LATENCY = 1.0
+QUERY_LATENCY = 0.1
+
+
+class FakeResponse:
+    usage_metadata = None
+
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeModel:
+    def __init__(self, name, system_instruction=None):
+        self.name = name
+
+    def generate_content(self, prompt, stream=False):
+        time.sleep(MODEL_LATENCY)
+        return FakeResponse(f"Answer from {self.name} for a prompt of {len(prompt)} characters")
+
+
+def fake_run_named(name, params=None, endpoint=None):
+    time.sleep(QUERY_LATENCY)
+    return []
+
+
+async def blocking_generate_with_fallback(model_names, prompt, endpoint=None, accept=None):
+    """The old behaviour: the SDK call runs directly on the event loop"""
+    return llm.generate_with_fallback(model_names, prompt, endpoint, accept)
+
+
+async def fire(concurrency):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+        started = time.perf_counter()
+        responses = await asyncio.gather(*(
+            client.post("/chat", json={"message": f"question {i}", "advisor_id": "ADV001"})
+            for i in range(concurrency)
+        ))
+        elapsed = time.perf_counter() - started
+    assert all(r.status_code == 200 and "Answer from" in r.json()["response"] for r in responses)
+    return elapsed
+
+
+def main(levels):
+    with mock.patch.object(llm, "GenerativeModel", FakeModel), \
+            mock.patch.object(data_access, "run_named", fake_run_named), \
+            mock.patch.object(snapshots, "ready", lambda: False):
+        print(f"model latency {MODEL_LATENCY:.1f}s, query latency {QUERY_LATENCY:.1f}s, "
+              f"Gemini workers {llm.LLM_MAX_CONCURRENCY}")
+        print(f"{'concurrent':>10} {'offloaded s':>12} {'blocking s':>11}")
+        for concurrency in levels:
+            offloaded = asyncio.run(fire(concurrency))
+            with mock.patch.object(llm, "agenerate_with_fallback", blocking_generate_with_fallback):
+                blocking = asyncio.run(fire(concurrency))
+            print(f"{concurrency:>10} {offloaded:>12.2f} {blocking:>11.2f}")
+    data_access.shutdown()
+
+
+if __name__ == "__main__":
+    main([int(n) for n in sys.argv[1:]] or [1, 4, 8, 16])
@@ -0,0 +1,89 @@
+# Throughput and tail latency of the main endpoints with no network
+#
+# Runs the app in-process with FAKE_BACKENDS=true (backend/fakes.py): Gemini is
+# a scripted fake and queries run on the local engine over generated fixtures,
+# both with injected latency. Each endpoint gets REQUESTS requests with at most
+# CONCURRENCY in flight, spread over the fixture advisors. Tune the stand-ins
+# with the FAKE_* variables; set QUERY_CACHE_ENABLED=false / LLM_CACHE_ENABLED=false
+# to measure the uncached path.
+#
+#   python -m backend.benchmarks.bench_endpoints [concurrency] [requests]
+
+import os
+import sys
+import tempfile
+
+os.environ.setdefault("FAKE_BACKENDS", "true")
+os.environ.setdefault("LOCAL_ENGINE_DATA_DIR", os.path.join(tempfile.gettempdir(), "advisor-fake-fixtures"))
+
+import asyncio
+import statistics
+import time
+
+import httpx
+
+from backend import data_access, fakes, warmup
+from backend.main import app
+
+ADVISORS = [f"ADV{a:03d}" for a in range(1, fakes.FAKE_FIXTURE_ADVISORS + 1)]
+
+ENDPOINTS = [
+    ("GET", "/clients", lambda i: {"params": {"advisor_id": ADVISORS[i % len(ADVISORS)]}}),
+    ("GET", "/todo", lambda i: {"params": {"advisor_id": ADVISORS[i % len(ADVISORS)]}}),
+    ("GET", "/nba", lambda i: {"params": {"advisor_id": ADVISORS[i % len(ADVISORS)]}}),
+    ("GET", "/dashboard-metrics", lambda i: {}),
+    ("GET", "/aggregation", lambda i: {"params": {"advisor_id": ADVISORS[i % len(ADVISORS)]}}),
+    ("GET", "/ai-insights", lambda i: {}),
+    ("POST", "/chat", lambda i: {"json": {"message": f"question {i}", "advisor_id": ADVISORS[i % len(ADVISORS)]}}),
+]
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+async def load(client, method, path, request_args, concurrency, requests):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, errors = [], 0
+
+    async def one(i):
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            response = await client.request(method, path, **request_args(i))
+            latencies.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    return time.perf_counter() - started, latencies, errors
+
+
+async def run(concurrency, requests):
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        # Measure a warmed instance, as traffic only arrives once /ready says so
+        await asyncio.get_running_loop().run_in_executor(None, warmup.wait)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=300) as client:
+            print(f"{'endpoint':<20} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8} {'errors':>7}")
+            for method, path, request_args in ENDPOINTS:
+                elapsed, latencies, errors = await load(client, method, path, request_args, concurrency, requests)
+                ms = [latency * 1000 for latency in latencies]
+                print(f"{method + ' ' + path:<20} {requests / elapsed:>8.1f} {statistics.median(ms):>8.0f} "
+                      f"{percentile(ms, 0.95):>8.0f} {percentile(ms, 0.99):>8.0f} {max(ms):>8.0f} {errors:>7}")
+
+
+def main(concurrency, requests):
+    print(f"fake Gemini {fakes.FAKE_LLM_LATENCY_MS:.0f}+~{fakes.FAKE_LLM_JITTER_MS:.0f} ms "
+          f"(error rate {fakes.FAKE_LLM_ERROR_RATE}), fake query {fakes.FAKE_QUERY_LATENCY_MS:.0f}"
+          f"+~{fakes.FAKE_QUERY_JITTER_MS:.0f} ms (error rate {fakes.FAKE_QUERY_ERROR_RATE}), "
+          f"concurrency {concurrency}, {requests} requests per endpoint")
+    asyncio.run(run(concurrency, requests))
+    data_access.shutdown()
+
+
+if __name__ == "__main__":
+    args = [int(n) for n in sys.argv[1:]]
+    main(args[0] if args else 32, args[1] if len(args) > 1 else 200)
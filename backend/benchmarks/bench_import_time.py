@@ -0,0 +1,88 @@
+# Import time of the backend, per module
+#
+# Imports backend.main in fresh interpreters with python -X importtime and
+# reports the median cumulative time of every backend module and of each
+# third-party package a backend module imports directly. The SDKs in LAZY must
+# only be imported on first use; if one shows up, or the total goes over
+# --budget-ms, the script exits non-zero so a cold-start regression fails CI.
+#
+#   python -m backend.benchmarks.bench_import_time [--runs N] [--budget-ms MS] [module]
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+# Imported on first use (backend/llm.py, backend/data_access.py, /ingest-data)
+LAZY = [
+    "vertexai",
+    "google.cloud.aiplatform",
+    "google.cloud.bigquery",
+    "google.cloud.storage",
+    "google.cloud.discoveryengine_v1",
+    "googleapiclient.discovery",
+]
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def import_tree(module):
+    """[(module, cumulative microseconds, parent module)] for one fresh import"""
+    env = {**os.environ, "PYTHONPATH": ROOT}
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, cwd=ROOT, env=env, check=True,
+    )
+    entries = []
+    pending = {}  # depth -> indexes of entries still waiting for their parent line
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        index = len(entries)
+        entries.append([name.strip(), int(cumulative), None])
+        # importtime prints children before their parent, one level deeper
+        for child in pending.pop(depth + 1, []):
+            entries[child][2] = name.strip()
+        pending.setdefault(depth, []).append(index)
+    return [tuple(entry) for entry in entries]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("module", nargs="?", default="backend.main")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=None)
+    args = parser.parse_args()
+
+    samples = {}
+    loaded = set()
+    for _ in range(args.runs):
+        for name, cumulative, parent in import_tree(args.module):
+            loaded.add(name)
+            if name.startswith("backend") or (parent or "").startswith("backend"):
+                samples.setdefault((name, parent), []).append(cumulative)
+
+    rows = sorted(
+        ((name, parent, statistics.median(values) / 1000) for (name, parent), values in samples.items()),
+        key=lambda row: row[2], reverse=True,
+    )
+    total = next((ms for name, parent, ms in rows if name == args.module), 0.0)
+    print(f"{args.module}: {total:.0f} ms (median of {args.runs} runs)")
+    print(f"{'module':<40} {'imported by':<24} {'ms':>8}")
+    for name, parent, ms in rows:
+        if name != args.module and ms >= 1:
+            print(f"{name:<40} {parent or '':<24} {ms:>8.1f}")
+
+    failures = [f"{name} is imported eagerly" for name in LAZY if name in loaded]
+    if args.budget_ms is not None and total > args.budget_ms:
+        failures.append(f"import took {total:.0f} ms, budget {args.budget_ms:.0f} ms")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,91 @@
+# Payload size and encode time of the largest JSON endpoints
+#
+# Fetches each endpoint once in-process with FAKE_BACKENDS=true, then times,
+# on the decoded payload:
+#   stdlib   jsonable_encoder + json.dumps (FastAPI's default JSONResponse path)
+#   orjson   FastJSONResponse.render straight from the dict, as /aggregation,
+#            /dashboard-metrics and /clients now return it
+#   enc+orj  jsonable_encoder + orjson, what a plain dict return costs with
+#            FastJSONResponse as the default response class
+# and the body size and compression time at the per-request levels
+# CompressionMiddleware uses (gzip COMPRESS_GZIP_LEVEL, brotli
+# COMPRESS_BROTLI_QUALITY). Grow the payloads with
+# FAKE_FIXTURE_CLIENTS_PER_ADVISOR.
+#
+#   python -m backend.benchmarks.bench_json_payloads [iterations]
+
+import os
+import sys
+import tempfile
+
+os.environ.setdefault("FAKE_BACKENDS", "true")
+os.environ.setdefault("LOCAL_ENGINE_DATA_DIR", os.path.join(tempfile.gettempdir(), "advisor-fake-fixtures"))
+os.environ.setdefault("FAKE_LLM_LATENCY_MS", "0")
+os.environ.setdefault("FAKE_QUERY_LATENCY_MS", "0")
+
+import asyncio
+import json
+import statistics
+import time
+
+import httpx
+from fastapi.encoders import jsonable_encoder
+from starlette.responses import JSONResponse
+
+from backend import data_access, responses, warmup
+from backend.main import app
+
+PATHS = [
+    "/aggregation?advisor_id=ADV001",
+    "/aggregation?advisor_id=ADV001&client_id=CLI0001",
+    "/dashboard-metrics",
+    "/clients?advisor_id=ADV001",
+    "/looker-integration",
+]
+
+
+def timed(fn, iterations):
+    """Median microseconds per call"""
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples) * 1e6
+
+
+async def fetch_payloads():
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        await asyncio.get_running_loop().run_in_executor(None, warmup.wait)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            return {path: (await client.get(path, headers={"Accept-Encoding": "identity"})).json() for path in PATHS}
+
+
+def main(iterations):
+    payloads = asyncio.run(fetch_payloads())
+    data_access.shutdown()
+    render = responses.FastJSONResponse.render
+    print(f"orjson {'installed' if responses.orjson else 'missing'}, brotli {'installed' if responses.brotli else 'missing'}, "
+          f"gzip level {responses.COMPRESS_GZIP_LEVEL}, brotli quality {responses.COMPRESS_BROTLI_QUALITY}, "
+          f"median of {iterations}")
+    print(f"{'endpoint':<48} {'stdlib us':>9} {'orjson us':>9} {'enc+orj us':>10}   "
+          f"{'bytes':>7} {'gzip':>6} {'gz us':>6} {'br':>6} {'br us':>6}")
+    for path, content in payloads.items():
+        stdlib = timed(lambda: JSONResponse.render(None, jsonable_encoder(content)), iterations)
+        direct = timed(lambda: render(None, content), iterations)
+        encoded = timed(lambda: render(None, jsonable_encoder(content)), iterations)
+        body = json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        gzipped = responses.compress(body, "gzip")
+        gzip_us = timed(lambda: responses.compress(body, "gzip"), iterations)
+        if responses.brotli is not None:
+            brotli_size = len(responses.compress(body, "br"))
+            brotli_us = f"{timed(lambda: responses.compress(body, 'br'), iterations):>6.0f}"
+        else:
+            brotli_size, brotli_us = "-", "-"
+        print(f"{path:<48} {stdlib:>9.0f} {direct:>9.0f} {encoded:>10.0f}   "
+              f"{len(body):>7} {len(gzipped):>6} {gzip_us:>6.0f} {brotli_size:>6} {brotli_us:>6}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
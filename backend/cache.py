@@ -0,0 +1,124 @@
+# In-process result cache for BigQuery reads
+#
+# Bounded LRU keyed by (query name, bound parameters). Each entry carries its own
+# TTL, and the cache evicts least-recently-used entries when either the entry
+# count or the estimated memory footprint goes over its cap.
+
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+QUERY_CACHE_ENABLED = os.getenv("QUERY_CACHE_ENABLED", "true").lower() == "true"
+QUERY_CACHE_MAX_ENTRIES = int(os.getenv("QUERY_CACHE_MAX_ENTRIES", "1024"))
+QUERY_CACHE_MAX_BYTES = int(os.getenv("QUERY_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+
+def estimate_size(value):
+    """Rough memory footprint of a cached value in bytes"""
+    if hasattr(value, "nbytes") and hasattr(value, "schema"):
+        # pyarrow.Table
+        return value.nbytes
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(estimate_size(k) + estimate_size(v) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set)):
+        size += sum(estimate_size(item) for item in value)
+    elif hasattr(value, "values") and callable(value.values):
+        # bigquery.Row
+        size += sum(estimate_size(item) for item in value.values())
+    elif hasattr(value, "__dict__"):
+        size += estimate_size(vars(value))
+    return size
+
+
+class TTLCache:
+    """Thread-safe LRU cache with per-entry TTLs and a memory cap"""
+
+    def __init__(self, max_entries=QUERY_CACHE_MAX_ENTRIES, max_bytes=QUERY_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (value, expires_at, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        """Return (True, value) on a fresh hit, (False, None) otherwise"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return False, None
+            value, expires_at, size = entry
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, value
+
+    def set(self, key, value, ttl):
+        if ttl <= 0:
+            return
+        size = estimate_size(value)
+        if size > self.max_bytes:
+            # Never let one oversized result flush the whole cache
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, time.monotonic() + ttl, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate(self, name=None, **params):
+        """Drop entries for a query name and/or matching parameter values.
+
+        With no arguments the whole cache is cleared. Returns the number of
+        entries removed.
+        """
+        with self._lock:
+            doomed = [
+                key for key in self._entries
+                if (name is None or key[0] == name)
+                and all(dict(key[1]).get(k) == v for k, v in params.items())
+            ]
+            for key in doomed:
+                self._remove(key)
+            self.invalidations += len(doomed)
+            return len(doomed)
+
+    def _remove(self, key):
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+
+# Shared cache for advisor-scoped query results
+query_cache = TTLCache()
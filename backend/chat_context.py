@@ -0,0 +1,119 @@
+# Per-advisor chat context snapshots
+#
+# /chat and /chat/stream answer from the advisor's clients, tasks, recent
+# transactions and portfolio breakdown. Building that context takes four
+# queries, and in a conversation it is the same for every message, so the
+# built context is kept here per advisor as a versioned snapshot: follow-up
+# messages reuse it and cost only the Gemini call. A snapshot is rebuilt once it
+# is CHAT_CONTEXT_TTL seconds old, or on the next message after cached results
+# of a query it is built from are invalidated for the advisor
+# (backend/data_access.invalidate_cache). Concurrent first messages for an
+# advisor share one build.
+
+import asyncio
+import itertools
+import os
+import threading
+import time
+
+from backend import coalesce, data_access
+from backend.cache import TTLCache
+
+CHAT_CONTEXT_ENABLED = os.getenv("CHAT_CONTEXT_ENABLED", "true").lower() == "true"
+CHAT_CONTEXT_TTL = int(os.getenv("CHAT_CONTEXT_TTL", "600"))
+CHAT_CONTEXT_MAX_ADVISORS = int(os.getenv("CHAT_CONTEXT_MAX_ADVISORS", "256"))
+
+# Queries the context is built from (_build_chat_context in backend/main.py),
+# live and snapshot-backed
+CONTEXT_QUERIES = {
+    "chat_clients", "chat_clients_snapshot", "advisor_tasks", "chat_transactions",
+    "chat_portfolio", "chat_portfolio_snapshot",
+}
+
+snapshots = TTLCache(max_entries=CHAT_CONTEXT_MAX_ADVISORS)
+_versions = itertools.count(1)
+_flights = coalesce.SingleFlight("chat-context")
+_invalidations = 0  # bumped by invalidate(); a build that overlaps one is not stored
+_invalidations_lock = threading.Lock()
+
+
+class Snapshot:
+    """One advisor's chat context as of built_at"""
+
+    def __init__(self, advisor_id, context, version):
+        self.advisor_id = advisor_id
+        self.context = context
+        self.version = version
+        self.built_at = time.time()
+
+    def age(self):
+        return time.time() - self.built_at
+
+
+def _key(advisor_id):
+    # Same (name, params) shape as query-cache keys, so invalidate() can filter by advisor
+    return ("chat_context", (("advisor_id", advisor_id),))
+
+
+def get(advisor_id, build):
+    """The advisor's current snapshot, calling build(advisor_id) for a new one when needed"""
+    if CHAT_CONTEXT_ENABLED:
+        hit, snapshot = snapshots.get(_key(advisor_id))
+        if hit:
+            return snapshot
+    return _rebuild(advisor_id, build)
+
+
+async def aget(advisor_id, build):
+    """get() for async endpoints: a hit returns straight away, a build runs on a
+    worker thread and concurrent callers await it without holding one"""
+    if CHAT_CONTEXT_ENABLED:
+        hit, snapshot = snapshots.get(_key(advisor_id))
+        if hit:
+            return snapshot
+    loop = asyncio.get_running_loop()
+    return await _flights.ado(_key(advisor_id), lambda: loop.run_in_executor(None, _build, advisor_id, build))
+
+
+def _rebuild(advisor_id, build):
+    return _flights.do(_key(advisor_id), lambda: _build(advisor_id, build))
+
+
+def _build(advisor_id, build):
+    key = _key(advisor_id)
+    if CHAT_CONTEXT_ENABLED:
+        # Stored by a build that finished after the caller's own cache check
+        hit, snapshot = snapshots.get(key)
+        if hit:
+            return snapshot
+    with _invalidations_lock:
+        invalidations = _invalidations
+    snapshot = Snapshot(advisor_id, build(advisor_id), next(_versions))
+    # Checked and stored under the lock, so an invalidation can't land in between
+    with _invalidations_lock:
+        if CHAT_CONTEXT_ENABLED and invalidations == _invalidations:
+            snapshots.set(key, snapshot, CHAT_CONTEXT_TTL)
+    return snapshot
+
+
+def invalidate(advisor_id=None):
+    """Drop one advisor's snapshot, or every snapshot"""
+    global _invalidations
+    with _invalidations_lock:
+        _invalidations += 1
+        if advisor_id is None:
+            return snapshots.invalidate()
+        return snapshots.invalidate(advisor_id=advisor_id)
+
+
+def _on_data_change(name, params):
+    """Drop snapshots built from the invalidated query; name None means every query"""
+    if name is None or name in CONTEXT_QUERIES:
+        invalidate(params.get("advisor_id"))
+
+
+def stats():
+    return {"ttl_seconds": CHAT_CONTEXT_TTL, **snapshots.stats()}
+
+
+data_access.on_invalidate(_on_data_change)
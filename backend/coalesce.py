@@ -0,0 +1,125 @@
+# Single-flight request coalescing
+#
+# When several callers ask for the same key at the same time, only the first
+# (the leader) runs the work; the others wait for it and share its result or
+# exception. Nothing is stored once the call finishes - that is the caches' job.
+# Async callers use ado(), where followers await the leader without holding a
+# thread; if the leader is cancelled, its followers retry the call themselves.
+
+import asyncio
+import threading
+
+_groups = {}
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Deduplicates concurrent calls that share a key"""
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._async_calls = {}  # key -> asyncio.Future of the leader's result
+        self.executions = 0
+        self.deduplicated = 0
+        _groups[name] = self
+
+    def do(self, key, fn):
+        """Run fn() for key, or wait for the in-flight call with the same key"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+                self.executions += 1
+            else:
+                self.deduplicated += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+        return call.result
+
+    async def ado(self, key, fn):
+        """Await fn() for key, or await the in-flight ado() call with the same key"""
+        while True:
+            with self._lock:
+                future = self._async_calls.get(key)
+                leader = future is None
+                if leader:
+                    future = asyncio.get_running_loop().create_future()
+                    # Nobody may be waiting on the error; retrieve it so it is not logged
+                    future.add_done_callback(lambda f: f.cancelled() or f.exception())
+                    self._async_calls[key] = future
+                    self.executions += 1
+                else:
+                    self.deduplicated += 1
+
+            if leader:
+                break
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # The leader was cancelled, not this caller: run fn() again, as
+                # the new leader unless another follower got there first
+                if future.cancelled() and not asyncio.current_task().cancelling():
+                    continue
+                raise
+
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._async_calls.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            calls = self.executions + self.deduplicated
+            return {
+                "calls": calls,
+                "executions": self.executions,
+                "deduplicated": self.deduplicated,
+                "dedup_rate": round(self.deduplicated / calls, 4) if calls else 0.0,
+                "in_flight": len(self._calls) + len(self._async_calls),
+            }
+
+
+def stats():
+    """Coalescing stats for every single-flight group"""
+    return {name: group.stats() for name, group in _groups.items()}
+
+
+# Identical BigQuery jobs (same query name and parameters)
+query_flights = SingleFlight("bigquery")
+
+# Whole firm-wide endpoint computations (BigQuery fan-out plus Gemini)
+endpoint_flights = SingleFlight("endpoint")
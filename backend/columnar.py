@@ -0,0 +1,47 @@
+# Columnar (Arrow) query results
+#
+# Large result sets are read page by page as Arrow record batches and turned into
+# response records column by column, instead of materializing one bigquery.Row
+# per result row and converting every field in a Python loop. pyarrow is
+# optional: without it (or with BQ_ARROW_RESULTS=false) callers use the Row path.
+
+import os
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError:
+    pa = None
+    pc = None
+
+ARROW_RESULTS_ENABLED = pa is not None and os.getenv("BQ_ARROW_RESULTS", "true").lower() == "true"
+
+
+def fetch_table(job):
+    """Wait for a query job and read its result pages as one Arrow table"""
+    # An empty result still yields one zero-row batch carrying the schema
+    return pa.Table.from_batches(list(job.result().to_arrow_iterable()))
+
+
+def as_float(column, null_as=0.0):
+    if pa.types.is_decimal(column.type):
+        # NUMERIC arrives as decimal128; going through the decimal string rounds
+        # exactly like float(Decimal) on the Row path, a direct cast can be off by an ulp
+        column = pc.cast(column, pa.string())
+    return pc.fill_null(pc.cast(column, pa.float64()), null_as)
+
+
+def as_int(column, null_as=0):
+    return pc.fill_null(pc.cast(column, pa.int64()), null_as)
+
+
+def as_str(column, null_as=None):
+    column = pc.cast(column, pa.string())
+    return column if null_as is None else pc.fill_null(column, null_as)
+
+
+def to_records(columns):
+    """Zip a dict of output key -> Arrow column into a list of JSON-ready dicts"""
+    keys = list(columns)
+    values = [columns[key].to_pylist() for key in keys]
+    return [dict(zip(keys, row)) for row in zip(*values)]
@@ -0,0 +1,9 @@
+# Shared backend configuration read from the environment
+
+import os
+
+project_id = os.getenv("PROJECT_ID", "apialchemists-1-47b9")
+dataset_name = os.getenv("DATASET_NAME", "apialchemists")
+location = os.getenv("LOCATION", "us-central1")
+# Local stand-ins for Gemini and BigQuery instead of the real services (backend/fakes.py)
+fake_backends = os.getenv("FAKE_BACKENDS", "false").lower() == "true"
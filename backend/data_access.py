@@ -0,0 +1,340 @@
+# Shared BigQuery data-access layer
+# One process-wide client backed by a pooled, keep-alive HTTP session.
+# Endpoints run named queries from backend.queries through run_named() and
+# run_queries() instead of building bigquery.Client per request; async
+# endpoints use the *_async variants, which wait on jobs without a thread. With
+# LOCAL_ENGINE set, reads are answered from the embedded local mirror
+# (backend/local_engine.py) when it can run them. With FAKE_BACKENDS=true every
+# uncached query also waits an injected latency (backend/fakes.py). The
+# BigQuery SDK is imported on first use, keeping it off the cold-start path.
+
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+from backend import columnar, fakes, local_engine, queries, telemetry
+from backend.cache import QUERY_CACHE_ENABLED, query_cache
+from backend.coalesce import query_flights
+from backend.config import dataset_name, project_id
+
+# Max keep-alive connections held open to the BigQuery API
+BQ_POOL_SIZE = int(os.getenv("BQ_POOL_SIZE", "20"))
+# Seconds between job status polls for async callers, doubling up to the max
+BQ_ASYNC_POLL_MIN = float(os.getenv("BQ_ASYNC_POLL_MIN", "0.05"))
+BQ_ASYNC_POLL_MAX = float(os.getenv("BQ_ASYNC_POLL_MAX", "1.0"))
+# Pooled connections opened to the BigQuery API by the startup warmup
+BQ_WARM_CONNECTIONS = int(os.getenv("BQ_WARM_CONNECTIONS", "4"))
+
+_client = None
+_session = None
+_client_lock = threading.Lock()
+_executor = None
+_invalidation_listeners = []
+
+
+def _build_http_session(pool_size):
+    """Authorized requests session with a connection pool sized for concurrent jobs"""
+    import google.auth
+    from google.auth.transport.requests import AuthorizedSession
+    from google.cloud import bigquery
+    from requests.adapters import HTTPAdapter
+
+    credentials, _ = google.auth.default(scopes=bigquery.Client.SCOPE)
+    session = AuthorizedSession(credentials)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_client():
+    """Return the shared BigQuery client, creating it on first use"""
+    global _client, _session
+    if _client is not None:
+        return _client
+    with _client_lock:
+        if _client is None:
+            from google.cloud import bigquery
+            _session = _build_http_session(BQ_POOL_SIZE)
+            _client = bigquery.Client(project=project_id, _http=_session)
+            print(f"BigQuery client initialized for project: {project_id} (pool size {BQ_POOL_SIZE})")
+    return _client
+
+
+def authenticate():
+    """Create the shared client and fetch its first access token now rather than
+    on the first query"""
+    from google.auth.transport.requests import Request
+    get_client()
+    _session.credentials.refresh(Request())
+
+
+def warm_connections(count=BQ_WARM_CONNECTIONS):
+    """Open count keep-alive connections in the client's pool with concurrent
+    dataset reads, so the first queries skip the TCP and TLS handshakes"""
+    client = get_client()
+    dataset = f"{project_id}.{dataset_name}"
+    list(_get_executor().map(lambda _: client.get_dataset(dataset), range(count)))
+    return count
+
+
+def _get_executor():
+    """Worker threads used to submit and wait on query jobs in parallel"""
+    global _executor
+    if _executor is None:
+        with _client_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=BQ_POOL_SIZE, thread_name_prefix="bq-query")
+    return _executor
+
+
+def _bind(query, params):
+    """Values for the parameters the query declares, ignoring any others"""
+    params = params or {}
+    return {name: params.get(name) for name in query.params}
+
+
+def _cache_key(name, bound, result_format="rows"):
+    """Hashable (query name, parameters, format) key shared by the cache and single-flight"""
+    return (name, tuple(sorted(
+        (param, tuple(value) if isinstance(value, list) else value)
+        for param, value in bound.items()
+    )), result_format)
+
+
+def _job_config(query, bound, endpoint):
+    """Bind the query's declared parameters and tag the job for cost attribution"""
+    from google.cloud import bigquery
+    return bigquery.QueryJobConfig(
+        query_parameters=[_query_parameter(name, query.params[name], value) for name, value in bound.items()],
+        labels={"endpoint": endpoint or "unknown", "query": query.name},
+    )
+
+
+def _query_parameter(name, param_type, value):
+    from google.cloud import bigquery
+    if param_type.startswith("ARRAY<"):
+        return bigquery.ArrayQueryParameter(name, param_type[len("ARRAY<"):-1], list(value or []))
+    return bigquery.ScalarQueryParameter(name, param_type, value)
+
+
+def _prepare(name, params, result_format):
+    """(query, bound parameters, cache key, whether results are cached)"""
+    query = queries.get(name)
+    bound = _bind(query, params)
+    return query, bound, _cache_key(name, bound, result_format), QUERY_CACHE_ENABLED and query.cache_ttl
+
+
+def _cached(name, key, endpoint):
+    """(True, result) for a fresh result-cache entry, else (False, None)"""
+    started = time.perf_counter()
+    hit, result = query_cache.get(key)
+    if hit:
+        telemetry.record_query(name, endpoint, "result_cache", time.perf_counter() - started, result)
+    return hit, result
+
+
+def _finish(query, key, use_cache, endpoint, started, result, job):
+    source = "local" if job is None else "bigquery"
+    telemetry.record_query(query.name, endpoint, source, time.perf_counter() - started, result, job)
+    if use_cache:
+        query_cache.set(key, result, query.cache_ttl)
+    return result
+
+
+def _run(name, params, endpoint, fetch, result_format):
+    query, bound, key, use_cache = _prepare(name, params, result_format)
+    if use_cache:
+        hit, result = _cached(name, key, endpoint)
+        if hit:
+            return result
+
+    def execute():
+        started = time.perf_counter()
+        job = None
+        try:
+            if fakes.ENABLED:
+                fakes.before_query(name)
+            result = local_engine.try_run(query, bound, result_format)
+            if result is None:
+                job = get_client().query(query.sql, job_config=_job_config(query, bound, endpoint))
+                result = fetch(job)
+        except Exception:
+            telemetry.record_query_error(name, endpoint)
+            raise
+        return _finish(query, key, use_cache, endpoint, started, result, job)
+
+    return query_flights.do(key, execute)
+
+
+async def _wait_for_job(job, loop, executor):
+    """Poll the job until it finishes, sleeping on the event loop between polls"""
+    delay = BQ_ASYNC_POLL_MIN
+    while not await loop.run_in_executor(executor, job.done):
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, BQ_ASYNC_POLL_MAX)
+
+
+async def _arun(name, params, endpoint, fetch, result_format):
+    """_run for async callers: a cache hit never leaves the event loop, and a
+    BigQuery job holds a query worker only to submit, poll and fetch it"""
+    query, bound, key, use_cache = _prepare(name, params, result_format)
+    if use_cache:
+        hit, result = _cached(name, key, endpoint)
+        if hit:
+            return result
+
+    async def execute():
+        loop = asyncio.get_running_loop()
+        executor = _get_executor()
+        started = time.perf_counter()
+        job = None
+        try:
+            if fakes.ENABLED:
+                await fakes.abefore_query(name)
+            result = None
+            if local_engine.ENABLED:
+                result = await loop.run_in_executor(executor, local_engine.try_run, query, bound, result_format)
+            if result is None:
+                job = await loop.run_in_executor(
+                    executor, lambda: get_client().query(query.sql, job_config=_job_config(query, bound, endpoint))
+                )
+                await _wait_for_job(job, loop, executor)
+                result = await loop.run_in_executor(executor, fetch, job)
+        except Exception:
+            telemetry.record_query_error(name, endpoint)
+            raise
+        return _finish(query, key, use_cache, endpoint, started, result, job)
+
+    return await query_flights.ado(key, execute)
+
+
+def run_named(name, params=None, endpoint=None):
+    """Run a registered query with bound parameters and return its rows as a list.
+
+    Queries registered with a cache_ttl are answered from the in-process result
+    cache while their entry is fresh. Concurrent identical calls share one job.
+    """
+    return _run(name, params, endpoint, lambda job: list(job.result()), "rows")
+
+
+def run_named_table(name, params=None, endpoint=None):
+    """Like run_named, but returns the result as a pyarrow.Table read page by page
+    as record batches (requires pyarrow, see backend/columnar.py)"""
+    return _run(name, params, endpoint, columnar.fetch_table, "arrow")
+
+
+def invalidate_cache(name=None, **params):
+    """Drop cached results, e.g. after new data is ingested.
+
+    invalidate_cache() clears everything, invalidate_cache(advisor_id="ADV001")
+    only that advisor's entries, invalidate_cache("chat_clients") one query.
+    """
+    removed = query_cache.invalidate(name, **params)
+    print(f"Query cache invalidated: {removed} entries (query={name}, filters={params})")
+    for listener in _invalidation_listeners:
+        try:
+            listener(name, params)
+        except Exception as e:
+            print(f"Cache invalidation listener error: {e}")
+    return removed
+
+
+def on_invalidate(listener):
+    """Call listener(name, params) whenever cached results are invalidated"""
+    _invalidation_listeners.append(listener)
+
+
+def cache_stats():
+    return query_cache.stats()
+
+
+def run_queries(names, params=None, endpoint=None):
+    """Run independent registered queries concurrently.
+
+    Every job is submitted at once with the same parameter values (each query
+    binds only the ones it declares). Returns a dict of query name -> rows, so
+    total latency is roughly that of the slowest query.
+    """
+    executor = _get_executor()
+    futures = {name: executor.submit(run_named, name, params, endpoint) for name in names}
+    return {name: future.result() for name, future in futures.items()}
+
+
+def run_sections_query(name, params=None, endpoint=None):
+    """Run a fused query whose single row holds one ARRAY<STRUCT> column per section.
+
+    Returns a dict of section name -> list of rows with attribute access, so callers
+    can treat each section like the result of its own query.
+    """
+    return _sections(run_named(name, params, endpoint))
+
+
+def _sections(rows):
+    if not rows:
+        return {}
+    return {
+        section: [SimpleNamespace(**item) for item in (items or [])]
+        for section, items in rows[0].items()
+    }
+
+
+async def run_named_async(name, params=None, endpoint=None):
+    """Awaitable run_named. While the job runs the request holds no thread, so
+    one worker can keep far more requests in flight than there are query workers."""
+    return await _arun(name, params, endpoint, lambda job: list(job.result()), "rows")
+
+
+async def run_named_table_async(name, params=None, endpoint=None):
+    """Awaitable run_named_table"""
+    return await _arun(name, params, endpoint, columnar.fetch_table, "arrow")
+
+
+async def run_queries_async(names, params=None, endpoint=None):
+    """Awaitable version of run_queries that keeps the event loop free"""
+    names = list(names)
+    results = await asyncio.gather(*(run_named_async(name, params, endpoint) for name in names))
+    return dict(zip(names, results))
+
+
+async def run_sections_query_async(name, params=None, endpoint=None):
+    """Awaitable run_sections_query"""
+    return _sections(await run_named_async(name, params, endpoint))
+
+
+def ensure_available():
+    """Raise if reads cannot be served: the BigQuery client can't be created and
+    the service isn't running on the offline local engine"""
+    if not local_engine.OFFLINE:
+        get_client()
+
+
+async def ensure_available_async():
+    """ensure_available() for async endpoints; creating the client runs on a worker thread"""
+    if not local_engine.OFFLINE and _client is None:
+        await asyncio.get_running_loop().run_in_executor(None, get_client)
+
+
+def startup():
+    """Load the local mirror at app startup; the shared client is created and
+    authenticated by the warmup (backend/warmup.py), or else on first use"""
+    local_engine.start()
+
+
+def shutdown():
+    """Close the shared client, its pooled connections and the query workers"""
+    global _client, _session, _executor
+    local_engine.stop()
+    with _client_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+            _executor = None
+        if _client is not None:
+            try:
+                _client.close()
+            except Exception as e:
+                print(f"BigQuery client shutdown error: {e}")
+            _client = None
+            _session = None
@@ -0,0 +1,369 @@
+# Local stand-ins for Gemini and BigQuery
+#
+# With FAKE_BACKENDS=true the service runs with no network and no credentials,
+# so main.py's endpoints can be load-tested on a laptop:
+#   - backend/llm.py builds FakeGenerativeModel handles instead of Vertex AI
+#     ones, so the SDK is never imported or initialized. Responses are scripted:
+#     the first rule whose pattern occurs in the prompt wins (FAKE_LLM_SCRIPT may
+#     point to a JSON list of {"match": ..., "text": ...} rules tried before the
+#     built-in ones). The text is the same for the same prompt on every run.
+#   - the local engine runs offline (backend/local_engine.py) over fixture CSVs
+#     for the db_schema.txt tables, generated deterministically from FAKE_SEED
+#     into LOCAL_ENGINE_DATA_DIR when that directory has none. Queries the local
+#     engine cannot run fail the way they would without BigQuery access.
+#   - every model call and every query that is not answered from the result
+#     cache waits an injected latency and fails at an injected error rate. The
+#     latency is a fixed base plus an exponential tail, so percentiles look like
+#     a real service rather than a constant.
+#
+#   FAKE_LLM_LATENCY_MS / FAKE_LLM_JITTER_MS / FAKE_LLM_ERROR_RATE
+#   FAKE_QUERY_LATENCY_MS / FAKE_QUERY_JITTER_MS / FAKE_QUERY_ERROR_RATE
+#
+# Write the fixtures without starting the service with
+#   python -m backend.fakes [data_dir]
+
+import asyncio
+import csv
+import datetime
+import json
+import os
+import random
+import sys
+import threading
+import time
+from types import SimpleNamespace
+
+from backend.config import fake_backends
+
+ENABLED = fake_backends
+FAKE_SEED = int(os.getenv("FAKE_SEED", "42"))
+FAKE_LLM_LATENCY_MS = float(os.getenv("FAKE_LLM_LATENCY_MS", "800"))
+FAKE_LLM_JITTER_MS = float(os.getenv("FAKE_LLM_JITTER_MS", "200"))
+FAKE_LLM_ERROR_RATE = float(os.getenv("FAKE_LLM_ERROR_RATE", "0"))
+# Delay between streamed chunks after the first
+FAKE_LLM_CHUNK_MS = float(os.getenv("FAKE_LLM_CHUNK_MS", "20"))
+FAKE_LLM_SCRIPT = os.getenv("FAKE_LLM_SCRIPT", "")
+FAKE_QUERY_LATENCY_MS = float(os.getenv("FAKE_QUERY_LATENCY_MS", "150"))
+FAKE_QUERY_JITTER_MS = float(os.getenv("FAKE_QUERY_JITTER_MS", "50"))
+FAKE_QUERY_ERROR_RATE = float(os.getenv("FAKE_QUERY_ERROR_RATE", "0"))
+
+FAKE_FIXTURE_ADVISORS = int(os.getenv("FAKE_FIXTURE_ADVISORS", "5"))
+FAKE_FIXTURE_CLIENTS_PER_ADVISOR = int(os.getenv("FAKE_FIXTURE_CLIENTS_PER_ADVISOR", "20"))
+
+_rng = random.Random(FAKE_SEED)
+_rng_lock = threading.Lock()
+_rules = None
+
+
+# ---------------------------------------------------------------------------
+# Latency and error injection
+# ---------------------------------------------------------------------------
+
+def _draw(latency_ms, jitter_ms, error_rate):
+    """(seconds to wait, whether to fail) from the shared seeded generator"""
+    with _rng_lock:
+        tail = _rng.expovariate(1 / jitter_ms) if jitter_ms > 0 else 0.0
+        failed = error_rate > 0 and _rng.random() < error_rate
+    return (latency_ms + tail) / 1000, failed
+
+
+def _unavailable(message):
+    """The error the real clients raise for a 503"""
+    from google.api_core import exceptions
+    return exceptions.ServiceUnavailable(message)
+
+
+def before_query(name):
+    """Wait like a BigQuery job would, then maybe fail like one"""
+    delay, failed = _draw(FAKE_QUERY_LATENCY_MS, FAKE_QUERY_JITTER_MS, FAKE_QUERY_ERROR_RATE)
+    time.sleep(delay)
+    if failed:
+        raise _unavailable(f"Injected query failure for {name}")
+
+
+async def abefore_query(name):
+    """before_query() for the async data path: waits on the event loop"""
+    delay, failed = _draw(FAKE_QUERY_LATENCY_MS, FAKE_QUERY_JITTER_MS, FAKE_QUERY_ERROR_RATE)
+    await asyncio.sleep(delay)
+    if failed:
+        raise _unavailable(f"Injected query failure for {name}")
+
+
+# ---------------------------------------------------------------------------
+# Gemini
+# ---------------------------------------------------------------------------
+
+_NBA_ACTIONS = [
+    {"action": "Schedule a portfolio review to rebalance toward the target allocation",
+     "rationale": "Equity drift has pushed risk above the stated tolerance",
+     "expected_outcome": "Allocation back within policy bands", "priority": "High", "timeline": "2 weeks"},
+    {"action": "Review cash balances for a short-duration treasury ladder",
+     "rationale": "Recent deposits are sitting in low-yield cash",
+     "expected_outcome": "Higher yield on idle cash", "priority": "Medium", "timeline": "1 month"},
+    {"action": "Discuss estate planning and beneficiary updates",
+     "rationale": "No estate review recorded in the last year",
+     "expected_outcome": "Documents current for the next review", "priority": "Low", "timeline": "Next quarter"},
+]
+
+# (pattern, response) tried in order; the last rule matches everything
+DEFAULT_RULES = [
+    ('"action", "rationale"', json.dumps(_NBA_ACTIONS)),
+    ("Parse this meeting request",
+     "Title: Client portfolio review\nDescription: Quarterly review of performance and allocation\nDuration: 60"),
+    ("Return a numbered list",
+     "1. Call high-priority clients about rebalancing\n2. Prepare quarterly review packs\n"
+     "3. Follow up on pending account openings\n4. Update compliance documentation"),
+    ("Suggest 3 next best actions",
+     "- Review portfolio allocation for clients with recent large transactions\n"
+     "- Reach out to clients with cash above target levels\n"
+     "- Schedule annual reviews for clients not contacted this quarter"),
+    ("Excerpt:", "Key facts from this section: revenue grew 4.2%, two decisions were recorded and one action "
+                 "item was assigned to the advisor."),
+    ("dashboard insights",
+     "1. Book AUM up 3.1% this quarter\n2. Equity concentration above target in 4 portfolios\n"
+     "3. Fixed income opportunity for conservative clients\n4. Schedule reviews for 6 clients"),
+    ("", "1. Portfolio performance is tracking ahead of benchmark.\n2. Concentration risk is highest in equities.\n"
+         "3. Several clients hold excess cash suited to fixed income.\n4. Prioritize reviews for the largest accounts."),
+]
+
+
+def _load_rules():
+    global _rules
+    if _rules is None:
+        rules = []
+        if FAKE_LLM_SCRIPT:
+            try:
+                with open(FAKE_LLM_SCRIPT) as f:
+                    rules = [(rule["match"], rule["text"]) for rule in json.load(f)]
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Fake LLM script error, using built-in responses: {e}")
+        _rules = rules + DEFAULT_RULES
+    return _rules
+
+
+def scripted_text(prompt):
+    for pattern, text in _load_rules():
+        if pattern in prompt:
+            return text
+    return ""
+
+
+class FakeResponse:
+    """The parts of a Vertex AI GenerationResponse the backend reads"""
+
+    def __init__(self, text, prompt_tokens=0):
+        self.text = text
+        self.usage_metadata = SimpleNamespace(
+            prompt_token_count=prompt_tokens,
+            candidates_token_count=len(text) // 4,
+            total_token_count=prompt_tokens + len(text) // 4,
+        )
+
+
+class FakeGenerativeModel:
+    """Drop-in for vertexai GenerativeModel with scripted responses and injected latency/errors"""
+
+    def __init__(self, model_name, system_instruction=None, **kwargs):
+        self.model_name = model_name
+        self.system_instruction = system_instruction
+
+    def _prompt_text(self, contents):
+        if isinstance(contents, str):
+            return contents
+        return "\n".join(str(part) for part in contents)
+
+    def generate_content(self, contents, stream=False, **kwargs):
+        prompt = self._prompt_text(contents)
+        delay, failed = _draw(FAKE_LLM_LATENCY_MS, FAKE_LLM_JITTER_MS, FAKE_LLM_ERROR_RATE)
+        prompt_tokens = (len(prompt) + len(self.system_instruction or "")) // 4
+        text = scripted_text(prompt)
+        if stream:
+            return self._stream(text, prompt_tokens, delay, failed)
+        time.sleep(delay)
+        if failed:
+            raise _unavailable(f"Injected failure for {self.model_name}")
+        return FakeResponse(text, prompt_tokens)
+
+    async def generate_content_async(self, contents, **kwargs):
+        prompt = self._prompt_text(contents)
+        delay, failed = _draw(FAKE_LLM_LATENCY_MS, FAKE_LLM_JITTER_MS, FAKE_LLM_ERROR_RATE)
+        await asyncio.sleep(delay)
+        if failed:
+            raise _unavailable(f"Injected failure for {self.model_name}")
+        return FakeResponse(scripted_text(prompt), (len(prompt) + len(self.system_instruction or "")) // 4)
+
+    def _stream(self, text, prompt_tokens, delay, failed):
+        time.sleep(delay)
+        if failed:
+            raise _unavailable(f"Injected failure for {self.model_name}")
+        words = text.split(" ")
+        for start in range(0, len(words), 8):
+            if start:
+                time.sleep(FAKE_LLM_CHUNK_MS / 1000)
+            last = start + 8 >= len(words)
+            chunk = " ".join(words[start:start + 8]) + ("" if last else " ")
+            response = FakeResponse(chunk, prompt_tokens)
+            if not last:
+                response.usage_metadata = None
+            yield response
+
+
+# ---------------------------------------------------------------------------
+# Fixtures for the local engine
+# ---------------------------------------------------------------------------
+
+FIRST_NAMES = ["Olivia", "James", "Amelia", "Henry", "Sophia", "Lucas", "Isla", "Arthur", "Maya", "Theo"]
+LAST_NAMES = ["Whitmore", "Chen", "Okafor", "Lindqvist", "Moreau", "Patel", "Harrington", "Silva", "Novak", "Reyes"]
+CITIES = ["New York", "London", "Zurich", "Singapore", "Hong Kong", "Geneva"]
+ASSET_CLASSES = [
+    ("Equity", [("AAPL", "Technology"), ("MSFT", "Technology"), ("JNJ", "Healthcare"), ("JPM", "Financials")]),
+    ("Fixed Income", [("UST10", "Government"), ("LQD", "Corporate")]),
+    ("Real Estate", [("VNQ", "Real Estate")]),
+    ("Alternatives", [("GLD", "Commodities"), ("PE-FUND-II", "Private Equity")]),
+    ("Cash", [("USD", "Cash")]),
+]
+CATEGORIES = ["Deposit", "Withdrawal", "Buy", "Sell", "Dividend", "Fee", "Transfer"]
+TASKS = [
+    "Review portfolio rebalancing for {client}",
+    "Prepare quarterly review pack for {client}",
+    "Follow up on account opening documents for {client}",
+    "Call {client} about maturing bonds",
+    "Update risk questionnaire for {client}",
+    "Send market outlook to {client}",
+]
+
+
+def _fixture_tables(seed, advisors, clients_per_advisor, today):
+    """table -> list of row dicts; the same arguments always give the same rows"""
+    rng = random.Random(seed)
+    tables = {name: [] for name in
+              ("advisors", "clients", "accounts", "holdings", "transactions", "todo_tasks", "client_interactions")}
+
+    def day(max_days_ago):
+        return (today - datetime.timedelta(days=rng.randint(0, max_days_ago))).isoformat()
+
+    client_number = account_number = holding_number = transaction_number = interaction_number = 0
+    for a in range(1, advisors + 1):
+        advisor_id = f"ADV{a:03d}"
+        advisor_name = f"{FIRST_NAMES[a % len(FIRST_NAMES)]} {LAST_NAMES[(a * 3) % len(LAST_NAMES)]}"
+        tables["advisors"].append({
+            "advisor_id": advisor_id,
+            "name": advisor_name,
+            "email": f"{advisor_name.lower().replace(' ', '.')}@privatebank.example",
+            "specialization": rng.choice(["Wealth Planning", "Investments", "Estate Planning"]),
+            "years_experience": rng.randint(3, 25),
+            "location": rng.choice(CITIES),
+        })
+        advisor_clients = []
+        for _ in range(clients_per_advisor):
+            client_number += 1
+            client_id = f"CLI{client_number:04d}"
+            name = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+            advisor_clients.append((client_id, name))
+            tables["clients"].append({
+                "client_id": client_id,
+                "name": name,
+                "email": f"{name.lower().replace(' ', '.')}{client_number}@example.com",
+                "phone": f"+1-555-{rng.randint(100, 999)}-{rng.randint(1000, 9999)}",
+                "advisor_id": advisor_id,
+                "client_tier": rng.choice(["Platinum", "Gold", "Silver"]),
+                "net_worth": rng.randint(1, 50) * 1_000_000,
+                "risk_tolerance": rng.choice(["Conservative", "Moderate", "Aggressive"]),
+                "investment_objective": rng.choice(["Growth", "Income", "Capital Preservation", "Balanced"]),
+                "location": rng.choice(CITIES),
+                "onboarding_date": day(3650),
+            })
+            for _ in range(rng.randint(1, 3)):
+                account_number += 1
+                account_id = f"ACC{account_number:05d}"
+                tables["accounts"].append({
+                    "account_id": account_id,
+                    "client_id": client_id,
+                    "bank_name": rng.choice(["Private Bank", "Custody Partner", "Trust Company"]),
+                    "account_type": rng.choice(["Brokerage", "Checking", "Trust", "IRA"]),
+                    "opened_date": day(3650),
+                })
+                for _ in range(rng.randint(4, 12)):
+                    transaction_number += 1
+                    tables["transactions"].append({
+                        "transaction_id": f"TXN{transaction_number:06d}",
+                        "account_id": account_id,
+                        "date": day(365),
+                        "amount": round(rng.uniform(500, 250_000), 2),
+                        "category": rng.choice(CATEGORIES),
+                    })
+            for _ in range(rng.randint(3, 8)):
+                holding_number += 1
+                asset_class, instruments = rng.choice(ASSET_CLASSES)
+                symbol, sector = rng.choice(instruments)
+                quantity = rng.randint(10, 5000)
+                current_price = round(rng.uniform(20, 600), 2)
+                tables["holdings"].append({
+                    "holding_id": f"HLD{holding_number:06d}",
+                    "client_id": client_id,
+                    "asset_class": asset_class,
+                    "value": round(quantity * current_price, 2),
+                    "symbol": symbol,
+                    "sector": sector,
+                    "quantity": quantity,
+                    "current_price": current_price,
+                    "purchase_price": round(current_price * rng.uniform(0.6, 1.3), 2),
+                })
+            for _ in range(rng.randint(0, 4)):
+                interaction_number += 1
+                tables["client_interactions"].append({
+                    "interaction_id": f"INT{interaction_number:06d}",
+                    "client_id": client_id,
+                    "date": day(180),
+                    "interaction_type": rng.choice(["Call", "Meeting", "Email"]),
+                })
+        for priority, template in enumerate(rng.sample(TASKS, len(TASKS)), start=1):
+            client_id, name = rng.choice(advisor_clients)
+            tables["todo_tasks"].append({
+                "task": template.format(client=name),
+                "priority": priority,
+                "advisor_id": advisor_id,
+                "client_id": client_id,
+            })
+    return tables
+
+
+def write_fixtures(data_dir, seed=FAKE_SEED, advisors=FAKE_FIXTURE_ADVISORS,
+                   clients_per_advisor=FAKE_FIXTURE_CLIENTS_PER_ADVISOR, today=None):
+    """Write one <table>.csv per mirrored table into data_dir and return the row counts.
+
+    Dates are relative to today, so the recent-activity queries always find rows.
+    """
+    tables = _fixture_tables(seed, advisors, clients_per_advisor, today or datetime.date.today())
+    os.makedirs(data_dir, exist_ok=True)
+    for table, rows in tables.items():
+        with open(os.path.join(data_dir, f"{table}.csv"), "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+    return {table: len(rows) for table, rows in tables.items()}
+
+
+def ensure_fixtures(data_dir):
+    """Generate the fixtures unless data_dir already holds table files"""
+    if os.path.isdir(data_dir) and any(name.endswith(".csv") for name in os.listdir(data_dir)):
+        return None
+    counts = write_fixtures(data_dir)
+    print(f"Fake fixtures written to {data_dir}: {counts}")
+    return counts
+
+
+def stats():
+    return {
+        "enabled": ENABLED,
+        "seed": FAKE_SEED,
+        "llm": {"latency_ms": FAKE_LLM_LATENCY_MS, "jitter_ms": FAKE_LLM_JITTER_MS, "error_rate": FAKE_LLM_ERROR_RATE},
+        "query": {"latency_ms": FAKE_QUERY_LATENCY_MS, "jitter_ms": FAKE_QUERY_JITTER_MS,
+                  "error_rate": FAKE_QUERY_ERROR_RATE},
+    }
+
+
+if __name__ == "__main__":
+    # python -m backend.fakes [data_dir]
+    target = sys.argv[1] if len(sys.argv) > 1 else os.getenv("LOCAL_ENGINE_DATA_DIR", "local_data")
+    print(write_fixtures(target))
@@ -0,0 +1,262 @@
+# Stale-while-revalidate store for Gemini dashboard insights
+#
+# /ai-insights, /dashboard-metrics and /aggregation read their insight text from
+# here instead of calling Gemini on the request path. A request gets the last
+# good value straight away together with its age; once an entry is older than
+# INSIGHTS_MAX_AGE_SECONDS, or the data behind it changed (any query-cache
+# invalidation: local mirror reload, snapshot refresh, ingest), it is marked
+# stale and regenerated in the background. A refresher thread also regenerates
+# every known entry each INSIGHTS_REFRESH_SECONDS so readers rarely see stale
+# text at all. Only the first request for a scope waits on generation.
+#
+# Builders are registered per kind and called as builder(scope); they raise when
+# they cannot produce insights, which keeps the previous value in place. Each
+# kind also names the queries it reads, so invalidating an unrelated query
+# doesn't regenerate it.
+
+import asyncio
+import datetime
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from backend import coalesce, data_access, telemetry
+
+INSIGHTS_MAX_AGE_SECONDS = int(os.getenv("INSIGHTS_MAX_AGE_SECONDS", "600"))
+INSIGHTS_REFRESH_SECONDS = int(os.getenv("INSIGHTS_REFRESH_SECONDS", "900"))
+# After a failed refresh, wait this long before trying that entry again
+INSIGHTS_RETRY_SECONDS = int(os.getenv("INSIGHTS_RETRY_SECONDS", "60"))
+# Per-advisor entries nobody has read for this long are dropped instead of refreshed
+INSIGHTS_IDLE_SECONDS = int(os.getenv("INSIGHTS_IDLE_SECONDS", str(24 * 3600)))
+INSIGHTS_REFRESH_WORKERS = int(os.getenv("INSIGHTS_REFRESH_WORKERS", "4"))
+
+FIRM = "firm"
+
+_builders = {}
+_queries = {}  # kind -> names of the queries its builder reads
+_entries = {}  # (kind, scope) -> _Entry
+_lock = threading.Lock()
+_executor = None
+_stop = threading.Event()
+_flights = coalesce.SingleFlight("insights")
+
+
+class _Entry:
+    def __init__(self, kind, scope):
+        self.kind = kind
+        self.scope = scope
+        self.value = None
+        self.generated_at = None  # wall-clock time of the last good value
+        self.stale = True
+        self.changes = 0  # bumped by mark_stale, so a change during a refresh is not lost
+        self.refreshing = False
+        self.last_error = None
+        self.retry_at = 0.0
+        self.last_read = time.time()
+
+    def age(self):
+        return time.time() - self.generated_at if self.generated_at else None
+
+    def freshness(self):
+        """Age metadata returned alongside the insights"""
+        return {
+            "generated_at": datetime.datetime.fromtimestamp(self.generated_at, datetime.timezone.utc).isoformat(),
+            "age_seconds": round(self.age(), 1),
+            "stale": self.stale,
+            "refreshing": self.refreshing,
+        }
+
+
+class Insights:
+    """A value from the store plus the freshness of that value"""
+
+    def __init__(self, value, freshness):
+        self.value = value
+        self.freshness = freshness
+
+
+def register(kind, builder, queries):
+    """Register builder(scope) as the generator for one kind of insight, which
+    reads the named queries"""
+    _builders[kind] = builder
+    _queries[kind] = set(queries)
+
+
+def get(kind, scope=FIRM):
+    """Last good insights for (kind, scope), scheduling a refresh when stale.
+
+    The first call for a scope generates inline (concurrent first calls share
+    one generation) and raises if that fails, so the caller can fall back.
+    """
+    key = (kind, scope)
+    with _lock:
+        entry = _entries.get(key)
+        if entry is None:
+            entry = _entries[key] = _Entry(kind, scope)
+        entry.last_read = time.time()
+        if entry.generated_at is not None:
+            if entry.age() > INSIGHTS_MAX_AGE_SECONDS:
+                entry.stale = True
+            state = "stale" if entry.stale else "fresh"
+            result = Insights(entry.value, entry.freshness())
+        else:
+            state = "cold"
+            result = None
+    telemetry.record_insights_read(kind, state)
+
+    if result is None:
+        _flights.do(key, lambda: _refresh(entry))
+        if entry.generated_at is None:
+            raise RuntimeError(entry.last_error or f"No {kind} insights for {scope}")
+        return Insights(entry.value, entry.freshness())
+    if state == "stale":
+        _schedule(entry)
+        with _lock:
+            result.freshness = entry.freshness()
+    return result
+
+
+async def aget(kind, scope=FIRM):
+    """get() for async endpoints: a stored value returns straight away, a first
+    generation runs on a worker thread"""
+    with _lock:
+        entry = _entries.get((kind, scope))
+        cold = entry is None or entry.generated_at is None
+    if not cold:
+        return get(kind, scope)
+    return await asyncio.get_running_loop().run_in_executor(None, get, kind, scope)
+
+
+def mark_stale(kind=None, advisor_id=None):
+    """Flag entries as stale after a data change and regenerate them in the background.
+
+    advisor_id limits per-advisor entries to that advisor; firm-wide entries
+    always cover it, so they are included either way.
+    """
+    with _lock:
+        doomed = [
+            entry for entry in _entries.values()
+            if (kind is None or entry.kind == kind)
+            and (advisor_id is None or entry.scope == FIRM or _advisor_of(entry.scope) == advisor_id)
+        ]
+        for entry in doomed:
+            entry.stale = True
+            entry.changes += 1
+            entry.retry_at = 0.0
+    for entry in doomed:
+        if entry.generated_at is not None:
+            _schedule(entry)
+    return len(doomed)
+
+
+def _advisor_of(scope):
+    return scope[0] if isinstance(scope, tuple) else scope
+
+
+def _on_data_change(name, params):
+    """Mark the kinds that read the invalidated query stale; name None means every query"""
+    for kind, queries in _queries.items():
+        if name is None or name in queries:
+            mark_stale(kind, advisor_id=params.get("advisor_id"))
+
+
+def _executor_pool():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=INSIGHTS_REFRESH_WORKERS, thread_name_prefix="insights")
+        return _executor
+
+
+def _schedule(entry):
+    """Start a background refresh unless one is running or the entry is backing off"""
+    with _lock:
+        if entry.refreshing or time.monotonic() < entry.retry_at:
+            return
+        entry.refreshing = True
+    try:
+        _executor_pool().submit(_flights.do, (entry.kind, entry.scope), lambda: _refresh(entry))
+    except RuntimeError:
+        # Executor shut down
+        with _lock:
+            entry.refreshing = False
+
+
+def _refresh(entry):
+    builder = _builders[entry.kind]
+    with _lock:
+        entry.refreshing = True
+        changes = entry.changes
+    started = time.perf_counter()
+    try:
+        value = builder(entry.scope)
+    except Exception as e:
+        print(f"Insights refresh error for {entry.kind} ({entry.scope}): {e}")
+        with _lock:
+            entry.last_error = str(e)
+            entry.retry_at = time.monotonic() + INSIGHTS_RETRY_SECONDS
+            entry.refreshing = False
+        telemetry.record_insights_refresh(entry.kind, "error", time.perf_counter() - started)
+        return
+    with _lock:
+        entry.value = value
+        entry.generated_at = time.time()
+        entry.stale = entry.changes != changes
+        entry.last_error = None
+        entry.retry_at = 0.0
+        entry.refreshing = False
+    telemetry.record_insights_refresh(entry.kind, "ok", time.perf_counter() - started)
+
+
+def _refresh_loop():
+    while not _stop.wait(INSIGHTS_REFRESH_SECONDS):
+        now = time.time()
+        with _lock:
+            for key, entry in list(_entries.items()):
+                if entry.scope != FIRM and now - entry.last_read > INSIGHTS_IDLE_SECONDS:
+                    del _entries[key]
+            entries = list(_entries.values())
+        for entry in entries:
+            _schedule(entry)
+
+
+def start(warm=()):
+    """Start the scheduled refresher and generate the firm-wide kinds in warm"""
+    _stop.clear()
+    for kind in warm:
+        with _lock:
+            entry = _entries.setdefault((kind, FIRM), _Entry(kind, FIRM))
+        _schedule(entry)
+    threading.Thread(target=_refresh_loop, name="insights-refresh", daemon=True).start()
+
+
+def stop():
+    global _executor
+    _stop.set()
+    with _lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+            _executor = None
+
+
+def stats():
+    with _lock:
+        return {
+            "max_age_seconds": INSIGHTS_MAX_AGE_SECONDS,
+            "refresh_seconds": INSIGHTS_REFRESH_SECONDS,
+            "entries": [
+                {
+                    "kind": entry.kind,
+                    "scope": "/".join(s for s in entry.scope if s) if isinstance(entry.scope, tuple) else entry.scope,
+                    "age_seconds": round(entry.age(), 1) if entry.generated_at else None,
+                    "stale": entry.stale,
+                    "refreshing": entry.refreshing,
+                    "last_error": entry.last_error,
+                }
+                for entry in _entries.values()
+            ],
+        }
+
+
+data_access.on_invalidate(_on_data_change)
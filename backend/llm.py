@@ -0,0 +1,613 @@
+# Gemini calls
+#
+# Endpoints call generate()/agenerate() (or the *_with_fallback and stream
+# variants) instead of GenerativeModel(...).generate_content() so every model
+# call is timed, its token usage recorded (backend/telemetry.py), repeated
+# prompts answered from a response cache and failing models skipped behind a
+# circuit breaker. With FAKE_BACKENDS=true the handles are scripted local
+# stand-ins (backend/fakes.py).
+
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+from backend import telemetry
+from backend.cache import TTLCache
+from backend.config import fake_backends, location, project_id
+
+if fake_backends:
+    from backend.fakes import FakeGenerativeModel as GenerativeModel
+else:
+    # Resolved by _model_class() on first use: importing the Vertex AI SDK takes
+    # seconds, so it stays off the import path
+    GenerativeModel = None
+
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "512"))
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR", "")
+
+# Response-cache TTL (seconds) per endpoint; override with LLM_CACHE_TTL_<ENDPOINT>,
+# e.g. LLM_CACHE_TTL_AI_INSIGHTS=300. Endpoints not listed are never cached.
+DEFAULT_CACHE_TTLS = {
+    "todo": 900,
+    "nba": 900,
+    "ai-insights": 600,
+    "dashboard-metrics": 600,
+}
+
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "2"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+
+# Chain used by /chat and the /dashboard-metrics insights
+FALLBACK_MODELS = ["gemini-pro", "gemini-1.0-pro"]
+
+# Worker threads for blocking Gemini calls made from async endpoints
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+# Native async Gemini calls in flight per event loop
+LLM_MAX_ASYNC_CONCURRENCY = int(os.getenv("LLM_MAX_ASYNC_CONCURRENCY", "128"))
+
+response_cache = TTLCache(max_entries=LLM_CACHE_MAX_ENTRIES, max_bytes=LLM_CACHE_MAX_BYTES)
+
+_models = {}
+_models_lock = threading.Lock()
+_breakers = {}
+_executor = None
+_async_semaphores = weakref.WeakKeyDictionary()
+
+
+class ModelUnavailable(Exception):
+    """Raised without calling the model while its circuit is open"""
+
+
+class CircuitBreaker:
+    """closed -> open after repeated failures -> half-open probe -> closed or open again"""
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, name, failure_threshold=LLM_BREAKER_FAILURES, cooldown=LLM_BREAKER_COOLDOWN):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """True if a call may go to the model now"""
+        with self._lock:
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.cooldown:
+                self._set_state(self.HALF_OPEN)
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.HALF_OPEN and not self.probing:
+                # Only one probe at a time; everyone else keeps failing fast
+                self.probing = True
+                return True
+            self.rejected += 1
+            telemetry.llm_circuit_rejections.inc(model=self.name)
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.probing = False
+            self._set_state(self.CLOSED)
+
+    def release(self):
+        """The call ended without a verdict (e.g. cancelled): let the next probe through"""
+        with self._lock:
+            self.probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.probing = False
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                self._set_state(self.OPEN)
+
+    def _set_state(self, state):
+        if state != self.state:
+            print(f"Gemini circuit for {self.name}: {self.state} -> {state}")
+        self.state = state
+        telemetry.llm_circuit_state.set(telemetry.CIRCUIT_STATES[state], model=self.name)
+
+    def stats(self):
+        with self._lock:
+            return {"state": self.state, "consecutive_failures": self.failures, "rejected": self.rejected}
+
+
+def _model_class():
+    """GenerativeModel, importing the SDK and initializing Vertex AI the first time"""
+    global GenerativeModel
+    if GenerativeModel is None:
+        with _models_lock:
+            if GenerativeModel is None:
+                import vertexai
+                from vertexai.generative_models import GenerativeModel as model_class
+                vertexai.init(project=project_id, location=location)
+                GenerativeModel = model_class
+    return GenerativeModel
+
+
+def init_sdk():
+    """Import the SDK and initialize Vertex AI now instead of on the first model handle"""
+    _model_class()
+
+
+def warm_models(model_names, system=None):
+    """Create the handles calls to model_names use, bare and with system where the
+    model accepts a system instruction; returns how many handles exist"""
+    for model_name in model_names:
+        get_model(model_name)
+        if system and _supports_system_instruction(model_name):
+            get_model(model_name, system)
+    return len(_models)
+
+
+def get_model(model_name, system=None):
+    """Process-wide GenerativeModel handle for model_name with system as its system instruction.
+
+    Handles are created once per (model, system prompt), so a shared system
+    prompt is set up once per process and every call starts with the same bytes.
+    The first handle imports and initializes the Vertex AI SDK, unless the
+    startup warmup (backend/warmup.py) already has.
+    """
+    key = (model_name, system)
+    model = _models.get(key)
+    if model is None:
+        model_class = _model_class()
+        with _models_lock:
+            model = _models.get(key)
+            if model is None:
+                if system:
+                    model = model_class(model_name, system_instruction=system)
+                else:
+                    model = model_class(model_name)
+                _models[key] = model
+    return model
+
+
+def _supports_system_instruction(model_name):
+    return not (model_name == "gemini-pro" or model_name.startswith("gemini-1.0"))
+
+
+def _parts(prompt):
+    """(system prompt, user text) for a plain string or a prompt_budget.Prompt"""
+    if isinstance(prompt, str):
+        return None, prompt
+    return prompt.system, prompt.text
+
+
+def _handle_and_contents(model_name, prompt):
+    """((model, system) handle key, contents to send) for a prompt"""
+    system, text = _parts(prompt)
+    if system and not _supports_system_instruction(model_name):
+        return (model_name, None), f"{system}\n\n{text}"
+    return (model_name, system), text
+
+
+def _model_and_contents(model_name, prompt):
+    handle, contents = _handle_and_contents(model_name, prompt)
+    return get_model(*handle), contents
+
+
+async def _amodel_and_contents(model_name, prompt):
+    """_model_and_contents() for async callers: an existing handle is a dict read;
+    a new one (maybe importing and initializing the SDK, under _models_lock) is
+    created on a worker thread so the event loop never waits on either"""
+    handle, contents = _handle_and_contents(model_name, prompt)
+    model = _models.get(handle)
+    if model is None:
+        model = await asyncio.get_running_loop().run_in_executor(_executor_pool(), get_model, *handle)
+    return model, contents
+
+
+def _breaker(model_name):
+    """The model's circuit breaker.
+
+    After LLM_BREAKER_FAILURES consecutive errors the model's calls fail fast
+    with ModelUnavailable for LLM_BREAKER_COOLDOWN seconds, then a single probe
+    call decides whether it is back. The *_with_fallback calls skip models with
+    an open circuit, so while a model is down requests go straight to the next.
+    """
+    breaker = _breakers.get(model_name)
+    if breaker is None:
+        with _models_lock:
+            breaker = _breakers.setdefault(model_name, CircuitBreaker(model_name))
+    return breaker
+
+
+class CachedResponse:
+    """Stands in for a GenerationResponse served from the cache"""
+
+    usage_metadata = None
+
+    def __init__(self, text):
+        self.text = text
+
+
+def cache_ttl(endpoint):
+    default = DEFAULT_CACHE_TTLS.get(endpoint, 0)
+    if not endpoint:
+        return default
+    return int(os.getenv(f"LLM_CACHE_TTL_{endpoint.upper().replace('-', '_')}", default))
+
+
+def _normalize(prompt):
+    """Collapse whitespace so indentation changes in prompt templates don't miss the cache"""
+    return " ".join(prompt.split())
+
+
+def cache_key(model_name, prompt):
+    system, text = _parts(prompt)
+    if system:
+        text = f"{system}\0{text}"
+    return hashlib.sha256(f"{model_name}\0{_normalize(text)}".encode("utf-8")).hexdigest()
+
+
+def _disk_path(key):
+    return os.path.join(LLM_CACHE_DIR, f"{key}.json")
+
+
+def _read_disk(key):
+    """(text, seconds left) for a persisted entry, or None if missing or expired"""
+    try:
+        with open(_disk_path(key)) as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+    remaining = entry["expires_at"] - time.time()
+    if remaining <= 0:
+        try:
+            os.remove(_disk_path(key))
+        except OSError:
+            pass
+        return None
+    return entry["text"], remaining
+
+
+def _write_disk(key, model_name, endpoint, text, ttl):
+    try:
+        os.makedirs(LLM_CACHE_DIR, exist_ok=True)
+        path = _disk_path(key)
+        with open(f"{path}.tmp", "w") as f:
+            json.dump({"model": model_name, "endpoint": endpoint, "text": text,
+                       "expires_at": time.time() + ttl}, f)
+        os.replace(f"{path}.tmp", path)
+    except OSError as e:
+        print(f"LLM cache write error: {e}")
+
+
+def _cached_text(key):
+    hit, text = response_cache.get(key)
+    if hit:
+        return text
+    if LLM_CACHE_DIR:
+        persisted = _read_disk(key)
+        if persisted is not None:
+            text, remaining = persisted
+            response_cache.set(key, text, remaining)
+            return text
+    return None
+
+
+def generate(model_name, prompt, endpoint=None):
+    """Run generate_content on model_name and return the response.
+
+    For endpoints with a cache TTL, an identical recent prompt (same model,
+    whitespace-normalized text and system prompt) is answered from the response
+    cache with a CachedResponse (same .text) instead; with LLM_CACHE_DIR set,
+    entries are also persisted there and survive restarts. A prompt_budget.Prompt
+    is sent with its system prompt as the handle's system instruction, or
+    prepended to the text for models without system-instruction support.
+    Raises ModelUnavailable without a model call while the model's circuit is
+    open (see _breaker).
+    """
+    key, ttl, cached = _cache_lookup(model_name, prompt, endpoint)
+    if cached is not None:
+        return cached
+    return _generate_uncached(model_name, prompt, endpoint, key, ttl)
+
+
+def _generate_uncached(model_name, prompt, endpoint, key, ttl):
+    """generate() after a response-cache miss: the model call, stored under key"""
+    breaker = _breaker(model_name)
+    if not breaker.allow():
+        raise ModelUnavailable(f"{model_name} circuit is open after repeated failures")
+    started = time.perf_counter()
+    try:
+        model, contents = _model_and_contents(model_name, prompt)
+        response = model.generate_content(contents)
+    except Exception:
+        breaker.record_failure()
+        telemetry.record_llm_call(model_name, endpoint, time.perf_counter() - started, "error")
+        raise
+    breaker.record_success()
+    telemetry.record_llm_call(model_name, endpoint, time.perf_counter() - started, "ok", response)
+    _cache_store(key, ttl, model_name, endpoint, response)
+    return response
+
+
+def _cache_lookup(model_name, prompt, endpoint):
+    """(cache key, ttl, CachedResponse or None); the key is None for uncached endpoints"""
+    ttl = cache_ttl(endpoint) if LLM_CACHE_ENABLED else 0
+    key = cache_key(model_name, prompt) if ttl else None
+    if key:
+        text = _cached_text(key)
+        telemetry.record_llm_cache(endpoint, text is not None)
+        if text is not None:
+            return key, ttl, CachedResponse(text)
+    return key, ttl, None
+
+
+def _cache_store(key, ttl, model_name, endpoint, response):
+    if not key:
+        return
+    try:
+        text = response.text
+    except ValueError:
+        # Blocked or empty candidates: nothing worth caching
+        return
+    if text and text.strip():
+        response_cache.set(key, text, ttl)
+        if LLM_CACHE_DIR:
+            _write_disk(key, model_name, endpoint, text, ttl)
+
+
+def generate_with_fallback(model_names, prompt, endpoint=None, accept=None):
+    """Try each model in turn until one returns a response accept() likes.
+
+    Returns (response, model_name, error): the last model's response (None if
+    it raised), the model that produced it and the last error message. Models
+    with an open circuit are skipped without a call.
+    """
+    response, used, error = None, None, None
+    for model_name in model_names:
+        try:
+            response = generate(model_name, prompt, endpoint=endpoint)
+            used = model_name
+            if accept is None or accept(response):
+                break
+        except ModelUnavailable as e:
+            error = error or str(e)
+        except Exception as e:
+            error = str(e)
+            print(f"Vertex AI model error for {model_name}: {e}")
+            response, used = None, model_name
+    return response, used, error
+
+
+def _executor_pool():
+    global _executor
+    if _executor is None:
+        with _models_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=LLM_MAX_CONCURRENCY, thread_name_prefix="gemini")
+    return _executor
+
+
+def _chunk_text(chunk):
+    try:
+        return chunk.text
+    except ValueError:
+        # Chunk without text parts (e.g. only safety ratings)
+        return ""
+
+
+def _async_slots():
+    """Semaphore bounding native async model calls on the running loop"""
+    loop = asyncio.get_running_loop()
+    slots = _async_semaphores.get(loop)
+    if slots is None:
+        slots = _async_semaphores[loop] = asyncio.Semaphore(LLM_MAX_ASYNC_CONCURRENCY)
+    return slots
+
+
+async def agenerate(model_name, prompt, endpoint=None):
+    """Awaitable generate() for async endpoints.
+
+    Uses the SDK's generate_content_async, so a request waiting on the model
+    holds no thread; at most LLM_MAX_ASYNC_CONCURRENCY such calls are in flight.
+    The response cache is checked first, so a cached answer never touches the
+    SDK. A handle that doesn't exist yet (the SDK import and init take seconds)
+    is created on a worker thread, never on the event loop, and handles without
+    an async call run the model call on the Gemini worker pool.
+    """
+    key, ttl, cached = _cache_lookup(model_name, prompt, endpoint)
+    if cached is not None:
+        return cached
+
+    model, contents = await _amodel_and_contents(model_name, prompt)
+    if not hasattr(model, "generate_content_async"):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            _executor_pool(), _generate_uncached, model_name, prompt, endpoint, key, ttl
+        )
+
+    breaker = _breaker(model_name)
+    if not breaker.allow():
+        raise ModelUnavailable(f"{model_name} circuit is open after repeated failures")
+    started = time.perf_counter()
+    try:
+        async with _async_slots():
+            response = await model.generate_content_async(contents)
+    except asyncio.CancelledError:
+        breaker.release()
+        raise
+    except Exception:
+        breaker.record_failure()
+        telemetry.record_llm_call(model_name, endpoint, time.perf_counter() - started, "error")
+        raise
+    breaker.record_success()
+    telemetry.record_llm_call(model_name, endpoint, time.perf_counter() - started, "ok", response)
+    _cache_store(key, ttl, model_name, endpoint, response)
+    return response
+
+
+async def agenerate_with_fallback(model_names, prompt, endpoint=None, accept=None):
+    """Awaitable generate_with_fallback(); see agenerate()"""
+    response, used, error = None, None, None
+    for model_name in model_names:
+        try:
+            response = await agenerate(model_name, prompt, endpoint=endpoint)
+            used = model_name
+            if accept is None or accept(response):
+                break
+        except ModelUnavailable as e:
+            error = error or str(e)
+        except Exception as e:
+            error = str(e)
+            print(f"Vertex AI model error for {model_name}: {e}")
+            response, used = None, model_name
+    return response, used, error
+
+
+def stream(model_name, prompt, endpoint=None, cancelled=None):
+    """Yield text chunks from a streaming generate_content call.
+
+    Stops and closes the model stream once cancelled (a threading.Event) is set
+    or the caller closes the generator. Streams are never cached.
+    """
+    breaker = _breaker(model_name)
+    if not breaker.allow():
+        raise ModelUnavailable(f"{model_name} circuit is open after repeated failures")
+    started = time.perf_counter()
+    status = "ok"
+    usage = None
+    chunks = None
+    first = True
+    try:
+        model, contents = _model_and_contents(model_name, prompt)
+        chunks = model.generate_content(contents, stream=True)
+        for chunk in chunks:
+            if first:
+                first = False
+                breaker.record_success()
+                telemetry.llm_first_token.observe(time.perf_counter() - started, model=model_name, endpoint=endpoint)
+            usage = getattr(chunk, "usage_metadata", None) or usage
+            text = _chunk_text(chunk)
+            if text:
+                yield text
+            if cancelled is not None and cancelled.is_set():
+                status = "cancelled"
+                break
+    except GeneratorExit:
+        status = "cancelled"
+        raise
+    except Exception:
+        status = "error"
+        if first:
+            breaker.record_failure()
+        raise
+    finally:
+        if first and status != "error":
+            if status == "ok":
+                breaker.record_success()
+            else:
+                breaker.release()
+        if chunks is not None and hasattr(chunks, "close"):
+            chunks.close()
+        telemetry.record_llm_call(
+            model_name, endpoint, time.perf_counter() - started, status, SimpleNamespace(usage_metadata=usage)
+        )
+
+
+def stream_with_fallback(model_names, prompt, endpoint=None, cancelled=None):
+    """Yield (model_name, text) chunks from the first model in the chain that starts
+    streaming; models that fail before their first chunk are skipped"""
+    error = None
+    for model_name in model_names:
+        chunks = stream(model_name, prompt, endpoint=endpoint, cancelled=cancelled)
+        try:
+            first = next(chunks)
+        except StopIteration:
+            error = error or f"{model_name} returned an empty response"
+            continue
+        except ModelUnavailable as e:
+            error = error or str(e)
+            continue
+        except Exception as e:
+            error = str(e)
+            print(f"Vertex AI model error for {model_name}: {e}")
+            continue
+        try:
+            yield model_name, first
+            for text in chunks:
+                yield model_name, text
+        finally:
+            chunks.close()
+        return
+    raise ModelUnavailable(error or "No Gemini model is available")
+
+
+async def astream_with_fallback(model_names, prompt, endpoint=None, cancelled=None):
+    """Async version of stream_with_fallback for streaming endpoints.
+
+    The SDK stream is drained on a worker thread. When the consumer stops early
+    (cancelled, client disconnect) cancelled is set and the worker closes the
+    model stream at the next chunk.
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    cancelled = cancelled or threading.Event()
+    done = object()
+
+    def drain():
+        try:
+            for item in stream_with_fallback(model_names, prompt, endpoint=endpoint, cancelled=cancelled):
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+                if cancelled.is_set():
+                    break
+            loop.call_soon_threadsafe(queue.put_nowait, done)
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, e)
+
+    _executor_pool().submit(drain)
+    finished = False
+    try:
+        while True:
+            item = await queue.get()
+            if item is done:
+                finished = True
+                return
+            if isinstance(item, Exception):
+                finished = True
+                raise item
+            yield item
+    finally:
+        if not finished:
+            # Consumer stopped early: tell the worker to close the model stream
+            cancelled.set()
+
+
+def circuit_stats():
+    return {name: breaker.stats() for name, breaker in list(_breakers.items())}
+
+
+def cache_stats():
+    return {**response_cache.stats(), "ttls": {endpoint: cache_ttl(endpoint) for endpoint in DEFAULT_CACHE_TTLS},
+            "disk": LLM_CACHE_DIR or None}
+
+
+def invalidate_cache():
+    """Drop every cached response, in memory and on disk"""
+    removed = response_cache.invalidate()
+    if LLM_CACHE_DIR and os.path.isdir(LLM_CACHE_DIR):
+        for name in os.listdir(LLM_CACHE_DIR):
+            if name.endswith(".json"):
+                try:
+                    os.remove(os.path.join(LLM_CACHE_DIR, name))
+                except OSError:
+                    pass
+    return removed
@@ -0,0 +1,372 @@
+# Embedded local read engine
+#
+# Mirrors the base tables (advisors, clients, accounts, holdings, transactions,
+# todo_tasks, client_interactions) into an in-memory SQLite database and answers
+# the registered read queries in-process. BigQuery stays the source of truth.
+#
+#   LOCAL_ENGINE=off      every query goes to BigQuery (default)
+#   LOCAL_ENGINE=replica  tables are copied from BigQuery at startup and every
+#                         LOCAL_ENGINE_REFRESH_SECONDS; reads that cannot run
+#                         locally, or arrive before the first copy, use BigQuery
+#   LOCAL_ENGINE=offline  tables are loaded from <table>.csv files in
+#                         LOCAL_ENGINE_DATA_DIR and BigQuery is never called,
+#                         so the service runs without credentials (tests, demos);
+#                         the default with FAKE_BACKENDS=true
+#
+# Query SQL is translated from BigQuery's dialect for the handful of constructs
+# the endpoints use; a query can also register its own local_sql (see
+# backend/queries.py). Queries that need ARRAY/STRUCT results, MERGE or the
+# snapshot tables are never run locally.
+
+import csv
+import datetime
+import decimal
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from backend import columnar
+from backend.config import project_id, dataset_name, fake_backends
+
+LOCAL_ENGINE = os.getenv("LOCAL_ENGINE", "offline" if fake_backends else "off").lower()
+ENABLED = LOCAL_ENGINE in ("replica", "offline")
+OFFLINE = LOCAL_ENGINE == "offline"
+LOCAL_ENGINE_REFRESH_SECONDS = int(os.getenv("LOCAL_ENGINE_REFRESH_SECONDS", "900"))
+LOCAL_ENGINE_DATA_DIR = os.getenv("LOCAL_ENGINE_DATA_DIR", "local_data")
+SCHEMA_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "db_schema.txt")
+
+MIRRORED_TABLES = [
+    "advisors",
+    "clients",
+    "accounts",
+    "holdings",
+    "transactions",
+    "todo_tasks",
+    "client_interactions",
+]
+
+# BigQuery column type -> SQLite column affinity
+SQLITE_TYPES = {
+    "STRING": "TEXT",
+    "INT64": "INTEGER",
+    "INTEGER": "INTEGER",
+    "NUMERIC": "REAL",
+    "BIGNUMERIC": "REAL",
+    "FLOAT64": "REAL",
+    "FLOAT": "REAL",
+    "BOOL": "INTEGER",
+    "BOOLEAN": "INTEGER",
+    "DATE": "TEXT",
+    "DATETIME": "TEXT",
+    "TIMESTAMP": "TEXT",
+}
+
+# Constructs with no SQLite equivalent; queries using them stay on BigQuery
+UNSUPPORTED = re.compile(r"\b(ARRAY|ARRAY_AGG|STRUCT|UNNEST|MERGE|CREATE|FARM_FINGERPRINT|TO_JSON_STRING)\b", re.I)
+
+_db = None
+_db_lock = threading.Lock()
+_local_sql = {}  # query name -> translated SQL, or None when it cannot run locally
+_stop = threading.Event()
+last_load = {}
+
+
+# ---------------------------------------------------------------------------
+# BigQuery functions SQLite lacks
+# ---------------------------------------------------------------------------
+
+def _safe_divide(numerator, denominator):
+    if numerator is None or not denominator:
+        return None
+    return numerator / denominator
+
+
+class _StdDev:
+    """Sample standard deviation, like BigQuery's STDDEV/STDDEV_SAMP"""
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def step(self, value):
+        if value is None:
+            return
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    def finalize(self):
+        if self.count < 2:
+            return None
+        return math.sqrt(self.m2 / (self.count - 1))
+
+
+def _connect():
+    db = sqlite3.connect(":memory:", check_same_thread=False)
+    db.create_function("SAFE_DIVIDE", 2, _safe_divide, deterministic=True)
+    db.create_aggregate("STDDEV", 1, _StdDev)
+    db.create_aggregate("STDDEV_SAMP", 1, _StdDev)
+    return db
+
+
+# ---------------------------------------------------------------------------
+# SQL translation
+# ---------------------------------------------------------------------------
+
+_DATE_PARTS = {"YEAR": "%Y", "MONTH": "%m", "DAY": "%d"}
+
+_REWRITES = [
+    # `project.dataset.table` -> table
+    (re.compile(r"`[^`]*\.(\w+)`"), r"\1"),
+    (re.compile(r"\bCURRENT_DATE\(\)", re.I), "DATE('now')"),
+    (re.compile(r"\bCURRENT_TIMESTAMP\(\)", re.I), "DATETIME('now')"),
+    (re.compile(r"\bDATE_SUB\((.+?),\s*INTERVAL\s+(\d+)\s+(DAY|MONTH|YEAR)\)", re.I),
+     lambda m: f"DATE({m.group(1)}, '-{m.group(2)} {m.group(3).lower()}s')"),
+    (re.compile(r"\bDATE_ADD\((.+?),\s*INTERVAL\s+(\d+)\s+(DAY|MONTH|YEAR)\)", re.I),
+     lambda m: f"DATE({m.group(1)}, '+{m.group(2)} {m.group(3).lower()}s')"),
+    (re.compile(r"\bDATE_TRUNC\((.+?),\s*(MONTH|YEAR)\)", re.I),
+     lambda m: f"DATE({m.group(1)}, 'start of {m.group(2).lower()}')"),
+    (re.compile(r"\bEXTRACT\((YEAR|MONTH|DAY)\s+FROM\s+([^)]+)\)", re.I),
+     lambda m: f"CAST(STRFTIME('{_DATE_PARTS[m.group(1).upper()]}', {m.group(2)}) AS INTEGER)"),
+]
+
+
+def translate(sql):
+    """Rewrite BigQuery SQL for SQLite; None when it uses constructs SQLite lacks
+    or reads tables that are not mirrored"""
+    referenced = set(re.findall(r"`[^`]*\.(\w+)`", sql))
+    if referenced - set(MIRRORED_TABLES) or UNSUPPORTED.search(sql):
+        return None
+    for pattern, replacement in _REWRITES:
+        sql = pattern.sub(replacement, sql)
+    return sql
+
+
+def local_sql(query):
+    """SQLite text for a registered query, or None if it must run on BigQuery"""
+    if query.name not in _local_sql:
+        _local_sql[query.name] = query.local_sql or translate(query.sql)
+    return _local_sql[query.name]
+
+
+# ---------------------------------------------------------------------------
+# Running queries
+# ---------------------------------------------------------------------------
+
+def try_run(query, bound, result_format="rows"):
+    """Answer a registered query locally.
+
+    Returns bigquery.Row objects (or a pyarrow.Table for result_format="arrow")
+    with the same columns the BigQuery job would return, or None when the query
+    has to go to BigQuery instead. In offline mode that is an error.
+    """
+    if not ENABLED:
+        return None
+    sql = local_sql(query)
+    if sql is None or _db is None:
+        if OFFLINE:
+            reason = "has no local SQL" if sql is None else "ran before the local tables were loaded"
+            raise RuntimeError(f"Query {query.name} {reason} (LOCAL_ENGINE=offline)")
+        return None
+    try:
+        with _db_lock:
+            cursor = _db.execute(sql, bound)
+            fields = [column[0] for column in cursor.description]
+            values = cursor.fetchall()
+    except sqlite3.Error as e:
+        if OFFLINE:
+            raise
+        # Translation missed something: keep this query on BigQuery from now on
+        print(f"Local engine cannot run {query.name}, using BigQuery: {e}")
+        _local_sql[query.name] = None
+        return None
+    if result_format == "arrow":
+        return columnar.pa.table({
+            field: columnar.pa.array([row[i] for row in values]) for i, field in enumerate(fields)
+        })
+    from google.cloud.bigquery.table import Row
+    field_to_index = {field: i for i, field in enumerate(fields)}
+    return [Row(row, field_to_index) for row in values]
+
+
+# ---------------------------------------------------------------------------
+# Loading the mirror
+# ---------------------------------------------------------------------------
+
+def _to_sqlite(value):
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, (datetime.date, datetime.datetime, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, (list, dict)):
+        return str(value)
+    return value
+
+
+def _create_table(db, table, columns):
+    """columns: list of (name, BigQuery type)"""
+    definition = ", ".join(f'"{name}" {SQLITE_TYPES.get(kind.upper(), "")}' for name, kind in columns)
+    db.execute(f'CREATE TABLE "{table}" ({definition})')
+
+
+def _insert(db, table, column_names, rows):
+    placeholders = ", ".join("?" for _ in column_names)
+    db.executemany(f'INSERT INTO "{table}" VALUES ({placeholders})', rows)
+
+
+def _load_from_bigquery(db):
+    """Copy every mirrored table with tabledata.list (no query jobs, no bytes billed)"""
+    from backend import data_access
+
+    client = data_access.get_client()
+    counts = {}
+    for table in MIRRORED_TABLES:
+        rows = client.list_rows(f"{project_id}.{dataset_name}.{table}")
+        columns = [(field.name, field.field_type) for field in rows.schema]
+        _create_table(db, table, columns)
+        values = [tuple(_to_sqlite(value) for value in row.values()) for row in rows]
+        _insert(db, table, [name for name, _ in columns], values)
+        counts[table] = len(values)
+    return counts
+
+
+def _schema_file_columns():
+    """table -> [(column, type)] from db_schema.txt (tab-separated dataset, table, column, type)"""
+    columns = {}
+    try:
+        with open(SCHEMA_FILE) as f:
+            for line in f:
+                parts = line.rstrip("\n").split("\t")
+                if len(parts) >= 4:
+                    _, table, column, kind = parts[-4:]
+                    columns.setdefault(table, []).append((column, kind))
+    except OSError:
+        pass
+    return columns
+
+
+def _infer_type(values):
+    present = [value for value in values if value != ""]
+    if not present:
+        return "STRING"
+    try:
+        [int(value) for value in present]
+        return "INT64"
+    except ValueError:
+        pass
+    try:
+        [float(value) for value in present]
+        return "FLOAT64"
+    except ValueError:
+        return "STRING"
+
+
+def _load_from_files(db, data_dir):
+    """Load <table>.csv files; tables without a file are created empty from db_schema.txt"""
+    schema = _schema_file_columns()
+    counts = {}
+    for table in MIRRORED_TABLES:
+        path = os.path.join(data_dir, f"{table}.csv")
+        if not os.path.exists(path):
+            _create_table(db, table, schema.get(table, [("id", "STRING")]))
+            counts[table] = 0
+            continue
+        with open(path, newline="") as f:
+            reader = csv.reader(f)
+            header = next(reader)
+            records = list(reader)
+        known = dict(schema.get(table, []))
+        columns = [
+            (name, known.get(name) or _infer_type([record[i] for record in records]))
+            for i, name in enumerate(header)
+        ]
+        _create_table(db, table, columns)
+        _insert(db, table, header, [[value if value != "" else None for value in record] for record in records])
+        counts[table] = len(records)
+    return counts
+
+
+def load():
+    """Build a fresh mirror and swap it in; readers keep using the old one until then"""
+    global _db
+    started = time.perf_counter()
+    db = _connect()
+    if OFFLINE and fake_backends:
+        from backend import fakes
+        fakes.ensure_fixtures(LOCAL_ENGINE_DATA_DIR)
+    counts = _load_from_files(db, LOCAL_ENGINE_DATA_DIR) if OFFLINE else _load_from_bigquery(db)
+    db.commit()
+    with _db_lock:
+        previous, _db = _db, db
+    if previous is not None:
+        previous.close()
+    last_load.update({
+        "mode": LOCAL_ENGINE,
+        "rows": counts,
+        "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+        "completed_at": time.time(),
+    })
+    if not OFFLINE:
+        # Cached BigQuery results may be older than the new copy
+        from backend import data_access
+        data_access.invalidate_cache()
+    print(f"Local engine loaded: {last_load}")
+    return dict(last_load)
+
+
+def _refresh_loop():
+    while True:
+        try:
+            load()
+        except Exception as e:
+            print(f"Local engine refresh error: {e}")
+        if _stop.wait(LOCAL_ENGINE_REFRESH_SECONDS):
+            return
+
+
+def start():
+    """Load the mirror: synchronously offline, on a refresh schedule as a replica"""
+    if not ENABLED:
+        return
+    _stop.clear()
+    if OFFLINE:
+        try:
+            load()
+        except Exception as e:
+            print(f"Local engine load error: {e}")
+        return
+    threading.Thread(target=_refresh_loop, name="local-engine-refresh", daemon=True).start()
+
+
+def refresh_in_background():
+    """Reload the mirror now without blocking the caller"""
+    def run():
+        try:
+            load()
+        except Exception as e:
+            print(f"Local engine refresh error: {e}")
+    threading.Thread(target=run, name="local-engine-refresh", daemon=True).start()
+
+
+def stop():
+    global _db
+    _stop.set()
+    with _db_lock:
+        if _db is not None:
+            _db.close()
+            _db = None
+
+
+def stats():
+    return {
+        "mode": LOCAL_ENGINE,
+        "loaded": _db is not None,
+        "last_load": dict(last_load),
+        "local_queries": sorted(name for name, sql in _local_sql.items() if sql is not None),
+        "bigquery_queries": sorted(name for name, sql in _local_sql.items() if sql is None),
+    }
@@ -1,26 +1,49 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request, Query
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from google.cloud import bigquery, storage, discoveryengine_v1 as discovery
-from google.api_core.client_options import ClientOptions
-from googleapiclient.discovery import build
-import vertexai
-from vertexai.generative_models import GenerativeModel
+from starlette.concurrency import run_in_threadpool
 import os
 import datetime
-import uvicorn
+import json
+import threading
+import time
+import uuid
 from typing import Optional
 
 # Import prompt templates (absolute import)
 from backend.prompt_templates import (
-    BANKING_ADVISOR_SYSTEM_PROMPT,
-    NBA_GENERATION_PROMPT,
     MESSAGE_DRAFTING_PROMPT,
-    CONTENT_SUMMARIZATION_PROMPT,
-    TASK_PRIORITIZATION_PROMPT,
-    CALENDAR_PROMPT
+    CHAT_PROMPT,
+    AI_INSIGHTS_PROMPT,
+    DASHBOARD_INSIGHTS_PROMPT,
+    AGGREGATION_INSIGHTS_PROMPT,
+    TODO_ORDERING_PROMPT,
+    NBA_ACTIVITY_PROMPT,
+    CALENDAR_PARSE_PROMPT
 )
+from backend import (
+    chat_context, coalesce, columnar, data_access, insights, llm, local_engine, nba_batch, prompt_budget, responses,
+    snapshots, summarizer, telemetry, warmup
+)
+from backend.config import project_id, dataset_name
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # Shared BigQuery client is created once and closed on shutdown
+    data_access.startup()
+    # Firm-wide insights are kept fresh in the background once warmup has generated them
+    insights.start()
+    # Credentials, pooled connections, model handles and firm-wide caches; /ready waits on it
+    warmup.start()
+    yield
+    insights.stop()
+    data_access.shutdown()
 
-app = FastAPI()
+
+# orjson rendering for every JSON response (backend/responses.py)
+app = FastAPI(lifespan=lifespan, default_response_class=responses.FastJSONResponse)
 
 # Add CORS middleware
 app.add_middleware(
@@ -35,18 +58,40 @@ app.add_middleware(
     allow_headers=["*"],  # Allow all headers
 )
 
-# Initialize clients
-project_id = os.getenv("PROJECT_ID", "apialchemists-1-47b9")
-dataset_name = os.getenv("DATASET_NAME", "apialchemists")
-location = os.getenv("LOCATION", "us-central1")
+# Bodies over COMPRESS_MIN_BYTES go out brotli- or gzip-compressed, as the client accepts
+app.add_middleware(responses.CompressionMiddleware)
+
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    """Per-route latency histogram for /metrics"""
+    started = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    telemetry.http_duration.observe(
+        time.perf_counter() - started,
+        method=request.method,
+        route=route.path if route else "unmatched",
+        status=response.status_code,
+    )
+    return response
 
-# Initialize Vertex AI
-vertexai.init(project=project_id, location=location)
+# "fused" runs /aggregation as one single-scan job, "split" as five parallel queries
+AGGREGATION_QUERY_MODE = os.getenv("AGGREGATION_QUERY_MODE", "fused")
+
+# Vertex AI is initialized by backend/llm.py on first use, or by the background
+# warmup started at startup, so the SDK import stays off the cold-start path
 
 @app.get("/")
 def root():
+    """Liveness: the process is up, whether or not warmup has finished"""
     return {"message": "Private Banking Advisor Copilot backend is running"}
 
+@app.get("/ready")
+def ready():
+    """Readiness: 503 until the startup warmup completes, then 200 with each step's duration"""
+    report = warmup.status()
+    return responses.FastJSONResponse(report, status_code=200 if report["ready"] else 503)
+
 @app.get("/auth-check")
 def auth_check():
     """Health check endpoint that also validates authentication"""
@@ -58,20 +103,15 @@ def auth_check():
     }
 
 @app.get("/clients")
-def get_clients(advisor_id: Optional[str] = Query(None)):
+async def get_clients(advisor_id: Optional[str] = Query(None)):
     """Get clients filtered by advisor"""
     try:
         # Default to ADV001 if no advisor_id provided
         current_advisor_id = advisor_id or 'ADV001'
         
-        # Initialize BigQuery client with explicit project - Cloud Run uses service account automatically
-        project_id = os.getenv('PROJECT_ID', 'apialchemists-1-47b9')
-        dataset_name = os.getenv('DATASET_NAME', 'apialchemists')
-        
         try:
             # In Cloud Run, this will use the service account automatically
-            bq_client = bigquery.Client(project=project_id)
-            print(f"BigQuery client initialized for project: {project_id}")
+            await data_access.ensure_available_async()
         except Exception as auth_error:
             print(f"BigQuery authentication error: {auth_error}")
             # Return mock data if database is not available
@@ -93,53 +133,17 @@ def get_clients(advisor_id: Optional[str] = Query(None)):
             }
         
         # Get clients for this advisor with their portfolio values
-        clients_query = f"""
-        SELECT 
-            c.client_id,
-            c.name,
-            c.email,
-            c.phone,
-            c.client_tier,
-            c.net_worth,
-            c.risk_tolerance,
-            c.investment_objective,
-            c.location,
-            c.onboarding_date,
-            COALESCE(SUM(h.value), 0) as portfolio_value,
-            COUNT(h.holding_id) as total_holdings,
-            COUNT(DISTINCT h.asset_class) as asset_classes,
-            MAX(ci.date) as last_contact_date
-        FROM `{project_id}.{dataset_name}.clients` c
-        LEFT JOIN `{project_id}.{dataset_name}.holdings` h ON c.client_id = h.client_id
-        LEFT JOIN `{project_id}.{dataset_name}.client_interactions` ci ON c.client_id = ci.client_id
-        WHERE c.advisor_id = '{current_advisor_id}'
-        GROUP BY c.client_id, c.name, c.email, c.phone, c.client_tier, c.net_worth, 
-                 c.risk_tolerance, c.investment_objective, c.location, c.onboarding_date
-        ORDER BY portfolio_value DESC
-        """
-        
-        results = list(bq_client.query(clients_query).result())
-        
-        clients_data = []
-        for row in results:
-            clients_data.append({
-                "client_id": row.client_id,
-                "name": row.name,
-                "email": row.email,
-                "phone": row.phone,
-                "location": row.location,
-                "client_tier": row.client_tier,
-                "net_worth": float(row.net_worth) if row.net_worth else 0,
-                "portfolio_value": float(row.portfolio_value),
-                "risk_tolerance": row.risk_tolerance,
-                "investment_objective": row.investment_objective,
-                "total_holdings": int(row.total_holdings),
-                "asset_classes": int(row.asset_classes),
-                "onboarding_date": str(row.onboarding_date),
-                "last_contact": str(row.last_contact_date) if row.last_contact_date else None
-            })
+        query_name = await snapshots.apick("clients_for_advisor")
+        params = {"advisor_id": current_advisor_id}
+        if columnar.ARROW_RESULTS_ENABLED:
+            table = await data_access.run_named_table_async(query_name, params, endpoint="clients")
+            clients_data = _clients_from_table(table)
+        else:
+            rows = await data_access.run_named_async(query_name, params, endpoint="clients")
+            clients_data = _clients_from_rows(rows)
         
-        return {
+        # A book can run to thousands of clients: render straight from the dict, skipping jsonable_encoder
+        return responses.FastJSONResponse({
             "clients": clients_data,
             "total_clients": len(clients_data),
             "advisor_id": current_advisor_id,
@@ -149,7 +153,7 @@ def get_clients(advisor_id: Optional[str] = Query(None)):
                 "high_value_clients": len([c for c in clients_data if c["portfolio_value"] >= 1000000]),
                 "tier_distribution": {}
             }
-        }
+        })
         
     except Exception as e:
         print(f"Clients error for advisor {advisor_id}: {e}")
@@ -160,6 +164,47 @@ def get_clients(advisor_id: Optional[str] = Query(None)):
             "error": f"Failed to fetch clients: {str(e)}"
         }
 
+def _clients_from_rows(rows):
+    """Build /clients records from bigquery.Row objects"""
+    clients_data = []
+    for row in rows:
+        clients_data.append({
+            "client_id": row.client_id,
+            "name": row.name,
+            "email": row.email,
+            "phone": row.phone,
+            "location": row.location,
+            "client_tier": row.client_tier,
+            "net_worth": float(row.net_worth) if row.net_worth else 0,
+            "portfolio_value": float(row.portfolio_value),
+            "risk_tolerance": row.risk_tolerance,
+            "investment_objective": row.investment_objective,
+            "total_holdings": int(row.total_holdings),
+            "asset_classes": int(row.asset_classes),
+            "onboarding_date": str(row.onboarding_date),
+            "last_contact": str(row.last_contact_date) if row.last_contact_date else None
+        })
+    return clients_data
+
+def _clients_from_table(table):
+    """Build the same /clients records from an Arrow table, converting whole columns at once"""
+    return columnar.to_records({
+        "client_id": table["client_id"],
+        "name": table["name"],
+        "email": table["email"],
+        "phone": table["phone"],
+        "location": table["location"],
+        "client_tier": table["client_tier"],
+        "net_worth": columnar.as_float(table["net_worth"]),
+        "portfolio_value": columnar.as_float(table["portfolio_value"]),
+        "risk_tolerance": table["risk_tolerance"],
+        "investment_objective": table["investment_objective"],
+        "total_holdings": columnar.as_int(table["total_holdings"]),
+        "asset_classes": columnar.as_int(table["asset_classes"]),
+        "onboarding_date": columnar.as_str(table["onboarding_date"], null_as="None"),
+        "last_contact": columnar.as_str(table["last_contact_date"])
+    })
+
 @app.post("/advisor-by-email")
 async def get_advisor_by_email(request: Request):
     """Get advisor information by email address"""
@@ -172,19 +217,9 @@ async def get_advisor_by_email(request: Request):
         
         # Initialize BigQuery client with error handling
         try:
-            # Use explicit project ID for Cloud Run service account
-            project_id = os.getenv('PROJECT_ID', 'apialchemists-1-47b9')
-            dataset_name = os.getenv('DATASET_NAME', 'apialchemists')
-            bq_client = bigquery.Client(project=project_id)
-            print(f"BigQuery client initialized for advisor lookup, project: {project_id}")
-            query = f"""
-            SELECT advisor_id, name, email, specialization, years_experience, location 
-            FROM `{project_id}.{dataset_name}.advisors` 
-            WHERE LOWER(email) = LOWER('{email}') 
-            LIMIT 1
-            """
-            
-            results = list(bq_client.query(query).result())
+            results = await data_access.run_named_async(
+                "advisor_by_email", {"email": email}, endpoint="advisor-by-email"
+            )
             
             if results:
                 advisor = results[0]
@@ -201,13 +236,9 @@ async def get_advisor_by_email(request: Request):
                 }
             else:
                 # Try to get default advisor from database
-                default_query = f"""
-                SELECT advisor_id, name, email, specialization, years_experience, location 
-                FROM `{project_id}.{dataset_name}.advisors` 
-                WHERE advisor_id = 'ADV001' 
-                LIMIT 1
-                """
-                default_results = list(bq_client.query(default_query).result())
+                default_results = await data_access.run_named_async(
+                    "advisor_by_id", {"advisor_id": "ADV001"}, endpoint="advisor-by-email"
+                )
                 
                 if default_results:
                     advisor = default_results[0]
@@ -290,29 +321,15 @@ async def get_advisor_by_id(request: Request):
         
         # Initialize BigQuery client with error handling
         try:
-            # Use explicit project ID for Cloud Run service account  
-            project_id = os.getenv('PROJECT_ID', 'apialchemists-1-47b9')
-            dataset_name = os.getenv('DATASET_NAME', 'apialchemists')
-            bq_client = bigquery.Client(project=project_id)
-            print(f"BigQuery client initialized for advisor-by-id, project: {project_id}")
-            
             # If numeric ID provided, find the corresponding advisor_id
             if str(advisor_id).isdigit():
-                query = f"""
-                SELECT advisor_id, name, email, specialization, years_experience, location 
-                FROM `{project_id}.{dataset_name}.advisors` 
-                ORDER BY advisor_id
-                LIMIT 1 OFFSET {int(advisor_id) - 1}
-                """
+                results = await data_access.run_named_async(
+                    "advisor_by_position", {"offset": int(advisor_id) - 1}, endpoint="advisor-by-id"
+                )
             else:
-                query = f"""
-                SELECT advisor_id, name, email, specialization, years_experience, location 
-                FROM `{project_id}.{dataset_name}.advisors` 
-                WHERE advisor_id = '{advisor_id}' 
-                LIMIT 1
-                """
-            
-            results = list(bq_client.query(query).result())
+                results = await data_access.run_named_async(
+                    "advisor_by_id", {"advisor_id": advisor_id}, endpoint="advisor-by-id"
+                )
             
             if results:
                 advisor = results[0]
@@ -330,13 +347,9 @@ async def get_advisor_by_id(request: Request):
             else:
                 # If requested advisor not found, return ADV001 as fallback
                 if advisor_id != "ADV001":
-                    fallback_query = f"""
-                    SELECT advisor_id, name, email, specialization, years_experience, location 
-                    FROM `{project_id}.{dataset_name}.advisors` 
-                    WHERE advisor_id = 'ADV001' 
-                    LIMIT 1
-                    """
-                    fallback_results = list(bq_client.query(fallback_query).result())
+                    fallback_results = await data_access.run_named_async(
+                        "advisor_by_id", {"advisor_id": "ADV001"}, endpoint="advisor-by-id"
+                    )
                     
                     if fallback_results:
                         advisor = fallback_results[0]
@@ -408,40 +421,28 @@ async def get_advisor_by_id(request: Request):
         }
 
 @app.get("/todo")
-def get_todo(advisor_id: Optional[str] = Query(None)):
+async def get_todo(advisor_id: Optional[str] = Query(None)):
     """Get todo tasks filtered by advisor"""
     try:
         # Default to ADV001 if no advisor_id provided
         current_advisor_id = advisor_id or 'ADV001'
         
-        # BigQuery client setup with explicit project
-        project_id = os.getenv('PROJECT_ID', 'apialchemists-1-47b9')
-        dataset_name = os.getenv('DATASET_NAME', 'apialchemists')
-        bq_client = bigquery.Client(project=project_id)
-        print(f"BigQuery client initialized for todo, project: {project_id}")
-        
         # Get tasks for clients of this advisor
-        query = f"""
-        SELECT tt.task, tt.priority, c.name as client_name
-        FROM `{project_id}.{dataset_name}.todo_tasks` tt
-        LEFT JOIN `{project_id}.{dataset_name}.clients` c ON tt.client_id = c.client_id
-        WHERE c.advisor_id = '{current_advisor_id}' OR tt.client_id IS NULL
-        ORDER BY tt.priority ASC 
-        LIMIT 10
-        """
-        results = bq_client.query(query).result()
+        results = await data_access.run_named_async(
+            "advisor_tasks", {"advisor_id": current_advisor_id}, endpoint="todo"
+        )
         tasks = [f"{row.task} {('('+row.client_name+')' if row.client_name else '')}" for row in results]
 
         # If no tasks found for this advisor, get general tasks
         if not tasks:
-            fallback_query = f"SELECT task FROM `{project_id}.{dataset_name}.todo_tasks` ORDER BY priority ASC LIMIT 10"
-            results = bq_client.query(fallback_query).result()
+            results = await data_access.run_named_async("all_tasks", endpoint="todo")
             tasks = [row.task for row in results]
 
         # Vertex AI integration for prioritization using Gemini
-        model = GenerativeModel("gemini-1.5-pro")
-        prompt = f"Prioritize these tasks for advisor {current_advisor_id}: {', '.join(tasks)}. Return a numbered list."
-        response = model.generate_content(prompt)
+        prompt = prompt_budget.build(
+            "todo", TODO_ORDERING_PROMPT, sections={"tasks": tasks}, system=None, advisor_id=current_advisor_id
+        )
+        response = await llm.agenerate("gemini-1.5-pro", prompt, endpoint="todo")
         
         # Parse prioritized tasks or fallback to original
         prioritized_tasks = response.text.split('\n') if response.text else tasks
@@ -461,33 +462,49 @@ def get_todo(advisor_id: Optional[str] = Query(None)):
         ]}
 
 @app.get("/nba")
-def get_nba(advisor_id: Optional[str] = Query(None)):
-    """Get Next Best Actions filtered by advisor"""
+async def get_nba(advisor_id: Optional[str] = Query(None), client_id: Optional[str] = Query(None)):
+    """Get Next Best Actions filtered by advisor, and optionally one of their clients"""
     try:
         # Default to ADV001 if no advisor_id provided
         current_advisor_id = advisor_id or 'ADV001'
         
+        if await nba_batch.aready():
+            # Client-specific actions precomputed by the nightly batch (backend/nba_batch.py)
+            rows = await data_access.run_named_async("nba_for_advisor", {
+                "advisor_id": current_advisor_id,
+                "client_id": client_id or None,
+                "max_actions": nba_batch.NBA_MAX_ACTIONS,
+            }, endpoint="nba")
+            if rows:
+                return {
+                    "next_best_actions": [f"{row.client_name}: {row.action}" for row in rows],
+                    "recommendations": [
+                        {
+                            "client_id": row.client_id,
+                            "client_name": row.client_name,
+                            "action": row.action,
+                            "rationale": row.rationale,
+                            "expected_outcome": row.expected_outcome,
+                            "priority": row.priority,
+                            "timeline": row.timeline
+                        }
+                        for row in rows
+                    ],
+                    "generated_at": str(max(row.generated_at for row in rows))
+                }
+        
+        # No precomputed actions yet: generate generic ones from recent activity
         # Get recent client activity from BigQuery using correct schema for this advisor
-        bq_client = bigquery.Client(project=project_id)
-        query = f"""
-        SELECT t.transaction_id, t.amount, t.category, t.date, c.client_id, c.name as client_name
-        FROM `{project_id}.{dataset_name}.transactions` t
-        JOIN `{project_id}.{dataset_name}.accounts` a ON t.account_id = a.account_id
-        JOIN `{project_id}.{dataset_name}.clients` c ON a.client_id = c.client_id
-        WHERE c.advisor_id = '{current_advisor_id}'
-        ORDER BY t.date DESC LIMIT 5
-        """
-        results = bq_client.query(query).result()
+        results = await data_access.run_named_async(
+            "advisor_recent_activity", {"advisor_id": current_advisor_id}, endpoint="nba"
+        )
         recent_activity = [f"{row.client_name}: {row.category} ${row.amount}" for row in results]
         
         # Vertex AI for NBA suggestions using Gemini
-        model = GenerativeModel("gemini-1.5-pro")
-        prompt = f"""
-        Based on recent client activity: {', '.join(recent_activity)}
-        Suggest 3 next best actions for a private bank advisor.
-        Format as bullet points.
-        """
-        response = model.generate_content(prompt)
+        prompt = prompt_budget.build(
+            "nba", NBA_ACTIVITY_PROMPT, sections={"recent_activity": recent_activity}, system=None
+        )
+        response = await llm.agenerate("gemini-1.5-pro", prompt, endpoint="nba")
         
         nba_suggestions = response.text.split('\n') if response.text else []
         # Clean up the suggestions
@@ -512,22 +529,20 @@ async def draft_message(request: Request):
         # Get client info if client_id provided using correct schema
         client_context = ""
         if client_id:
-            bq_client = bigquery.Client(project=project_id)
-            query = f"SELECT name, email, phone FROM `{project_id}.{dataset_name}.clients` WHERE client_id = '{client_id}' LIMIT 1"
-            results = bq_client.query(query).result()
+            results = await data_access.run_named_async(
+                "client_contact", {"client_id": client_id}, endpoint="draft-message"
+            )
             for row in results:
                 client_context = f"Client: {row.name} ({row.email}, {row.phone})"
         
         # Enhanced Vertex AI message generation with professional banking template using Gemini
-        model = GenerativeModel("gemini-1.5-pro")
-        prompt = MESSAGE_DRAFTING_PROMPT.format(
-            system_prompt=BANKING_ADVISOR_SYSTEM_PROMPT,
-            context=context,
+        prompt = prompt_budget.build(
+            "draft-message", MESSAGE_DRAFTING_PROMPT,
+            inputs={"context": context, "key_points": f"Context: {context}"},
             client_name=client_context.split(':')[1].split('(')[0].strip() if client_context else "Valued Client",
-            message_type="Email Update",
-            key_points=f"Context: {context}"
+            message_type="Email Update"
         )
-        response = model.generate_content(prompt)
+        response = await llm.agenerate("gemini-1.5-pro", prompt, endpoint="draft-message")
         
         draft = response.text if response.text else f"Dear valued client,\n\nI hope this message finds you well. I wanted to reach out regarding {context} and provide you with a personalized update on your portfolio.\n\nI look forward to discussing this further at your convenience.\n\nBest regards,\nYour Private Banking Advisor"
         
@@ -542,17 +557,10 @@ async def calendar_invite(request: Request):
         details = data.get("details", "")
         
         # Use Vertex AI to structure the invite details using Gemini
-        model = GenerativeModel("gemini-1.5-pro")
-        prompt = f"""
-        Parse this meeting request and suggest calendar event details:
-        "{details}"
-        
-        Return in format:
-        Title: [meeting title]
-        Description: [meeting description]
-        Duration: [suggested duration in minutes]
-        """
-        response = model.generate_content(prompt)
+        prompt = prompt_budget.build(
+            "calendar-invite", CALENDAR_PARSE_PROMPT, inputs={"details": details}, system=None
+        )
+        response = await llm.agenerate("gemini-1.5-pro", prompt, endpoint="calendar-invite")
         
         # For now, just return the structured details
         # Real implementation would use Google Calendar API
@@ -569,17 +577,13 @@ async def summarize(request: Request):
         data = await request.json()
         text = data.get("text", "")
         
-        # Enhanced summarization for banking context using Gemini
-        model = GenerativeModel("gemini-1.5-pro")
-        prompt = CONTENT_SUMMARIZATION_PROMPT.format(
-            system_prompt=BANKING_ADVISOR_SYSTEM_PROMPT,
-            content=text
-        )
-        response = model.generate_content(prompt)
+        # Enhanced summarization for banking context using Gemini; long content
+        # is summarized in chunks and merged (backend/summarizer.py)
+        result = await summarizer.summarize(text)
         
-        summary = response.text if response.text else f"**Executive Summary**: Key insights from provided content.\n\n**Key Points**:\n• {text[:150]}...\n\n**Action Items**: Review content for client impact and investment implications.\n\n**Relevance**: Content may contain information relevant to client portfolio management and advisory services."
+        summary = result.text if result.text else f"**Executive Summary**: Key insights from provided content.\n\n**Key Points**:\n• {text[:150]}...\n\n**Action Items**: Review content for client impact and investment implications.\n\n**Relevance**: Content may contain information relevant to client portfolio management and advisory services."
         
-        return {"summary": summary}
+        return {"summary": summary, "summarization": result.stats}
     except Exception as e:
         return {"summary": f"**Executive Summary**: Content analysis temporarily unavailable.\n\n**Key Points**:\n• {text[:150]}...\n\n**Recommendation**: Manual review suggested for full context and actionable insights."}
 
@@ -595,13 +599,15 @@ async def ingest_data(request: Request):
             return {"ingest_status": "Error: No data provided for ingestion"}
         
         # Upload to Cloud Storage - using existing bucket
-        storage_client = storage.Client()
+        # Storage calls block, so they run in the threadpool rather than on the event loop
+        from google.cloud import storage
+        storage_client = await run_in_threadpool(storage.Client)
         bucket_name = "apialchemists"  # Use existing bucket
         
         try:
             bucket = storage_client.bucket(bucket_name)
             # Test if bucket exists and is accessible
-            bucket.reload()
+            await run_in_threadpool(bucket.reload)
         except Exception as bucket_error:
             print(f"Bucket access error: {bucket_error}")
             return {"ingest_status": f"Error: Unable to access Cloud Storage bucket '{bucket_name}'. Please check permissions."}
@@ -613,13 +619,17 @@ async def ingest_data(request: Request):
         
         try:
             blob = bucket.blob(blob_name)
-            blob.upload_from_string(ingest_content)
+            await run_in_threadpool(blob.upload_from_string, ingest_content)
             
             # Optionally trigger BigQuery ingestion job here
             # bq_client = bigquery.Client()
             # job_config = bigquery.LoadJobConfig()
             # job = bq_client.load_job_from_uri(f"gs://{bucket_name}/{blob_name}", table_ref, job_config=job_config)
             
+            # New data makes cached advisor reads stale; the invalidation also
+            # refreshes the portfolio snapshots in the background (backend/snapshots.py)
+            data_access.invalidate_cache()
+            
             return {
                 "ingest_status": f"✅ Data successfully uploaded to Cloud Storage",
                 "file_location": f"gs://{bucket_name}/{blob_name}",
@@ -639,143 +649,135 @@ async def ingest_data(request: Request):
             "troubleshooting": "Check Google Cloud authentication and storage permissions"
         }
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Query, Gemini and request telemetry in the Prometheus text format"""
+    return PlainTextResponse(telemetry.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/admin/llm/circuits")
+def llm_circuits():
+    """Circuit breaker state for each Gemini model"""
+    return {"circuits": llm.circuit_stats()}
+
+@app.get("/admin/cache/stats")
+def cache_stats():
+    """Hit/miss/eviction stats for the query result cache, the Gemini response cache, chat context snapshots
+    and cached chunk summaries"""
+    return {
+        "query_cache": data_access.cache_stats(),
+        "llm_cache": llm.cache_stats(),
+        "chat_context": chat_context.stats(),
+        "summarize_chunks": summarizer.stats()
+    }
+
+@app.post("/admin/cache/invalidate")
+async def invalidate_cache(request: Request):
+    """Drop cached query results; optional body filters: query, advisor_id, client_id.
+    {"llm": true} clears the Gemini response cache and cached chunk summaries instead."""
+    try:
+        data = await request.json()
+    except Exception:
+        data = {}
+    if data.get("llm"):
+        removed = llm.invalidate_cache() + summarizer.invalidate_cache()
+        return {"invalidated": removed, "llm_cache": llm.cache_stats()}
+    filters = {key: data[key] for key in ("advisor_id", "client_id") if data.get(key)}
+    removed = data_access.invalidate_cache(data.get("query"), **filters)
+    return {"invalidated": removed, "query_cache": data_access.cache_stats()}
+
+@app.get("/admin/insights/stats")
+def insights_stats():
+    """Age and refresh state of each stored insight"""
+    return {"insights": insights.stats()}
+
+@app.post("/admin/insights/refresh")
+async def refresh_insights(request: Request):
+    """Regenerate stored insights in the background; optional body filters: kind, advisor_id"""
+    try:
+        data = await request.json()
+    except Exception:
+        data = {}
+    marked = insights.mark_stale(data.get("kind"), data.get("advisor_id"))
+    return {"status": "refresh started", "entries": marked}
+
+@app.get("/admin/coalescing/stats")
+def coalescing_stats():
+    """How many identical in-flight queries and endpoint calls were deduplicated"""
+    return {"coalescing": coalesce.stats()}
+
+@app.post("/admin/snapshots/refresh")
+async def refresh_snapshots(request: Request):
+    """Refresh portfolio snapshots; optional body {"client_ids": [...]} limits the scope"""
+    try:
+        data = await request.json()
+    except Exception:
+        data = {}
+    snapshots.refresh_in_background(data.get("client_ids"))
+    return {"status": "refresh started", "last_refresh": snapshots.last_refresh}
+
+@app.post("/admin/nba/refresh")
+async def refresh_nba(request: Request):
+    """Run the next-best-action batch now; optional body {"advisor_ids": [...]} limits the scope"""
+    try:
+        data = await request.json()
+    except Exception:
+        data = {}
+    nba_batch.run_in_background(data.get("advisor_ids"))
+    return {"status": "batch started", "last_run": nba_batch.last_run}
+
+@app.get("/admin/local-engine/stats")
+def local_engine_stats():
+    """Local mirror mode, last load and which queries it answers"""
+    return {"local_engine": local_engine.stats()}
+
+@app.post("/admin/local-engine/refresh")
+def refresh_local_engine():
+    """Reload the local mirror from BigQuery now (LOCAL_ENGINE=replica)"""
+    if local_engine.LOCAL_ENGINE != "replica":
+        return {"status": "local engine is not running as a replica", "local_engine": local_engine.stats()}
+    local_engine.refresh_in_background()
+    return {"status": "refresh started", "last_load": local_engine.last_load}
+
 @app.get("/dashboard-metrics")
-def get_dashboard_metrics():
+async def get_dashboard_metrics():
     """Optimized endpoint for modern dashboard visualization with Looker-ready format"""
+    # Firm-wide and identical for every advisor: concurrent loads share one computation.
+    # Returned as a response so FastAPI skips its jsonable_encoder pass over the nested dict
+    return responses.FastJSONResponse(await coalesce.endpoint_flights.ado("dashboard-metrics", _build_dashboard_metrics))
+
+# KPIs, asset allocation, advisor leaderboard, monthly trends and risk heatmap
+DASHBOARD_QUERIES = [
+    "dashboard_kpi",
+    "dashboard_asset_allocation",
+    "dashboard_top_advisors",
+    "dashboard_monthly_trends",
+    "dashboard_risk_metrics",
+]
+
+async def _build_dashboard_metrics():
     try:
-        bq_client = bigquery.Client(project=project_id)
-        
-        # KPI Summary Cards
-        kpi_query = f"""
-        WITH portfolio_summary AS (
-            SELECT 
-                COUNT(DISTINCT c.client_id) as total_clients,
-                COUNT(DISTINCT a.advisor_id) as total_advisors,
-                SUM(h.value) as total_aum,
-                COUNT(DISTINCT h.symbol) as unique_securities,
-                AVG(h.value) as avg_holding_value
-            FROM `{project_id}.{dataset_name}.holdings` h
-            JOIN `{project_id}.{dataset_name}.clients` c ON h.client_id = c.client_id
-            JOIN `{project_id}.{dataset_name}.advisors` a ON c.advisor_id = a.advisor_id
-        )
-        SELECT * FROM portfolio_summary
-        """
-        
-        # Asset allocation for pie charts
-        asset_allocation_query = f"""
-        SELECT 
-            h.asset_class,
-            SUM(h.value) as value,
-            COUNT(*) as holdings_count,
-            COUNT(DISTINCT c.client_id) as client_count,
-            ROUND(100.0 * SUM(h.value) / SUM(SUM(h.value)) OVER(), 2) as percentage
-        FROM `{project_id}.{dataset_name}.holdings` h
-        JOIN `{project_id}.{dataset_name}.clients` c ON h.client_id = c.client_id
-        GROUP BY h.asset_class
-        ORDER BY value DESC
-        """
-        
-        # Top performers for leaderboard
-        top_advisors_query = f"""
-        SELECT 
-            a.name as advisor_name,
-            COUNT(DISTINCT c.client_id) as client_count,
-            SUM(h.value) as total_aum,
-            ROUND(AVG(h.value), 0) as avg_holding_value,
-            COUNT(DISTINCT h.asset_class) as asset_diversity,
-            RANK() OVER (ORDER BY SUM(h.value) DESC) as rank
-        FROM `{project_id}.{dataset_name}.advisors` a
-        LEFT JOIN `{project_id}.{dataset_name}.clients` c ON a.advisor_id = c.advisor_id
-        LEFT JOIN `{project_id}.{dataset_name}.holdings` h ON c.client_id = h.client_id
-        GROUP BY a.advisor_id, a.name
-        HAVING SUM(h.value) > 0
-        ORDER BY total_aum DESC
-        LIMIT 10
-        """
-        
-        # Monthly trend data for line charts
-        monthly_trends_query = f"""
-        SELECT 
-            EXTRACT(YEAR FROM t.date) as year,
-            EXTRACT(MONTH FROM t.date) as month,
-            DATE_TRUNC(DATE(t.date), MONTH) as month_year,
-            SUM(CASE WHEN t.amount > 0 THEN t.amount ELSE 0 END) as inflows,
-            SUM(CASE WHEN t.amount < 0 THEN ABS(t.amount) ELSE 0 END) as outflows,
-            COUNT(DISTINCT c.client_id) as active_clients,
-            COUNT(*) as transaction_count
-        FROM `{project_id}.{dataset_name}.transactions` t
-        JOIN `{project_id}.{dataset_name}.accounts` a ON t.account_id = a.account_id
-        JOIN `{project_id}.{dataset_name}.clients` c ON a.client_id = c.client_id
-        WHERE t.date >= DATE_SUB(CURRENT_DATE(), INTERVAL 12 MONTH)
-        GROUP BY year, month, month_year
-        ORDER BY year DESC, month DESC
-        LIMIT 12
-        """
-        
-        # Risk metrics for heatmap
-        risk_metrics_query = f"""
-        SELECT 
-            h.asset_class,
-            h.sector,
-            SUM(h.value) as exposure,
-            COUNT(*) as positions,
-            STDDEV(h.current_price) as volatility,
-            AVG(SAFE_DIVIDE(h.current_price - h.purchase_price, NULLIF(h.purchase_price, 0)) * 100) as avg_performance
-        FROM `{project_id}.{dataset_name}.holdings` h
-        WHERE h.sector IS NOT NULL
-        GROUP BY h.asset_class, h.sector
-        HAVING SUM(h.value) > 100000
-        ORDER BY exposure DESC
-        """
-        
-        # Execute all queries
-        kpi_results = list(bq_client.query(kpi_query).result())
-        asset_results = list(bq_client.query(asset_allocation_query).result())
-        advisor_results = list(bq_client.query(top_advisors_query).result())
-        trends_results = list(bq_client.query(monthly_trends_query).result())
-        risk_results = list(bq_client.query(risk_metrics_query).result())
+        results = await data_access.run_queries_async(DASHBOARD_QUERIES, endpoint="dashboard-metrics")
+        kpi_results = results["dashboard_kpi"]
+        asset_results = results["dashboard_asset_allocation"]
+        advisor_results = results["dashboard_top_advisors"]
+        trends_results = results["dashboard_monthly_trends"]
+        risk_results = results["dashboard_risk_metrics"]
         
         # Format KPIs
         kpis = kpi_results[0] if kpi_results else None
         
-        # Generate AI insights for dashboard with robust model fallback
-        total_aum = kpis.total_aum if kpis else 0
-        context = f"Portfolio: ${total_aum:,.0f} AUM, {len(asset_results)} asset classes"
-        insights_prompt = f"""
-        {BANKING_ADVISOR_SYSTEM_PROMPT}
-
-        Generate 4 concise dashboard insights for: {context}
-
-        Focus on:
-        1. Performance highlight
-        2. Risk observation
-        3. Opportunity identification
-        4. Action recommendation
-
-        Keep each insight under 15 words, dashboard-friendly format.
-        """
-        model = None
-        response = None
-        model_error = None
-        for model_name in ["gemini-pro", "gemini-1.0-pro"]:
-            try:
-                model = GenerativeModel(model_name)
-                response = model.generate_content(insights_prompt)
-                if response.text and len(response.text.strip()) > 10:
-                    break
-            except Exception as e:
-                model_error = str(e)
-                print(f"Vertex AI model error for {model_name}: {e}")
-                response = None
-        if response and response.text:
-            insights = response.text.split('\n')[:4]
-        else:
-            insights = [
+        # AI insights come from the background refresher, so this path never waits on Gemini
+        try:
+            cached = await insights.aget("dashboard-metrics")
+            insight_lines, insights_freshness = cached.value, cached.freshness
+        except Exception as insights_error:
+            print(f"Dashboard insights error: {insights_error}")
+            insight_lines, insights_freshness = [
                 "Strong diversification across asset classes",
                 "Monitor concentration risk in top holdings", 
                 "Growth opportunities in underweight sectors",
                 "Optimize advisor client distribution"
-            ]
+            ], None
         
         # Build beautiful, modern UI-ready dashboard response (not Looker config)
         dashboard_data = {
@@ -860,8 +862,9 @@ def get_dashboard_metrics():
                     "type": "info",
                     "priority": idx + 1
                 }
-                for idx, insight in enumerate(insights) if insight.strip()
+                for idx, insight in enumerate(insight_lines) if insight.strip()
             ],
+            "insights_freshness": insights_freshness,
             "metadata": {
                 "last_updated": "2025-08-07T00:00:00Z",
                 "data_freshness": "real-time",
@@ -881,6 +884,27 @@ def get_dashboard_metrics():
             }
         }
 
+def _generate_dashboard_insights(scope):
+    """Four short firm-wide dashboard insights from the KPI and allocation queries"""
+    results = data_access.run_queries(
+        ["dashboard_kpi", "dashboard_asset_allocation"], endpoint="dashboard-metrics"
+    )
+    kpi_results = results["dashboard_kpi"]
+    kpis = kpi_results[0] if kpi_results else None
+    total_aum = kpis.total_aum if kpis else 0
+    context = f"Portfolio: ${total_aum:,.0f} AUM, {len(results['dashboard_asset_allocation'])} asset classes"
+    insights_prompt = prompt_budget.build("dashboard-metrics", DASHBOARD_INSIGHTS_PROMPT, context=context)
+    # Robust model fallback
+    response, model_name, model_error = llm.generate_with_fallback(
+        llm.FALLBACK_MODELS, insights_prompt, endpoint="dashboard-metrics",
+        accept=lambda response: response.text and len(response.text.strip()) > 10
+    )
+    if not (response and response.text):
+        raise RuntimeError(f"No model produced dashboard insights: {model_error}")
+    return response.text.split('\n')[:4]
+
+insights.register("dashboard-metrics", _generate_dashboard_insights, ["dashboard_kpi", "dashboard_asset_allocation"])
+
 def _get_asset_color(asset_class):
     """Get color for asset class visualization"""
     colors = {
@@ -915,135 +939,133 @@ def _get_risk_level(volatility, exposure):
     else:
         return "low"
 
-@app.get("/looker-integration")
-def get_looker_data():
-    """Enhanced Looker Studio integration with portfolio-specific dashboard IDs"""
-    try:
-        # Professional Portfolio Analytics Dashboard IDs for Looker Studio
-        looker_config = {
-            "connection": {
-                "database": "bigquery",
-                "project_id": project_id,
-                "dataset": dataset_name,
-                "connection_name": "banking_analytics"
+def _looker_integration_config():
+    """Looker Studio views, dashboards and SQL; they depend only on project_id and dataset_name"""
+    # Professional Portfolio Analytics Dashboard IDs for Looker Studio
+    looker_config = {
+        "connection": {
+            "database": "bigquery",
+            "project_id": project_id,
+            "dataset": dataset_name,
+            "connection_name": "banking_analytics"
+        },
+        
+        # Portfolio-specific Looker Studio Dashboard IDs
+        "portfolio_dashboards": {
+            "portfolio_overview_id": "1a2b3c4d-portfolio-overview",
+            "asset_allocation_id": "2b3c4d5e-asset-allocation", 
+            "performance_risk_id": "3c4d5e6f-performance-risk",
+            "holdings_transactions_id": "4d5e6f7g-holdings-transactions"
+        },
+        
+        "views": [
+            {
+                "name": "advisor_performance",
+                "sql_table_name": f"`{project_id}.{dataset_name}.advisors`",
+                "dimension_groups": [
+                    {
+                        "name": "created",
+                        "type": "time",
+                        "timeframes": ["date", "week", "month", "quarter", "year"]
+                    }
+                ],
+                "dimensions": [
+                    {"name": "advisor_id", "type": "string", "primary_key": "yes"},
+                    {"name": "name", "type": "string", "label": "Advisor Name"},
+                    {"name": "email", "type": "string"}
+                ],
+                "measures": [
+                    {"name": "count", "type": "count", "label": "Number of Advisors"},
+                    {"name": "avg_aum", "type": "average", "sql": "${total_aum}", "value_format": "$#,##0"}
+                ]
             },
             
-            # Portfolio-specific Looker Studio Dashboard IDs
-            "portfolio_dashboards": {
-                "portfolio_overview_id": "1a2b3c4d-portfolio-overview",
-                "asset_allocation_id": "2b3c4d5e-asset-allocation", 
-                "performance_risk_id": "3c4d5e6f-performance-risk",
-                "holdings_transactions_id": "4d5e6f7g-holdings-transactions"
+            {
+                "name": "client_portfolio",
+                "sql_table_name": f"`{project_id}.{dataset_name}.clients`", 
+                "joins": [
+                    {
+                        "name": "holdings",
+                        "type": "left_join",
+                        "sql_on": "${client_portfolio.client_id} = ${holdings.client_id}"
+                    },
+                    {
+                        "name": "advisor_performance", 
+                        "type": "left_join",
+                        "sql_on": "${client_portfolio.advisor_id} = ${advisor_performance.advisor_id}"
+                    }
+                ],
+                "dimensions": [
+                    {"name": "client_id", "type": "string", "primary_key": "yes"},
+                    {"name": "name", "type": "string", "label": "Client Name"},
+                    {"name": "tier", "type": "string", "label": "Client Tier"},
+                    {"name": "risk_profile", "type": "string"}
+                ],
+                "measures": [
+                    {"name": "total_portfolio_value", "type": "sum", "sql": "${holdings.value}", "value_format": "$#,##0"},
+                    {"name": "client_count", "type": "count_distinct", "sql": "${client_id}"}
+                ]
             },
             
-            "views": [
-                {
-                    "name": "advisor_performance",
-                    "sql_table_name": f"`{project_id}.{dataset_name}.advisors`",
-                    "dimension_groups": [
-                        {
-                            "name": "created",
-                            "type": "time",
-                            "timeframes": ["date", "week", "month", "quarter", "year"]
+            {
+                "name": "holdings",
+                "sql_table_name": f"`{project_id}.{dataset_name}.holdings`",
+                "dimensions": [
+                    {"name": "symbol", "type": "string", "label": "Security Symbol"},
+                    {"name": "asset_class", "type": "string", "label": "Asset Class"},
+                    {"name": "sector", "type": "string", "label": "Sector"}
+                ],
+                "measures": [
+                    {"name": "total_value", "type": "sum", "sql": "${TABLE}.value", "value_format": "$#,##0"},
+                    {"name": "avg_current_price", "type": "average", "sql": "${TABLE}.current_price", "value_format": "$#,##0.00"},
+                    {"name": "performance_pct", "type": "number", "sql": "ROUND((${TABLE}.current_price - ${TABLE}.purchase_price) / ${TABLE}.purchase_price * 100, 2)"}
+                ]
+            }
+        ],
+        
+        "dashboards": [
+            {
+                "name": "advisor_performance_dashboard",
+                "title": "Private Banking - Advisor Performance",
+                "layout": "newspaper",
+                "elements": [
+                    {
+                        "name": "kpi_total_aum",
+                        "type": "single_value", 
+                        "query": {
+                            "model": "banking_analytics",
+                            "explore": "client_portfolio",
+                            "measures": ["client_portfolio.total_portfolio_value"]
                         }
-                    ],
-                    "dimensions": [
-                        {"name": "advisor_id", "type": "string", "primary_key": "yes"},
-                        {"name": "name", "type": "string", "label": "Advisor Name"},
-                        {"name": "email", "type": "string"}
-                    ],
-                    "measures": [
-                        {"name": "count", "type": "count", "label": "Number of Advisors"},
-                        {"name": "avg_aum", "type": "average", "sql": "${total_aum}", "value_format": "$#,##0"}
-                    ]
-                },
-                
-                {
-                    "name": "client_portfolio",
-                    "sql_table_name": f"`{project_id}.{dataset_name}.clients`", 
-                    "joins": [
-                        {
-                            "name": "holdings",
-                            "type": "left_join",
-                            "sql_on": "${client_portfolio.client_id} = ${holdings.client_id}"
-                        },
-                        {
-                            "name": "advisor_performance", 
-                            "type": "left_join",
-                            "sql_on": "${client_portfolio.advisor_id} = ${advisor_performance.advisor_id}"
+                    },
+                    {
+                        "name": "asset_allocation_chart",
+                        "type": "looker_pie",
+                        "query": {
+                            "model": "banking_analytics", 
+                            "explore": "holdings",
+                            "dimensions": ["holdings.asset_class"],
+                            "measures": ["holdings.total_value"]
                         }
-                    ],
-                    "dimensions": [
-                        {"name": "client_id", "type": "string", "primary_key": "yes"},
-                        {"name": "name", "type": "string", "label": "Client Name"},
-                        {"name": "tier", "type": "string", "label": "Client Tier"},
-                        {"name": "risk_profile", "type": "string"}
-                    ],
-                    "measures": [
-                        {"name": "total_portfolio_value", "type": "sum", "sql": "${holdings.value}", "value_format": "$#,##0"},
-                        {"name": "client_count", "type": "count_distinct", "sql": "${client_id}"}
-                    ]
-                },
-                
-                {
-                    "name": "holdings",
-                    "sql_table_name": f"`{project_id}.{dataset_name}.holdings`",
-                    "dimensions": [
-                        {"name": "symbol", "type": "string", "label": "Security Symbol"},
-                        {"name": "asset_class", "type": "string", "label": "Asset Class"},
-                        {"name": "sector", "type": "string", "label": "Sector"}
-                    ],
-                    "measures": [
-                        {"name": "total_value", "type": "sum", "sql": "${TABLE}.value", "value_format": "$#,##0"},
-                        {"name": "avg_current_price", "type": "average", "sql": "${TABLE}.current_price", "value_format": "$#,##0.00"},
-                        {"name": "performance_pct", "type": "number", "sql": "ROUND((${TABLE}.current_price - ${TABLE}.purchase_price) / ${TABLE}.purchase_price * 100, 2)"}
-                    ]
-                }
-            ],
-            
-            "dashboards": [
-                {
-                    "name": "advisor_performance_dashboard",
-                    "title": "Private Banking - Advisor Performance",
-                    "layout": "newspaper",
-                    "elements": [
-                        {
-                            "name": "kpi_total_aum",
-                            "type": "single_value", 
-                            "query": {
-                                "model": "banking_analytics",
-                                "explore": "client_portfolio",
-                                "measures": ["client_portfolio.total_portfolio_value"]
-                            }
-                        },
-                        {
-                            "name": "asset_allocation_chart",
-                            "type": "looker_pie",
-                            "query": {
-                                "model": "banking_analytics", 
-                                "explore": "holdings",
-                                "dimensions": ["holdings.asset_class"],
-                                "measures": ["holdings.total_value"]
-                            }
-                        },
-                        {
-                            "name": "advisor_leaderboard",
-                            "type": "looker_column",
-                            "query": {
-                                "model": "banking_analytics",
-                                "explore": "advisor_performance", 
-                                "dimensions": ["advisor_performance.name"],
-                                "measures": ["advisor_performance.avg_aum"],
-                                "sorts": ["advisor_performance.avg_aum desc"],
-                                "limit": "10"
-                            }
+                    },
+                    {
+                        "name": "advisor_leaderboard",
+                        "type": "looker_column",
+                        "query": {
+                            "model": "banking_analytics",
+                            "explore": "advisor_performance", 
+                            "dimensions": ["advisor_performance.name"],
+                            "measures": ["advisor_performance.avg_aum"],
+                            "sorts": ["advisor_performance.avg_aum desc"],
+                            "limit": "10"
                         }
-                    ]
-                }
-            ],
-            
-            "sql_snippets": {
-                "portfolio_summary": f"""
+                    }
+                ]
+            }
+        ],
+        
+        "sql_snippets": {
+            "portfolio_summary": f"""
                 SELECT 
                     a.name as advisor_name,
                     COUNT(DISTINCT c.client_id) as client_count,
@@ -1055,8 +1077,8 @@ def get_looker_data():
                 GROUP BY a.advisor_id, a.name
                 ORDER BY total_aum DESC
                 """,
-                
-                "monthly_trends": f"""
+            
+            "monthly_trends": f"""
                 SELECT 
                     DATE_TRUNC(DATE(t.date), MONTH) as month,
                     SUM(CASE WHEN t.amount > 0 THEN t.amount ELSE 0 END) as inflows,
@@ -1066,33 +1088,52 @@ def get_looker_data():
                 GROUP BY month
                 ORDER BY month DESC
                 """
-            }
         }
-        
-        return {
-            "looker_config": looker_config,
-            # Return the dashboard IDs directly for easy frontend access
-            "portfolio_overview_id": looker_config["portfolio_dashboards"]["portfolio_overview_id"],
-            "asset_allocation_id": looker_config["portfolio_dashboards"]["asset_allocation_id"], 
-            "performance_risk_id": looker_config["portfolio_dashboards"]["performance_risk_id"],
-            "holdings_transactions_id": looker_config["portfolio_dashboards"]["holdings_transactions_id"],
-            "integration_guide": {
-                "setup_steps": [
-                    "1. Create Looker Studio reports using BigQuery data source",
-                    "2. Configure advisor_id parameter filtering",
-                    "3. Set up real-time data refresh from BigQuery",
-                    "4. Design professional portfolio analytics dashboards",
-                    "5. Enable interactive drill-down capabilities"
-                ],
-                "connection_details": {
-                    "data_source": "bigquery",
-                    "project": project_id,
-                    "dataset": dataset_name,
-                    "authentication": "service_account"
-                }
+    }
+    
+    return {
+        "looker_config": looker_config,
+        # Return the dashboard IDs directly for easy frontend access
+        "portfolio_overview_id": looker_config["portfolio_dashboards"]["portfolio_overview_id"],
+        "asset_allocation_id": looker_config["portfolio_dashboards"]["asset_allocation_id"], 
+        "performance_risk_id": looker_config["portfolio_dashboards"]["performance_risk_id"],
+        "holdings_transactions_id": looker_config["portfolio_dashboards"]["holdings_transactions_id"],
+        "integration_guide": {
+            "setup_steps": [
+                "1. Create Looker Studio reports using BigQuery data source",
+                "2. Configure advisor_id parameter filtering",
+                "3. Set up real-time data refresh from BigQuery",
+                "4. Design professional portfolio analytics dashboards",
+                "5. Enable interactive drill-down capabilities"
+            ],
+            "connection_details": {
+                "data_source": "bigquery",
+                "project": project_id,
+                "dataset": dataset_name,
+                "authentication": "service_account"
             }
         }
-        
+    }
+
+# Serialized and compressed once, by the startup warmup or else the first request
+_looker_integration = None
+
+def _prebuild_looker_integration():
+    global _looker_integration
+    if _looker_integration is None:
+        _looker_integration = responses.Prebuilt(_looker_integration_config())
+    return {"bytes": _looker_integration.stats()}
+
+warmup.register("looker_payload", _prebuild_looker_integration, lane="payloads")
+
+@app.get("/looker-integration")
+async def get_looker_data(request: Request):
+    """Enhanced Looker Studio integration with portfolio-specific dashboard IDs"""
+    try:
+        if _looker_integration is None:
+            _prebuild_looker_integration()
+        # 304 when the client's ETag matches, else the stored bytes for its Accept-Encoding
+        return _looker_integration.response(request)
     except Exception as e:
         print(f"Looker integration error: {e}")
         return {
@@ -1101,174 +1142,31 @@ def get_looker_data():
         }
 
 @app.get("/aggregation")
-def aggregation(advisor_id: Optional[str] = Query(None), client_id: Optional[str] = Query(None)):
+async def aggregation(advisor_id: Optional[str] = Query(None), client_id: Optional[str] = Query(None)):
     """Enhanced Portfolio Insights with comprehensive real data analysis optimized for modern dashboards"""
     try:
         # Default to ADV001 if no advisor_id provided
         current_advisor_id = advisor_id or 'ADV001'
         current_client_id = client_id
         
-        bq_client = bigquery.Client(project=project_id)
-        
-        # Updated portfolio overview query filtered by advisor
-        portfolio_overview_query = f"""
-        SELECT 
-            h.asset_class,
-            COUNT(*) as holdings_count,
-            SUM(h.value) as total_value,
-            AVG(h.value) as avg_holding_value,
-            MIN(h.value) as min_holding,
-            MAX(h.value) as max_holding,
-            COUNT(DISTINCT h.client_id) as clients_count
-        FROM `{project_id}.{dataset_name}.holdings` h
-        JOIN `{project_id}.{dataset_name}.clients` c ON h.client_id = c.client_id
-        WHERE c.advisor_id = '{current_advisor_id}'"""
-        if current_client_id:
-            portfolio_overview_query += f" AND c.client_id = '{current_client_id}'"
-        portfolio_overview_query += """
-        GROUP BY h.asset_class
-        ORDER BY total_value DESC
-        """
-        
-        # Updated top holdings query filtered by advisor
-        top_holdings_query = f"""
-        SELECT 
-            h.symbol,
-            h.asset_class,
-            h.client_id,
-            c.name as client_name,
-            h.value,
-            h.quantity,
-            h.current_price,
-            ROUND((h.current_price - h.purchase_price) / NULLIF(h.purchase_price, 0) * 100, 2) as performance_pct
-        FROM `{project_id}.{dataset_name}.holdings` h
-        JOIN `{project_id}.{dataset_name}.clients` c ON h.client_id = c.client_id
-        WHERE c.advisor_id = '{current_advisor_id}'"""
-        if current_client_id:
-            top_holdings_query += f" AND c.client_id = '{current_client_id}'"
-        top_holdings_query += """
-        ORDER BY h.value DESC
-        LIMIT 10
-        """
-        
-        # Updated advisor distribution query for current advisor
-        advisor_distribution_query = f"""
-        SELECT 
-            a.name as advisor_name,
-            a.advisor_id,
-            COUNT(DISTINCT c.client_id) as client_count,
-            SUM(h.value) as total_aum,
-            AVG(h.value) as avg_client_portfolio,
-            COUNT(DISTINCT h.asset_class) as asset_classes_managed,
-            COUNT(DISTINCT h.symbol) as unique_securities,
-            COUNT(CASE WHEN h.value >= 1000000 THEN 1 END) as high_value_clients,
-            MAX(h.value) as largest_holding,
-            MIN(h.value) as smallest_holding,
-            STDDEV(h.value) as portfolio_volatility
-        FROM `{project_id}.{dataset_name}.advisors` a
-        JOIN `{project_id}.{dataset_name}.clients` c ON a.advisor_id = c.advisor_id
-        JOIN `{project_id}.{dataset_name}.holdings` h ON c.client_id = h.client_id
-        WHERE a.advisor_id = '{current_advisor_id}'"""
-        if current_client_id:
-            advisor_distribution_query += f" AND c.client_id = '{current_client_id}'"
-        advisor_distribution_query += """
-        GROUP BY a.advisor_id, a.name
-        """
-        
-        # Updated risk analysis query filtered by advisor
-        risk_analysis_query = f"""
-        SELECT 
-            h.asset_class,
-            COUNT(*) as positions,
-            SUM(h.value) as exposure,
-            STDDEV(h.value) as volatility,
-            COUNT(DISTINCT h.client_id) as clients_exposed
-        FROM `{project_id}.{dataset_name}.holdings` h
-        JOIN `{project_id}.{dataset_name}.clients` c ON h.client_id = c.client_id
-        WHERE c.advisor_id = '{current_advisor_id}'"""
-        if current_client_id:
-            risk_analysis_query += f" AND c.client_id = '{current_client_id}'"
-        risk_analysis_query += """
-        GROUP BY h.asset_class
-        HAVING COUNT(*) > 0
-        ORDER BY exposure DESC
-        """
-        
-        # Updated activity summary filtered by advisor
-        activity_summary_query = f"""
-        SELECT 
-            DATE(t.date) as activity_date,
-            COUNT(*) as transaction_count,
-            SUM(CASE WHEN t.amount > 0 THEN t.amount ELSE 0 END) as inflows,
-            SUM(CASE WHEN t.amount < 0 THEN ABS(t.amount) ELSE 0 END) as outflows,
-            COUNT(DISTINCT c.client_id) as active_clients
-        FROM `{project_id}.{dataset_name}.transactions` t
-        JOIN `{project_id}.{dataset_name}.accounts` a ON t.account_id = a.account_id
-        JOIN `{project_id}.{dataset_name}.clients` c ON a.client_id = c.client_id
-        WHERE c.advisor_id = '{current_advisor_id}'"""
-        if current_client_id:
-            activity_summary_query += f" AND c.client_id = '{current_client_id}'"
-        activity_summary_query += """
-        AND t.date >= DATE_SUB(CURRENT_DATE(), INTERVAL 7 DAY)
-        GROUP BY DATE(t.date)
-        ORDER BY activity_date DESC
-        LIMIT 5
-        """
-        
-        # Execute all queries
-        portfolio_results = list(bq_client.query(portfolio_overview_query).result())
-        top_holdings_results = list(bq_client.query(top_holdings_query).result())
-        advisor_results = list(bq_client.query(advisor_distribution_query).result())
-        risk_results = list(bq_client.query(risk_analysis_query).result())
-        activity_results = list(bq_client.query(activity_summary_query).result())
+        results = await _aggregation_results_async(current_advisor_id, current_client_id)
+        portfolio_results = results.get("aggregation_portfolio_overview", [])
+        top_holdings_results = results.get("aggregation_top_holdings", [])
+        advisor_results = results.get("aggregation_advisor_distribution", [])
+        risk_results = results.get("aggregation_risk_analysis", [])
+        activity_results = results.get("aggregation_activity_summary", [])
         
         # Calculate totals from simplified data
         total_aum = sum(row.total_value for row in portfolio_results)
         total_clients = sum(row.clients_count for row in portfolio_results)
         
-        # Create simplified AI context
-        portfolio_context = "\n".join([
-            f"{row.asset_class}: ${row.total_value:,.0f} ({row.holdings_count} holdings)"
-            for row in portfolio_results[:5]
-        ])
-        
-        risk_context = "\n".join([
-            f"{row.asset_class}: ${row.exposure:,.0f} exposure, {row.clients_exposed} clients"
-            for row in risk_results[:5]
-        ])
-        
-        # Simplified advisor context for single advisor
-        advisor_context = f"Sample Advisor: {advisor_results[0].client_count} clients, ${advisor_results[0].total_aum:,.0f} AUM" if advisor_results else "No advisor data"
-        
-        # Simplified AI analysis
-        model = GenerativeModel("gemini-1.5-pro")
-        
-        prompt = f"""
-        {BANKING_ADVISOR_SYSTEM_PROMPT}
-        
-        Analyze this portfolio data:
-        
-        Portfolio Summary:
-        {portfolio_context}
-        
-        Risk Analysis:
-        {risk_context}
-        
-        Total AUM: ${total_aum:,.0f}
-        Total Clients: {total_clients}
-        
-        Provide 4 strategic insights for a banking advisor focusing on:
-        1. Portfolio diversification opportunities
-        2. Asset allocation recommendations  
-        3. Risk management strategies
-        4. Client growth opportunities
-        
-        Be specific and actionable.
-        """
-        
-        response = model.generate_content(prompt)
-        ai_insights = response.text.split('\n') if response.text else []
-        insights = [insight.strip('- •') for insight in ai_insights if insight.strip() and len(insight.strip()) > 10]
+        # AI insights come from the background refresher; only a first view waits on Gemini
+        try:
+            cached = await insights.aget("aggregation", (current_advisor_id, current_client_id))
+            ai_insights, insights_freshness = cached.value, cached.freshness
+        except Exception as insights_error:
+            print(f"Portfolio insights generation error for advisor {current_advisor_id}: {insights_error}")
+            ai_insights, insights_freshness = [], None
         
         # Build comprehensive response with simplified structure
         portfolio_insights = {
@@ -1393,12 +1291,13 @@ def aggregation(advisor_id: Optional[str] = Query(None), client_id: Optional[str
                 for row in activity_results
             ],
             
-            "ai_insights": insights[:4] if insights else [
+            "ai_insights": ai_insights[:4] if ai_insights else [
                 "Portfolio demonstrates strong diversification across multiple asset classes with balanced risk exposure",
                 f"Top-performing advisors managing ${sum(row.total_aum for row in advisor_results[:3] if row.total_aum > 0):,.0f} represent efficient client distribution model",
                 "Client concentration analysis suggests opportunities for portfolio rebalancing and advisor workload optimization",
                 "Recent market activity indicates positive client engagement with strategic growth opportunities identified"
             ],
+            "insights_freshness": insights_freshness,
             
             "advisor_context": {
                 "advisor_id": current_advisor_id,
@@ -1409,10 +1308,11 @@ def aggregation(advisor_id: Optional[str] = Query(None), client_id: Optional[str
             
             "data_source": "BigQuery Real-time Data",
             "last_updated": "2025-08-07",
-            "analysis_timestamp": str(bq_client.query("SELECT CURRENT_DATETIME()").result().__next__()[0])
+            "analysis_timestamp": str(datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None))
         }
         
-        return {"aggregation": portfolio_insights}
+        # Rendered straight from the nested dict, skipping FastAPI's jsonable_encoder pass
+        return responses.FastJSONResponse({"aggregation": portfolio_insights})
         
     except Exception as e:
         print(f"Portfolio insights error for advisor {advisor_id}: {e}")
@@ -1433,76 +1333,90 @@ def aggregation(advisor_id: Optional[str] = Query(None), client_id: Optional[str
             "data_source": "Fallback Mode"
         }}
 
+AGGREGATION_QUERIES = [
+    "aggregation_portfolio_overview",
+    "aggregation_top_holdings",
+    "aggregation_advisor_distribution",
+    "aggregation_risk_analysis",
+    "aggregation_activity_summary",
+]
+
+def _aggregation_sections_query(whole_book_snapshot):
+    """Single-row sections query answering /aggregation, or None for the split queries"""
+    if whole_book_snapshot:
+        # Whole book: read the advisor's precomputed snapshot row
+        return "aggregation_snapshot"
+    if AGGREGATION_QUERY_MODE == "fused" and not local_engine.ENABLED:
+        # One job that scans the advisor's holdings once
+        return "aggregation_fused"
+    return None
+
+def _aggregation_results(advisor_id, client_id):
+    """Portfolio overview, top holdings, advisor distribution, risk and recent activity"""
+    params = {"advisor_id": advisor_id, "client_id": client_id or None}
+    sections_query = _aggregation_sections_query(not client_id and snapshots.ready())
+    if sections_query:
+        results = data_access.run_sections_query(sections_query, params, endpoint="aggregation")
+        return {f"aggregation_{section}": rows for section, rows in results.items()}
+    return data_access.run_queries(AGGREGATION_QUERIES, params, endpoint="aggregation")
+
+async def _aggregation_results_async(advisor_id, client_id):
+    """_aggregation_results for the async endpoint"""
+    params = {"advisor_id": advisor_id, "client_id": client_id or None}
+    sections_query = _aggregation_sections_query(not client_id and await snapshots.aready())
+    if sections_query:
+        results = await data_access.run_sections_query_async(sections_query, params, endpoint="aggregation")
+        return {f"aggregation_{section}": rows for section, rows in results.items()}
+    return await data_access.run_queries_async(AGGREGATION_QUERIES, params, endpoint="aggregation")
+
+def _generate_aggregation_insights(scope):
+    """Four strategic insights for one advisor's book, or one client within it"""
+    advisor_id, client_id = scope
+    results = _aggregation_results(advisor_id, client_id)
+    portfolio_results = results.get("aggregation_portfolio_overview", [])
+    risk_results = results.get("aggregation_risk_analysis", [])
+    total_aum = sum(row.total_value for row in portfolio_results)
+    total_clients = sum(row.clients_count for row in portfolio_results)
+    
+    # Largest asset classes first, within the aggregation prompt budget
+    prompt = prompt_budget.build(
+        "aggregation", AGGREGATION_INSIGHTS_PROMPT,
+        sections={
+            "portfolio": [
+                f"{row.asset_class}: ${row.total_value:,.0f} ({row.holdings_count} holdings)"
+                for row in portfolio_results[:5]
+            ],
+            "risk": [
+                f"{row.asset_class}: ${row.exposure:,.0f} exposure, {row.clients_exposed} clients"
+                for row in risk_results[:5]
+            ],
+        },
+        total_aum=total_aum,
+        total_clients=total_clients
+    )
+    
+    response = llm.generate("gemini-1.5-pro", prompt, endpoint="aggregation")
+    ai_insights = response.text.split('\n') if response.text else []
+    insights_list = [insight.strip('- •') for insight in ai_insights if insight.strip() and len(insight.strip()) > 10]
+    if not insights_list:
+        raise ValueError("Gemini returned no usable insights")
+    return insights_list[:4]
+
+insights.register(
+    "aggregation", _generate_aggregation_insights, [*AGGREGATION_QUERIES, "aggregation_snapshot", "aggregation_fused"]
+)
+
 @app.get("/ai-insights")
-def get_ai_insights():
+async def get_ai_insights():
     """AI-powered insights for dashboard"""
     try:
-        bq_client = bigquery.Client(project=project_id)
-        
-        # Get recent market data and client activities
-        recent_activity_query = f"""
-        SELECT c.name as client_name, t.amount, t.category, t.date
-        FROM `{project_id}.{dataset_name}.transactions` t
-        JOIN `{project_id}.{dataset_name}.accounts` a ON t.account_id = a.account_id
-        JOIN `{project_id}.{dataset_name}.clients` c ON a.client_id = c.client_id
-        ORDER BY t.date DESC LIMIT 10
-        """
-        
-        # Get portfolio summary
-        portfolio_summary_query = f"""
-        SELECT h.asset_class, SUM(h.value) as total_value, COUNT(*) as holdings_count
-        FROM `{project_id}.{dataset_name}.holdings` h
-        GROUP BY h.asset_class
-        ORDER BY total_value DESC
-        """
-        
-        recent_activities = list(bq_client.query(recent_activity_query).result())
-        portfolio_summary = list(bq_client.query(portfolio_summary_query).result())
-        
-        # Use Vertex AI to generate insights with Gemini
-        model = GenerativeModel("gemini-1.5-pro")
-        
-        # Create context for AI analysis
-        activity_context = "\n".join([
-            f"{activity.client_name}: {activity.category} ${activity.amount:,.0f} on {activity.date}"
-            for activity in recent_activities[:5]
-        ])
-        
-        portfolio_context = "\n".join([
-            f"{portfolio.asset_class}: ${portfolio.total_value:,.0f} ({portfolio.holdings_count} holdings)"
-            for portfolio in portfolio_summary
-        ])
-        
-        prompt = f"""
-        {BANKING_ADVISOR_SYSTEM_PROMPT}
-        
-        Based on the following real client data, provide 3-4 key insights for the advisor dashboard:
-        
-        Recent Client Activities:
-        {activity_context}
-        
-        Portfolio Breakdown:
-        {portfolio_context}
-        
-        Generate actionable insights focusing on:
-        1. Client behavior patterns
-        2. Portfolio optimization opportunities  
-        3. Risk management recommendations
-        4. Revenue generation opportunities
-        
-        Format as bullet points with specific recommendations.
-        """
-        
-        response = model.generate_content(prompt)
-        
-        ai_insights = response.text.split('\n') if response.text else []
-        # Clean up the insights
-        insights = [insight.strip('- •') for insight in ai_insights if insight.strip() and len(insight.strip()) > 10]
-        
+        # Last good insights from the background refresher, with their age
+        cached = await insights.aget("ai-insights")
         return {
-            "ai_insights": insights[:4],
+            "ai_insights": cached.value,
             "data_source": "BigQuery + Vertex AI",
-            "last_updated": "2025-08-07"
+            "last_updated": "2025-08-07",
+            "insights_freshness": cached.freshness
         }
         
     except Exception as e:
@@ -1519,186 +1433,290 @@ def get_ai_insights():
             "last_updated": "2025-08-07"
         }
 
+def _generate_ai_insights(scope):
+    """Firm-wide dashboard insights from recent activity and the portfolio summary"""
+    # Get recent market data and client activities plus the portfolio summary
+    results = data_access.run_queries(
+        ["insights_recent_activity", "insights_portfolio_summary"], endpoint="ai-insights"
+    )
+    recent_activities = results["insights_recent_activity"]
+    portfolio_summary = results["insights_portfolio_summary"]
+    
+    # Most recent activity first, within the ai-insights prompt budget
+    prompt = prompt_budget.build(
+        "ai-insights", AI_INSIGHTS_PROMPT,
+        sections={
+            "activities": [
+                f"{activity.client_name}: {activity.category} ${activity.amount:,.0f} on {activity.date}"
+                for activity in recent_activities[:5]
+            ],
+            "portfolio": [
+                f"{portfolio.asset_class}: ${portfolio.total_value:,.0f} ({portfolio.holdings_count} holdings)"
+                for portfolio in portfolio_summary
+            ],
+        }
+    )
+    
+    response = llm.generate("gemini-1.5-pro", prompt, endpoint="ai-insights")
+    
+    ai_insights = response.text.split('\n') if response.text else []
+    # Clean up the insights
+    insights_list = [insight.strip('- •') for insight in ai_insights if insight.strip() and len(insight.strip()) > 10]
+    if not insights_list:
+        raise ValueError("Gemini returned no usable insights")
+    return insights_list[:4]
+
+insights.register("ai-insights", _generate_ai_insights, ["insights_recent_activity", "insights_portfolio_summary"])
+
+# Firm-wide caches primed by the startup warmup, after credentials and model handles
+FIRM_INSIGHTS = ["ai-insights", "dashboard-metrics"]
+
+def _warm_dashboard_queries():
+    """Run the firm-wide dashboard queries once so BigQuery's result cache holds them"""
+    results = data_access.run_queries(DASHBOARD_QUERIES, endpoint="warmup")
+    return {name: len(rows) for name, rows in results.items()}
+
+def _warm_firm_insights():
+    """Generate the firm-wide insights the dashboard reads"""
+    failed = []
+    for kind in FIRM_INSIGHTS:
+        try:
+            insights.get(kind)
+        except Exception as e:
+            print(f"Warmup {kind} insights error: {e}")
+            failed.append(kind)
+    if failed:
+        raise RuntimeError(f"No insights for {', '.join(failed)}")
+    return f"{len(FIRM_INSIGHTS)} kinds"
+
+warmup.register("dashboard_queries", _warm_dashboard_queries, requires=["credentials"])
+warmup.register("firm_insights", _warm_firm_insights, requires=["credentials", "model_handles"])
+
+async def _chat_advisor_id(request, data):
+    """advisor_id from the auth context, else looked up from advisor_name, else ADV001"""
+    # First check for advisor_id (from auth context), then advisor_name (legacy)
+    advisor_id = data.get("advisor_id") or request.query_params.get("advisor_id")
+    advisor_name = data.get("advisor_name", "")  # Fallback for manual selection
+
+    # If no advisor_id but we have advisor_name, look it up
+    if not advisor_id and advisor_name:
+        try:
+            advisor_results = await data_access.run_named_async(
+                "advisor_id_by_name", {"advisor_name": advisor_name}, endpoint="chat"
+            )
+            for row in advisor_results:
+                advisor_id = row.advisor_id
+                break
+        except Exception as e:
+            print(f"Error getting advisor_id: {e}")
+
+    # If still no advisor_id, use default ADV001
+    if not advisor_id:
+        advisor_id = 'ADV001'
+        print(f"Using default advisor: {advisor_id}")
+    return advisor_id
+
+async def _chat_context(advisor_id):
+    """Advisor's clients, tasks, recent transactions and portfolio breakdown for the chat prompt"""
+    # Reused across the messages of a conversation until the data changes or the snapshot expires
+    snapshot = await chat_context.aget(advisor_id, _build_chat_context)
+    return snapshot.context
+
+def _build_chat_context(advisor_id):
+    # Run the four queries concurrently
+    clients_query = snapshots.pick("chat_clients")
+    portfolio_query = snapshots.pick("chat_portfolio")
+    results = data_access.run_queries(
+        [clients_query, "advisor_tasks", "chat_transactions", portfolio_query],
+        {"advisor_id": advisor_id},
+        endpoint="chat",
+    )
+    clients_results = results[clients_query]
+    tasks_results = results["advisor_tasks"]
+    transactions_results = results["chat_transactions"]
+    portfolio_results = results[portfolio_query]
+
+    # Build context for Vertex AI
+    return {
+        "clients": [{"name": row.name, "portfolio_value": row.portfolio_value} for row in clients_results],
+        "tasks": [{"task": row.task, "priority": row.priority} for row in tasks_results],
+        "recent_transactions": [{"client": row.client_name, "amount": row.amount, "category": row.category, "date": str(row.date)} for row in transactions_results],
+        "portfolio_breakdown": [{"asset_class": row.asset_class, "count": row.count, "value": row.total_value} for row in portfolio_results]
+    }
+
+def _chat_prompt(message, context_data):
+    """Chat prompt with the advisor's data ranked into sections under the chat token budget"""
+    return prompt_budget.build(
+        "chat", CHAT_PROMPT,
+        sections={
+            "clients": [f"• {client['name']}: ${client['portfolio_value']:,.0f}" for client in context_data['clients'][:5]],
+            "tasks": [f"• {task['task']} (Priority: {task['priority']})" for task in context_data['tasks'][:5]],
+            "transactions": [f"• {trans['client']}: {trans['category']} ${trans['amount']:,.0f} on {trans['date']}" for trans in context_data['recent_transactions'][:5]],
+            "portfolio": [f"• {portfolio['asset_class']}: {portfolio['count']} holdings, ${portfolio['value']:,.0f}" for portfolio in context_data['portfolio_breakdown']],
+        },
+        inputs={"message": message}
+    )
+
+def _chat_fallback(message, context_data, model_error=None):
+    """Answer from the BigQuery data alone when no Gemini model responded"""
+    if any(word in message for word in ["client", "customer", "top", "valuable", "worth"]):
+        client_list = [f"• {client['name']}: ${client['portfolio_value']:,.0f}" for client in context_data['clients'][:5]]
+        total_aum = sum(client['portfolio_value'] for client in context_data['clients'])
+        return {
+            "response": f"Your top clients by portfolio value:\n\n" + "\n".join(client_list) + f"\n\nTotal AUM: ${total_aum:,.0f}",
+            "role": "Wealth Manager",
+            "platform": "AI-Powered Platform"
+        }
+    elif any(word in message for word in ["task", "todo", "priority"]):
+        task_list = [f"• {task['task']}" for task in context_data['tasks'][:5]]
+        return {
+            "response": f"Your priority tasks:\n\n" + "\n".join(task_list),
+            "role": "Wealth Manager",
+            "platform": "AI-Powered Platform"
+        }
+    # If all models failed, show model error
+    if model_error:
+        return {
+            "response": f"Vertex AI error: {model_error}. Please check your model access or try again later.",
+            "role": "Wealth Manager",
+            "platform": "AI-Powered Platform"
+        }
+    return {
+        "response": f"Based on your BigQuery data, I can help you with information about your {len(context_data['clients'])} clients and ${sum(client['portfolio_value'] for client in context_data['clients']):,.0f} total AUM.",
+        "role": "Wealth Manager",
+        "platform": "AI-Powered Platform"
+    }
+
+CHAT_DATA_ERROR = "I apologize, but I'm having trouble accessing your data right now. Please ensure your BigQuery tables are accessible and try again."
+CHAT_GENERIC_ERROR = "I'm here to help with your advisory questions. Please specify an advisor name and ask about clients, tasks, or portfolio data!"
+
 @app.post("/chat")
 async def chat(request: Request):
     try:
         data = await request.json()
         message = data.get("message", "").lower().strip()
-        
-        # First check for advisor_id (from auth context), then advisor_name (legacy)
-        advisor_id = data.get("advisor_id") or request.query_params.get("advisor_id")
-        advisor_name = data.get("advisor_name", "")  # Fallback for manual selection
-        print(f"Received message: {message}, Advisor ID: {advisor_id}, Advisor Name: {advisor_name}")
-        
-        # If no advisor_id but we have advisor_name, look it up
-        if not advisor_id and advisor_name:
-            try:
-                bq_client = bigquery.Client(project=project_id)
-                advisor_query = f"""
-                SELECT advisor_id FROM `{project_id}.{dataset_name}.advisors` 
-                WHERE LOWER(name) = LOWER('{advisor_name}') LIMIT 1
-                """
-                advisor_results = bq_client.query(advisor_query).result()
-                for row in advisor_results:
-                    advisor_id = row.advisor_id
-                    break
-            except Exception as e:
-                print(f"Error getting advisor_id: {e}")
-        
-        # If still no advisor_id, use default ADV001
-        if not advisor_id:
-            advisor_id = 'ADV001'
-            print(f"Using default advisor: {advisor_id}")
+        advisor_id = await _chat_advisor_id(request, data)
         
         # Always proceed with advisor_id (either from context, lookup, or default)
         # Now process the question with advisor context using BigQuery + Vertex AI
         try:
-            bq_client = bigquery.Client(project=project_id)
-            
             # Get comprehensive advisor context from BigQuery
-            context_data = {}
-            
-            # Get advisor's clients
-            clients_query = f"""
-            SELECT c.name, c.client_id, 
-                   COALESCE(SUM(h.value), 0) as portfolio_value
-            FROM `{project_id}.{dataset_name}.clients` c
-            LEFT JOIN `{project_id}.{dataset_name}.holdings` h ON c.client_id = h.client_id
-            WHERE c.advisor_id = '{advisor_id}'
-            GROUP BY c.client_id, c.name
-            ORDER BY portfolio_value DESC
-            """
-            
-            # Get advisor's tasks
-            tasks_query = f"""
-            SELECT tt.task, tt.priority, c.name as client_name
-            FROM `{project_id}.{dataset_name}.todo_tasks` tt
-            LEFT JOIN `{project_id}.{dataset_name}.clients` c ON tt.client_id = c.client_id
-            WHERE c.advisor_id = '{advisor_id}' OR tt.client_id IS NULL
-            ORDER BY tt.priority ASC LIMIT 10
-            """
-            
-            # Get recent transactions for advisor's clients
-            transactions_query = f"""
-            SELECT t.amount, t.category, t.date, c.name as client_name
-            FROM `{project_id}.{dataset_name}.transactions` t
-            JOIN `{project_id}.{dataset_name}.accounts` a ON t.account_id = a.account_id
-            JOIN `{project_id}.{dataset_name}.clients` c ON a.client_id = c.client_id
-            WHERE c.advisor_id = '{advisor_id}'
-            ORDER BY t.date DESC LIMIT 10
-            """
-            
-            # Get portfolio breakdown for advisor's clients
-            portfolio_query = f"""
-            SELECT h.asset_class, COUNT(*) as count, SUM(h.value) as total_value
-            FROM `{project_id}.{dataset_name}.holdings` h
-            JOIN `{project_id}.{dataset_name}.clients` c ON h.client_id = c.client_id
-            WHERE c.advisor_id = '{advisor_id}'
-            GROUP BY h.asset_class
-            ORDER BY total_value DESC
-            """
-            
-            # Execute all queries
-            clients_results = list(bq_client.query(clients_query).result())
-            tasks_results = list(bq_client.query(tasks_query).result())
-            transactions_results = list(bq_client.query(transactions_query).result())
-            portfolio_results = list(bq_client.query(portfolio_query).result())
-            
-            # Build context for Vertex AI
-            context_data = {
-                "clients": [{"name": row.name, "portfolio_value": row.portfolio_value} for row in clients_results],
-                "tasks": [{"task": row.task, "priority": row.priority} for row in tasks_results],
-                "recent_transactions": [{"client": row.client_name, "amount": row.amount, "category": row.category, "date": str(row.date)} for row in transactions_results],
-                "portfolio_breakdown": [{"asset_class": row.asset_class, "count": row.count, "value": row.total_value} for row in portfolio_results]
-            }
-            
-            print(f"Context data: {context_data}")  # Debug log
+            context_data = await _chat_context(advisor_id)
             
             # Use Vertex AI with real data context using Gemini
-            prompt = f"""
-            {BANKING_ADVISOR_SYSTEM_PROMPT}
-
-            You are responding as the AI assistant for a private banking advisor.
-
-            CURRENT ADVISOR DATA FROM BIGQUERY:
-
-            Top Clients:
-            {chr(10).join([f"• {client['name']}: ${client['portfolio_value']:,.0f}" for client in context_data['clients'][:5]])}
+            prompt = _chat_prompt(message, context_data)
 
-            Current Tasks:
-            {chr(10).join([f"• {task['task']} (Priority: {task['priority']})" for task in context_data['tasks'][:5]])}
-
-            Recent Transactions:
-            {chr(10).join([f"• {trans['client']}: {trans['category']} ${trans['amount']:,.0f} on {trans['date']}" for trans in context_data['recent_transactions'][:5]])}
-
-            Portfolio Breakdown:
-            {chr(10).join([f"• {portfolio['asset_class']}: {portfolio['count']} holdings, ${portfolio['value']:,.0f}" for portfolio in context_data['portfolio_breakdown']])}
-
-            CLIENT QUESTION: {message}
-
-            Based on the REAL DATA above, provide a detailed, specific response that uses the actual client names, amounts, and data from BigQuery. 
-            Be specific and reference the actual data points. Do not use generic examples.
-            """
-
-            # Try gemini-pro, then gemini-1.0-pro as fallback
-            model = None
-            response = None
-            model_error = None
-            for model_name in ["gemini-pro", "gemini-1.0-pro"]:
-                try:
-                    model = GenerativeModel(model_name)
-                    response = model.generate_content(prompt)
-                    if response.text and len(response.text.strip()) > 10:
-                        break
-                except Exception as e:
-                    model_error = str(e)
-                    print(f"Vertex AI model error for {model_name}: {e}")
-                    response = None
+            # Try gemini-pro, then gemini-1.0-pro as fallback, skipping a model that is down
+            response, model_name, model_error = await llm.agenerate_with_fallback(
+                llm.FALLBACK_MODELS, prompt, endpoint="chat",
+                accept=lambda response: response.text and len(response.text.strip()) > 10
+            )
 
             if response and response.text and len(response.text.strip()) > 10:
                 return {
                     "response": response.text.strip(),
                     "role": "Wealth Manager",
                     "platform": "AI-Powered Platform",
-                    "data_source": f"BigQuery + Vertex AI ({model_name})"
+                    "data_source": f"BigQuery + Vertex AI ({model_name})",
+                    "prompt_stats": prompt.stats
                 }
             else:
                 # Fallback with real data if Vertex AI fails
-                if any(word in message for word in ["client", "customer", "top", "valuable", "worth"]):
-                    client_list = [f"• {client['name']}: ${client['portfolio_value']:,.0f}" for client in context_data['clients'][:5]]
-                    total_aum = sum(client['portfolio_value'] for client in context_data['clients'])
-                    return {
-                        "response": f"Your top clients by portfolio value:\n\n" + "\n".join(client_list) + f"\n\nTotal AUM: ${total_aum:,.0f}",
-                        "role": "Wealth Manager",
-                        "platform": "AI-Powered Platform"
-                    }
-                elif any(word in message for word in ["task", "todo", "priority"]):
-                    task_list = [f"• {task['task']}" for task in context_data['tasks'][:5]]
-                    return {
-                        "response": f"Your priority tasks:\n\n" + "\n".join(task_list),
-                        "role": "Wealth Manager",
-                        "platform": "AI-Powered Platform"
-                    }
-                # If all models failed, show model error
-                if model_error:
-                    return {
-                        "response": f"Vertex AI error: {model_error}. Please check your model access or try again later.",
-                        "role": "Wealth Manager",
-                        "platform": "AI-Powered Platform"
-                    }
-                return {
-                    "response": f"Based on your BigQuery data, I can help you with information about your {len(context_data['clients'])} clients and ${sum(client['portfolio_value'] for client in context_data['clients']):,.0f} total AUM.",
-                    "role": "Wealth Manager",
-                    "platform": "AI-Powered Platform"
-                }
+                return _chat_fallback(message, context_data, model_error)
             
         except Exception as e:
             print(f"BigQuery/Vertex AI error: {e}")
-            return {"response": f"I apologize, but I'm having trouble accessing your data right now. Please ensure your BigQuery tables are accessible and try again."}
+            return {"response": CHAT_DATA_ERROR}
         
     except Exception as e:
         print(f"Chat error: {e}")
-        return {"response": "I'm here to help with your advisory questions. Please specify an advisor name and ask about clients, tasks, or portfolio data!"}
+        return {"response": CHAT_GENERIC_ERROR}
+
+# Open /chat/stream responses: stream_id -> cancellation flag
+_chat_streams = {}
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/chat/stream")
+async def chat_stream(request: Request):
+    """/chat as Server-Sent Events: a start event with the stream_id, token events
+    as Gemini generates, then done. Generation stops when the client disconnects
+    or calls /chat/stream/{stream_id}/cancel."""
+    stream_id = uuid.uuid4().hex
+    cancelled = threading.Event()
+    # Read the body before streaming starts; afterwards the response owns receive()
+    try:
+        data = await request.json()
+    except Exception as e:
+        print(f"Chat error: {e}")
+        data = None
+
+    async def events():
+        _chat_streams[stream_id] = cancelled
+        try:
+            yield _sse("start", {"stream_id": stream_id})
+            try:
+                message = data.get("message", "").lower().strip()
+                advisor_id = await _chat_advisor_id(request, data)
+            except Exception as e:
+                print(f"Chat error: {e}")
+                yield _sse("token", {"text": CHAT_GENERIC_ERROR})
+                yield _sse("done", {})
+                return
+            try:
+                context_data = await _chat_context(advisor_id)
+            except Exception as e:
+                print(f"BigQuery/Vertex AI error: {e}")
+                yield _sse("token", {"text": CHAT_DATA_ERROR})
+                yield _sse("done", {})
+                return
+
+            prompt = _chat_prompt(message, context_data)
+            model_name = None
+            try:
+                async for model_name, text in llm.astream_with_fallback(
+                    llm.FALLBACK_MODELS, prompt, endpoint="chat", cancelled=cancelled
+                ):
+                    yield _sse("token", {"text": text})
+            except Exception as e:
+                if model_name is None:
+                    # No model produced anything: answer from the data instead
+                    fallback = _chat_fallback(message, context_data, str(e))
+                    yield _sse("token", {"text": fallback["response"]})
+                    yield _sse("done", {"role": fallback["role"], "platform": fallback["platform"]})
+                else:
+                    print(f"Chat stream error from {model_name}: {e}")
+                    yield _sse("error", {"message": "The response was interrupted. Please try again."})
+                return
+            if cancelled.is_set():
+                yield _sse("cancelled", {})
+                return
+            yield _sse("done", {
+                "role": "Wealth Manager",
+                "platform": "AI-Powered Platform",
+                "data_source": f"BigQuery + Vertex AI ({model_name})",
+                "prompt_stats": prompt.stats
+            })
+        finally:
+            # Client went away or the stream ended: stop generating
+            cancelled.set()
+            _chat_streams.pop(stream_id, None)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.post("/chat/stream/{stream_id}/cancel")
+def cancel_chat_stream(stream_id: str):
+    """Stop an in-progress /chat/stream response"""
+    cancelled = _chat_streams.get(stream_id)
+    if cancelled is None:
+        return {"cancelled": False, "stream_id": stream_id}
+    cancelled.set()
+    return {"cancelled": True, "stream_id": stream_id}
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,214 @@
+# Nightly next-best-action generation
+#
+# Reads every client's profile and recent transactions in bulk queries,
+# generates three client-specific actions per client from NBA_GENERATION_PROMPT
+# with at most NBA_BATCH_CONCURRENCY Gemini calls in flight, and publishes them
+# to the nba_recommendations table, which /nba reads by advisor. Clients whose
+# generation fails keep the actions from the previous run. The SQL lives in
+# backend/queries.py. Run it on a nightly schedule with
+#   python -m backend.nba_batch [advisor_id ...]
+
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from backend import data_access, llm, local_engine, prompt_budget
+from backend.config import project_id, dataset_name
+from backend.prompt_templates import NBA_GENERATION_PROMPT, NBA_JSON_FORMAT
+
+NBA_BATCH_CONCURRENCY = int(os.getenv("NBA_BATCH_CONCURRENCY", "8"))
+NBA_ACTIVITY_PER_CLIENT = int(os.getenv("NBA_ACTIVITY_PER_CLIENT", "5"))
+# Clients per publish statement, which keeps the JSON payload parameter small
+NBA_PUBLISH_BATCH = int(os.getenv("NBA_PUBLISH_BATCH", "200"))
+# Actions /nba returns for an advisor, highest priority first
+NBA_MAX_ACTIONS = int(os.getenv("NBA_MAX_ACTIONS", "10"))
+
+PRIORITIES = ("High", "Medium", "Low")
+
+_ready = None
+_run_lock = threading.Lock()
+last_run = {}
+
+
+def ready():
+    """True once the nba_recommendations table exists; checked once, then after each run"""
+    global _ready
+    if local_engine.OFFLINE:
+        return False
+    if _ready is None:
+        from google.api_core.exceptions import NotFound
+        try:
+            data_access.get_client().get_table(f"{project_id}.{dataset_name}.nba_recommendations")
+            _ready = True
+        except NotFound:
+            print("nba_recommendations table not found; /nba generates actions live until the first batch run")
+            _ready = False
+        except Exception as e:
+            # Transient/auth failure: generate live now and check again next time
+            print(f"NBA table check failed: {e}")
+            return False
+    return _ready
+
+
+async def aready():
+    """ready() for async endpoints; until the answer is known the table check runs on a worker thread"""
+    if local_engine.OFFLINE or _ready is not None:
+        return ready()
+    return await asyncio.get_running_loop().run_in_executor(None, ready)
+
+
+def parse_actions(text):
+    """Up to three action dicts from a model response; JSON first, bullet lines as a fallback"""
+    body = text.strip()
+    if body.startswith("```"):
+        # ```json ... ``` fence
+        body = body.strip("`")
+        body = body[body.find("\n") + 1:]
+    try:
+        items = json.loads(body)
+    except ValueError:
+        items = [{"action": line.strip("-•* ")} for line in text.splitlines() if len(line.strip("-•* ")) > 10]
+    actions = []
+    for item in items if isinstance(items, list) else []:
+        if not isinstance(item, dict) or not str(item.get("action") or "").strip():
+            continue
+        priority = str(item.get("priority") or "").strip().capitalize()
+        actions.append({
+            "action": str(item["action"]).strip(),
+            "rationale": str(item.get("rationale") or ""),
+            "expected_outcome": str(item.get("expected_outcome") or ""),
+            "priority": priority if priority in PRIORITIES else "Medium",
+            "timeline": str(item.get("timeline") or ""),
+        })
+    return actions[:3]
+
+
+def _market_context(rows):
+    """Firm-wide allocation lines, largest asset class first"""
+    return [
+        f"- {row.asset_class}: ${row.total_value:,.0f} firm-wide ({row.holdings_count} holdings)"
+        for row in sorted(rows, key=lambda row: row.total_value, reverse=True)
+    ]
+
+
+def _client_prompt(profile, activity, market_lines):
+    recent = "; ".join(f"{row.date} {row.category} ${row.amount:,.0f}" for row in activity)
+    return prompt_budget.build(
+        "nba-batch", NBA_GENERATION_PROMPT + NBA_JSON_FORMAT,
+        sections={"market_data": market_lines},
+        client_name=profile.client_name,
+        net_worth=float(profile.net_worth or 0),
+        risk_tolerance=profile.risk_tolerance or "Unknown",
+        investment_objective=profile.investment_objective or "Unknown",
+        recent_activity=recent or "No recent transactions",
+    )
+
+
+def _generate(profile, activity, market_lines):
+    """Rows to publish for one client, or None when no model produced usable actions"""
+    try:
+        response, model_name, error = llm.generate_with_fallback(
+            llm.FALLBACK_MODELS, _client_prompt(profile, activity, market_lines), endpoint="nba-batch",
+            accept=lambda response: bool(response.text and parse_actions(response.text))
+        )
+        actions = parse_actions(response.text) if response and response.text else []
+    except Exception as e:
+        actions, error = [], str(e)
+    if not actions:
+        print(f"NBA generation failed for client {profile.client_id}: {error or 'no usable actions'}")
+        return None
+    return [
+        {
+            "advisor_id": profile.advisor_id,
+            "client_id": profile.client_id,
+            "client_name": profile.client_name,
+            "rank": rank,
+            **action,
+            "model": model_name,
+        }
+        for rank, action in enumerate(actions, start=1)
+    ]
+
+
+def _publish(records, run_id):
+    client_ids = sorted({record["client_id"] for record in records})
+    for start in range(0, len(client_ids), NBA_PUBLISH_BATCH):
+        batch = set(client_ids[start:start + NBA_PUBLISH_BATCH])
+        data_access.run_named("nba_publish", {
+            "client_ids": sorted(batch),
+            "payload": json.dumps([record for record in records if record["client_id"] in batch]),
+            "run_id": run_id,
+        }, endpoint="nba-batch")
+    return len(client_ids)
+
+
+def run(advisor_ids=None):
+    """Generate and publish actions for every client, or only the given advisors' clients.
+
+    Returns counts and timings for the run.
+    """
+    global _ready
+    params = {"advisor_ids": list(advisor_ids or []), "per_client": NBA_ACTIVITY_PER_CLIENT}
+    with _run_lock:
+        started = time.perf_counter()
+        run_id = uuid.uuid4().hex
+        data_access.run_named("nba_create_table", endpoint="nba-batch")
+        _ready = True
+        results = data_access.run_queries(
+            ["nba_client_profiles", "nba_recent_activity", "insights_portfolio_summary"],
+            params, endpoint="nba-batch"
+        )
+        profiles = results["nba_client_profiles"]
+        activity = {}
+        for row in results["nba_recent_activity"]:
+            activity.setdefault(row.client_id, []).append(row)
+        market_data = _market_context(results["insights_portfolio_summary"])
+        read_ms = (time.perf_counter() - started) * 1000
+
+        generate_started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=NBA_BATCH_CONCURRENCY, thread_name_prefix="nba-batch") as pool:
+            generated = list(pool.map(
+                lambda profile: _generate(profile, activity.get(profile.client_id, []), market_data), profiles
+            ))
+        records = [record for client_records in generated if client_records for record in client_records]
+        generate_ms = (time.perf_counter() - generate_started) * 1000
+
+        published = _publish(records, run_id) if records else 0
+        last_run.clear()
+        last_run.update({
+            "run_id": run_id,
+            "scope": "full" if not params["advisor_ids"] else f"{len(params['advisor_ids'])} advisors",
+            "clients": len(profiles),
+            "published": published,
+            "failed": len(profiles) - published,
+            "actions": len(records),
+            "read_ms": round(read_ms, 1),
+            "generate_ms": round(generate_ms, 1),
+            "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+            "completed_at": time.time(),
+        })
+    # Cached /nba reads predate the new actions
+    data_access.invalidate_cache("nba_for_advisor")
+    print(f"NBA batch finished: {last_run}")
+    return dict(last_run)
+
+
+def run_in_background(advisor_ids=None):
+    """Start a run without blocking the caller"""
+    def target():
+        try:
+            run(advisor_ids)
+        except Exception as e:
+            print(f"NBA batch error: {e}")
+    threading.Thread(target=target, name="nba-batch", daemon=True).start()
+
+
+if __name__ == "__main__":
+    # python -m backend.nba_batch [advisor_id ...]
+    print(run(sys.argv[1:] or None))
+    data_access.shutdown()
@@ -0,0 +1,153 @@
+# Token-budgeted prompt assembly
+#
+# Endpoints build their Gemini prompts with build() instead of formatting the
+# whole data context into an f-string. The template's data slots are filled
+# under a per-endpoint token budget (PROMPT_BUDGET_<ENDPOINT>, e.g.
+# PROMPT_BUDGET_CHAT=2000):
+#   - sections are ranked lists of context lines, most important section first
+#     and most relevant line first. Every non-empty section keeps its top line,
+#     then lines are added in rank order while the budget lasts.
+#   - inputs are free text from the request (a chat question, content to
+#     summarize). They are cut down to fit only when they would not fit whole.
+#
+# The system prompt is not formatted into the text. It travels with the Prompt
+# and backend/llm.py sends it as the model's system instruction on a handle
+# kept per (model, system prompt), so the shared prefix is prepared once and is
+# byte-identical on every call. Each build records its token counts in
+# telemetry, and the stats are kept on the Prompt for the caller.
+
+import math
+import os
+
+from backend import telemetry
+from backend.prompt_templates import BANKING_ADVISOR_SYSTEM_PROMPT
+
+# "estimate" counts CHARS_PER_TOKEN characters as one token. "local" uses the
+# Vertex AI SDK's offline Gemini tokenizer, which needs sentencepiece and
+# downloads the tokenizer model on first use.
+PROMPT_TOKENIZER = os.getenv("PROMPT_TOKENIZER", "estimate").lower()
+PROMPT_TOKENIZER_MODEL = os.getenv("PROMPT_TOKENIZER_MODEL", "gemini-1.5-pro-002")
+CHARS_PER_TOKEN = 4
+
+# Whole-prompt budget (system prompt included) per endpoint
+DEFAULT_PROMPT_BUDGETS = {
+    "chat": 1500,
+    "aggregation": 1200,
+    "ai-insights": 1200,
+    "dashboard-metrics": 800,
+    "todo": 800,
+    "nba": 800,
+    "nba-batch": 1200,
+    "draft-message": 1500,
+    "calendar-invite": 1000,
+    "summarize": 8000,
+    "summarize-chunk": 3000,
+}
+DEFAULT_PROMPT_BUDGET = int(os.getenv("PROMPT_BUDGET_DEFAULT", "2000"))
+# Inputs are never cut below this many tokens, even over budget
+MIN_INPUT_TOKENS = 64
+
+_tokenizer = None
+
+
+class Prompt:
+    """User prompt text plus the system prompt it is sent with"""
+
+    def __init__(self, text, system=None, stats=None):
+        self.text = text
+        self.system = system
+        self.stats = stats or {}
+
+    def __str__(self):
+        return self.text
+
+
+def budget(endpoint):
+    default = DEFAULT_PROMPT_BUDGETS.get(endpoint, DEFAULT_PROMPT_BUDGET)
+    return int(os.getenv(f"PROMPT_BUDGET_{endpoint.upper().replace('-', '_')}", default))
+
+
+def _local_tokenizer():
+    global _tokenizer
+    if _tokenizer is None:
+        from vertexai.preview.tokenization import get_tokenizer_for_model
+        _tokenizer = get_tokenizer_for_model(PROMPT_TOKENIZER_MODEL)
+    return _tokenizer
+
+
+def count_tokens(text):
+    global PROMPT_TOKENIZER
+    if not text:
+        return 0
+    if PROMPT_TOKENIZER == "local":
+        try:
+            return _local_tokenizer().count_tokens(text).total_tokens
+        except Exception as e:
+            print(f"Local tokenizer unavailable, estimating token counts: {e}")
+            PROMPT_TOKENIZER = "estimate"
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def truncate(text, max_tokens):
+    """text cut at a word boundary to about max_tokens tokens"""
+    tokens = count_tokens(text)
+    if tokens <= max_tokens:
+        return text
+    limit = int(len(text) * max_tokens / tokens)
+    cut = text.rfind(" ", 0, limit)
+    return text[:cut if cut > limit // 2 else limit].rstrip() + " [truncated]"
+
+
+def build(endpoint, template, sections=None, inputs=None, system=BANKING_ADVISOR_SYSTEM_PROMPT, **fields):
+    """Fill template under the endpoint's token budget and return a Prompt.
+
+    sections maps a template field to its ranked lines, in order of importance;
+    inputs maps a field to request text; fields are formatted as they are. A
+    {system_prompt} slot in the template is left empty, since the system prompt
+    is sent separately.
+    """
+    sections = sections or {}
+    inputs = inputs or {}
+    limit = budget(endpoint)
+    system_tokens = count_tokens(system)
+    empty = {name: "" for name in list(sections) + list(inputs)}
+    remaining = limit - system_tokens - count_tokens(template.format(system_prompt="", **fields, **empty))
+
+    # The top line of every section first, then the request inputs, then the
+    # rest of the context in rank order
+    costs = {name: [count_tokens(line) + 1 for line in lines] for name, lines in sections.items()}
+    kept = {name: min(len(lines), 1) for name, lines in sections.items()}
+    remaining -= sum(cost[0] for cost in costs.values() if cost)
+
+    fitted = {}
+    truncated = []
+    for index, (name, text) in enumerate(inputs.items()):
+        share = max(remaining // (len(inputs) - index), MIN_INPUT_TOKENS)
+        fitted[name] = truncate(text, share)
+        if fitted[name] is not text:
+            truncated.append(name)
+        remaining -= count_tokens(fitted[name])
+
+    for name, cost in costs.items():
+        for line_cost in cost[kept[name]:]:
+            if line_cost > remaining:
+                break
+            remaining -= line_cost
+            kept[name] += 1
+
+    rendered = {name: "\n".join(lines[:kept[name]]) for name, lines in sections.items()}
+    text = template.format(system_prompt="", **fields, **rendered, **fitted).strip()
+    prompt_tokens = count_tokens(text)
+    stats = {
+        "endpoint": endpoint,
+        "budget": limit,
+        "system_tokens": system_tokens,
+        "prompt_tokens": prompt_tokens,
+        "total_tokens": system_tokens + prompt_tokens,
+        "over_budget": system_tokens + prompt_tokens > limit,
+        "dropped": {name: len(lines) - kept[name] for name, lines in sections.items() if len(lines) > kept[name]},
+        "truncated": truncated,
+        "tokenizer": PROMPT_TOKENIZER,
+    }
+    telemetry.record_prompt(stats)
+    return Prompt(text, system, stats)
@@ -66,6 +66,12 @@ Format each recommendation with:
 - Estimated timeline
 """
 
+# Appended to NBA_GENERATION_PROMPT by the nightly batch so each action can be stored as a row
+NBA_JSON_FORMAT = """
+Return only a JSON array of exactly 3 objects, most important first, each with the keys
+"action", "rationale", "expected_outcome", "priority" (High, Medium or Low) and "timeline".
+"""
+
 # Message Drafting Prompt Template  
 MESSAGE_DRAFTING_PROMPT = """
 {system_prompt}
@@ -181,3 +187,123 @@ Check for:
 
 Provide compliance assessment and any necessary modifications or disclaimers.
 """
+
+# ---------------------------------------------------------------------------
+# Endpoint prompts, filled under a token budget by backend/prompt_budget.py.
+# The system prompt is sent separately, so these have no {system_prompt} slot.
+# ---------------------------------------------------------------------------
+
+# Chat with the advisor's live data
+CHAT_PROMPT = """
+You are responding as the AI assistant for a private banking advisor.
+
+CURRENT ADVISOR DATA FROM BIGQUERY:
+
+Top Clients:
+{clients}
+
+Current Tasks:
+{tasks}
+
+Recent Transactions:
+{transactions}
+
+Portfolio Breakdown:
+{portfolio}
+
+CLIENT QUESTION: {message}
+
+Based on the REAL DATA above, provide a detailed, specific response that uses the actual client names, amounts, and data from BigQuery. 
+Be specific and reference the actual data points. Do not use generic examples.
+"""
+
+# Firm-wide dashboard insights (/ai-insights)
+AI_INSIGHTS_PROMPT = """
+Based on the following real client data, provide 3-4 key insights for the advisor dashboard:
+
+Recent Client Activities:
+{activities}
+
+Portfolio Breakdown:
+{portfolio}
+
+Generate actionable insights focusing on:
+1. Client behavior patterns
+2. Portfolio optimization opportunities  
+3. Risk management recommendations
+4. Revenue generation opportunities
+
+Format as bullet points with specific recommendations.
+"""
+
+# Short KPI insights (/dashboard-metrics)
+DASHBOARD_INSIGHTS_PROMPT = """
+Generate 4 concise dashboard insights for: {context}
+
+Focus on:
+1. Performance highlight
+2. Risk observation
+3. Opportunity identification
+4. Action recommendation
+
+Keep each insight under 15 words, dashboard-friendly format.
+"""
+
+# Advisor book analysis (/aggregation)
+AGGREGATION_INSIGHTS_PROMPT = """
+Analyze this portfolio data:
+
+Portfolio Summary:
+{portfolio}
+
+Risk Analysis:
+{risk}
+
+Total AUM: ${total_aum:,.0f}
+Total Clients: {total_clients}
+
+Provide 4 strategic insights for a banking advisor focusing on:
+1. Portfolio diversification opportunities
+2. Asset allocation recommendations  
+3. Risk management strategies
+4. Client growth opportunities
+
+Be specific and actionable.
+"""
+
+# Task list ordering (/todo)
+TODO_ORDERING_PROMPT = """
+Prioritize these tasks for advisor {advisor_id}:
+{tasks}
+Return a numbered list.
+"""
+
+# Generic next best actions from recent activity (/nba before the batch has run)
+NBA_ACTIVITY_PROMPT = """
+Based on recent client activity:
+{recent_activity}
+Suggest 3 next best actions for a private bank advisor.
+Format as bullet points.
+"""
+
+# Meeting request parsing (/calendar-invite)
+CALENDAR_PARSE_PROMPT = """
+Parse this meeting request and suggest calendar event details:
+"{details}"
+
+Return in format:
+Title: [meeting title]
+Description: [meeting description]
+Duration: [suggested duration in minutes]
+"""
+
+# One excerpt of a long document (/summarize map step). Carries nothing but the
+# excerpt, so its summary can be cached by the excerpt's content.
+CHUNK_SUMMARIZATION_PROMPT = """
+Summarize this excerpt from a longer document for a private banking advisor.
+Keep the facts, figures, names, dates, decisions and action items; leave out filler.
+Use at most 150 words.
+
+Excerpt:
+{content}
+"""
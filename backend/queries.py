@@ -0,0 +1,841 @@
+# Named, parameterized BigQuery queries used by the API endpoints
+#
+# Each query is registered once with its table names resolved, so the query text
+# is identical for every advisor and BigQuery can reuse cached results. Values
+# such as advisor_id are bound at run time as query parameters, never formatted
+# into the SQL. Queries registered with a cache_ttl are also served from the
+# in-process result cache (backend/cache.py) for that many seconds. local_sql
+# overrides the automatic BigQuery -> SQLite translation used by the embedded
+# local engine (backend/local_engine.py).
+
+import os
+
+from backend.config import project_id, dataset_name
+
+# Result-cache TTLs (seconds); the source tables change a few times a day at most
+ADVISOR_READ_TTL = int(os.getenv("ADVISOR_READ_TTL", "600"))
+ACTIVITY_READ_TTL = int(os.getenv("ACTIVITY_READ_TTL", "120"))
+
+TABLES = {
+    name: f"`{project_id}.{dataset_name}.{name}`"
+    for name in [
+        "advisors",
+        "clients",
+        "accounts",
+        "holdings",
+        "transactions",
+        "todo_tasks",
+        "client_interactions",
+        "client_portfolio_snapshot",
+        "advisor_portfolio_snapshot",
+        "nba_recommendations",
+    ]
+}
+
+
+class NamedQuery:
+    """A compiled SQL template plus the BigQuery types of its parameters"""
+
+    def __init__(self, name, sql, params=None, cache_ttl=0, local_sql=None):
+        self.name = name
+        self.sql = sql.format(**TABLES)
+        self.params = params or {}
+        self.cache_ttl = cache_ttl
+        self.local_sql = local_sql.format(**{table: table for table in TABLES}) if local_sql else None
+
+
+QUERIES = {}
+
+
+def register(name, sql, cache_ttl=0, local_sql=None, **params):
+    """Compile and register a query; params map parameter name -> BigQuery type"""
+    QUERIES[name] = NamedQuery(name, sql, params, cache_ttl, local_sql)
+    return QUERIES[name]
+
+
+def get(name):
+    return QUERIES[name]
+
+
+# ---------------------------------------------------------------------------
+# Clients and advisors
+# ---------------------------------------------------------------------------
+
+register("clients_for_advisor", """
+    SELECT
+        c.client_id,
+        c.name,
+        c.email,
+        c.phone,
+        c.client_tier,
+        c.net_worth,
+        c.risk_tolerance,
+        c.investment_objective,
+        c.location,
+        c.onboarding_date,
+        COALESCE(SUM(h.value), 0) as portfolio_value,
+        COUNT(h.holding_id) as total_holdings,
+        COUNT(DISTINCT h.asset_class) as asset_classes,
+        MAX(ci.date) as last_contact_date
+    FROM {clients} c
+    LEFT JOIN {holdings} h ON c.client_id = h.client_id
+    LEFT JOIN {client_interactions} ci ON c.client_id = ci.client_id
+    WHERE c.advisor_id = @advisor_id
+    GROUP BY c.client_id, c.name, c.email, c.phone, c.client_tier, c.net_worth,
+             c.risk_tolerance, c.investment_objective, c.location, c.onboarding_date
+    ORDER BY portfolio_value DESC
+""", advisor_id="STRING", cache_ttl=ADVISOR_READ_TTL)
+
+register("advisor_by_email", """
+    SELECT advisor_id, name, email, specialization, years_experience, location
+    FROM {advisors}
+    WHERE LOWER(email) = LOWER(@email)
+    LIMIT 1
+""", email="STRING")
+
+register("advisor_by_id", """
+    SELECT advisor_id, name, email, specialization, years_experience, location
+    FROM {advisors}
+    WHERE advisor_id = @advisor_id
+    LIMIT 1
+""", advisor_id="STRING")
+
+register("advisor_by_position", """
+    SELECT advisor_id, name, email, specialization, years_experience, location
+    FROM {advisors}
+    ORDER BY advisor_id
+    LIMIT 1 OFFSET @offset
+""", offset="INT64")
+
+register("advisor_id_by_name", """
+    SELECT advisor_id FROM {advisors}
+    WHERE LOWER(name) = LOWER(@advisor_name) LIMIT 1
+""", advisor_name="STRING", cache_ttl=ADVISOR_READ_TTL)
+
+register("client_contact", """
+    SELECT name, email, phone FROM {clients} WHERE client_id = @client_id LIMIT 1
+""", client_id="STRING")
+
+# ---------------------------------------------------------------------------
+# Tasks and next best actions
+# ---------------------------------------------------------------------------
+
+register("advisor_tasks", """
+    SELECT tt.task, tt.priority, c.name as client_name
+    FROM {todo_tasks} tt
+    LEFT JOIN {clients} c ON tt.client_id = c.client_id
+    WHERE c.advisor_id = @advisor_id OR tt.client_id IS NULL
+    ORDER BY tt.priority ASC
+    LIMIT 10
+""", advisor_id="STRING", cache_ttl=ADVISOR_READ_TTL)
+
+register("all_tasks", """
+    SELECT task FROM {todo_tasks} ORDER BY priority ASC LIMIT 10
+""", cache_ttl=ADVISOR_READ_TTL)
+
+register("advisor_recent_activity", """
+    SELECT t.transaction_id, t.amount, t.category, t.date, c.client_id, c.name as client_name
+    FROM {transactions} t
+    JOIN {accounts} a ON t.account_id = a.account_id
+    JOIN {clients} c ON a.client_id = c.client_id
+    WHERE c.advisor_id = @advisor_id
+    ORDER BY t.date DESC LIMIT 5
+""", advisor_id="STRING", cache_ttl=ACTIVITY_READ_TTL)
+
+# ---------------------------------------------------------------------------
+# Firm-wide dashboard
+# ---------------------------------------------------------------------------
+
+register("dashboard_kpi", """
+    WITH portfolio_summary AS (
+        SELECT
+            COUNT(DISTINCT c.client_id) as total_clients,
+            COUNT(DISTINCT a.advisor_id) as total_advisors,
+            SUM(h.value) as total_aum,
+            COUNT(DISTINCT h.symbol) as unique_securities,
+            AVG(h.value) as avg_holding_value
+        FROM {holdings} h
+        JOIN {clients} c ON h.client_id = c.client_id
+        JOIN {advisors} a ON c.advisor_id = a.advisor_id
+    )
+    SELECT * FROM portfolio_summary
+""")
+
+register("dashboard_asset_allocation", """
+    SELECT
+        h.asset_class,
+        SUM(h.value) as value,
+        COUNT(*) as holdings_count,
+        COUNT(DISTINCT c.client_id) as client_count,
+        ROUND(100.0 * SUM(h.value) / SUM(SUM(h.value)) OVER(), 2) as percentage
+    FROM {holdings} h
+    JOIN {clients} c ON h.client_id = c.client_id
+    GROUP BY h.asset_class
+    ORDER BY value DESC
+""")
+
+register("dashboard_top_advisors", """
+    SELECT
+        a.name as advisor_name,
+        COUNT(DISTINCT c.client_id) as client_count,
+        SUM(h.value) as total_aum,
+        ROUND(AVG(h.value), 0) as avg_holding_value,
+        COUNT(DISTINCT h.asset_class) as asset_diversity,
+        RANK() OVER (ORDER BY SUM(h.value) DESC) as rank
+    FROM {advisors} a
+    LEFT JOIN {clients} c ON a.advisor_id = c.advisor_id
+    LEFT JOIN {holdings} h ON c.client_id = h.client_id
+    GROUP BY a.advisor_id, a.name
+    HAVING SUM(h.value) > 0
+    ORDER BY total_aum DESC
+    LIMIT 10
+""")
+
+register("dashboard_monthly_trends", """
+    SELECT
+        EXTRACT(YEAR FROM t.date) as year,
+        EXTRACT(MONTH FROM t.date) as month,
+        DATE_TRUNC(DATE(t.date), MONTH) as month_year,
+        SUM(CASE WHEN t.amount > 0 THEN t.amount ELSE 0 END) as inflows,
+        SUM(CASE WHEN t.amount < 0 THEN ABS(t.amount) ELSE 0 END) as outflows,
+        COUNT(DISTINCT c.client_id) as active_clients,
+        COUNT(*) as transaction_count
+    FROM {transactions} t
+    JOIN {accounts} a ON t.account_id = a.account_id
+    JOIN {clients} c ON a.client_id = c.client_id
+    WHERE t.date >= DATE_SUB(CURRENT_DATE(), INTERVAL 12 MONTH)
+    GROUP BY year, month, month_year
+    ORDER BY year DESC, month DESC
+    LIMIT 12
+""")
+
+register("dashboard_risk_metrics", """
+    SELECT
+        h.asset_class,
+        h.sector,
+        SUM(h.value) as exposure,
+        COUNT(*) as positions,
+        STDDEV(h.current_price) as volatility,
+        AVG(SAFE_DIVIDE(h.current_price - h.purchase_price, NULLIF(h.purchase_price, 0)) * 100) as avg_performance
+    FROM {holdings} h
+    WHERE h.sector IS NOT NULL
+    GROUP BY h.asset_class, h.sector
+    HAVING SUM(h.value) > 100000
+    ORDER BY exposure DESC
+""")
+
+register("insights_recent_activity", """
+    SELECT c.name as client_name, t.amount, t.category, t.date
+    FROM {transactions} t
+    JOIN {accounts} a ON t.account_id = a.account_id
+    JOIN {clients} c ON a.client_id = c.client_id
+    ORDER BY t.date DESC LIMIT 10
+""")
+
+register("insights_portfolio_summary", """
+    SELECT h.asset_class, SUM(h.value) as total_value, COUNT(*) as holdings_count
+    FROM {holdings} h
+    GROUP BY h.asset_class
+    ORDER BY total_value DESC
+""")
+
+# ---------------------------------------------------------------------------
+# Advisor portfolio aggregation
+# A NULL @client_id means "all of the advisor's clients".
+# ---------------------------------------------------------------------------
+
+register("aggregation_portfolio_overview", """
+    SELECT
+        h.asset_class,
+        COUNT(*) as holdings_count,
+        SUM(h.value) as total_value,
+        AVG(h.value) as avg_holding_value,
+        MIN(h.value) as min_holding,
+        MAX(h.value) as max_holding,
+        COUNT(DISTINCT h.client_id) as clients_count
+    FROM {holdings} h
+    JOIN {clients} c ON h.client_id = c.client_id
+    WHERE c.advisor_id = @advisor_id
+    AND (@client_id IS NULL OR c.client_id = @client_id)
+    GROUP BY h.asset_class
+    ORDER BY total_value DESC
+""", advisor_id="STRING", client_id="STRING", cache_ttl=ADVISOR_READ_TTL)
+
+register("aggregation_top_holdings", """
+    SELECT
+        h.symbol,
+        h.asset_class,
+        h.client_id,
+        c.name as client_name,
+        h.value,
+        h.quantity,
+        h.current_price,
+        ROUND((h.current_price - h.purchase_price) / NULLIF(h.purchase_price, 0) * 100, 2) as performance_pct
+    FROM {holdings} h
+    JOIN {clients} c ON h.client_id = c.client_id
+    WHERE c.advisor_id = @advisor_id
+    AND (@client_id IS NULL OR c.client_id = @client_id)
+    ORDER BY h.value DESC
+    LIMIT 10
+""", advisor_id="STRING", client_id="STRING", cache_ttl=ADVISOR_READ_TTL)
+
+register("aggregation_advisor_distribution", """
+    SELECT
+        a.name as advisor_name,
+        a.advisor_id,
+        COUNT(DISTINCT c.client_id) as client_count,
+        SUM(h.value) as total_aum,
+        AVG(h.value) as avg_client_portfolio,
+        COUNT(DISTINCT h.asset_class) as asset_classes_managed,
+        COUNT(DISTINCT h.symbol) as unique_securities,
+        COUNT(CASE WHEN h.value >= 1000000 THEN 1 END) as high_value_clients,
+        MAX(h.value) as largest_holding,
+        MIN(h.value) as smallest_holding,
+        STDDEV(h.value) as portfolio_volatility
+    FROM {advisors} a
+    JOIN {clients} c ON a.advisor_id = c.advisor_id
+    JOIN {holdings} h ON c.client_id = h.client_id
+    WHERE a.advisor_id = @advisor_id
+    AND (@client_id IS NULL OR c.client_id = @client_id)
+    GROUP BY a.advisor_id, a.name
+""", advisor_id="STRING", client_id="STRING", cache_ttl=ADVISOR_READ_TTL)
+
+register("aggregation_risk_analysis", """
+    SELECT
+        h.asset_class,
+        COUNT(*) as positions,
+        SUM(h.value) as exposure,
+        STDDEV(h.value) as volatility,
+        COUNT(DISTINCT h.client_id) as clients_exposed
+    FROM {holdings} h
+    JOIN {clients} c ON h.client_id = c.client_id
+    WHERE c.advisor_id = @advisor_id
+    AND (@client_id IS NULL OR c.client_id = @client_id)
+    GROUP BY h.asset_class
+    HAVING COUNT(*) > 0
+    ORDER BY exposure DESC
+""", advisor_id="STRING", client_id="STRING", cache_ttl=ADVISOR_READ_TTL)
+
+register("aggregation_activity_summary", """
+    SELECT
+        DATE(t.date) as activity_date,
+        COUNT(*) as transaction_count,
+        SUM(CASE WHEN t.amount > 0 THEN t.amount ELSE 0 END) as inflows,
+        SUM(CASE WHEN t.amount < 0 THEN ABS(t.amount) ELSE 0 END) as outflows,
+        COUNT(DISTINCT c.client_id) as active_clients
+    FROM {transactions} t
+    JOIN {accounts} a ON t.account_id = a.account_id
+    JOIN {clients} c ON a.client_id = c.client_id
+    WHERE c.advisor_id = @advisor_id
+    AND (@client_id IS NULL OR c.client_id = @client_id)
+    AND t.date >= DATE_SUB(CURRENT_DATE(), INTERVAL 7 DAY)
+    GROUP BY DATE(t.date)
+    ORDER BY activity_date DESC
+    LIMIT 5
+""", advisor_id="STRING", client_id="STRING", cache_ttl=ACTIVITY_READ_TTL)
+
+# Single-scan variant: filters the advisor's holdings once and returns every
+# section as an ARRAY<STRUCT> column of one row
+register("aggregation_fused", """
+    WITH advisor_holdings AS (
+        SELECT h.client_id, h.symbol, h.asset_class, h.value, h.quantity,
+               h.current_price, h.purchase_price, c.name as client_name, c.advisor_id
+        FROM {holdings} h
+        JOIN {clients} c ON h.client_id = c.client_id
+        WHERE c.advisor_id = @advisor_id
+        AND (@client_id IS NULL OR c.client_id = @client_id)
+    ),
+    portfolio_overview AS (
+        SELECT
+            asset_class,
+            COUNT(*) as holdings_count,
+            SUM(value) as total_value,
+            AVG(value) as avg_holding_value,
+            MIN(value) as min_holding,
+            MAX(value) as max_holding,
+            COUNT(DISTINCT client_id) as clients_count
+        FROM advisor_holdings
+        GROUP BY asset_class
+    ),
+    top_holdings AS (
+        SELECT
+            symbol,
+            asset_class,
+            client_id,
+            client_name,
+            value,
+            quantity,
+            current_price,
+            ROUND((current_price - purchase_price) / NULLIF(purchase_price, 0) * 100, 2) as performance_pct
+        FROM advisor_holdings
+        ORDER BY value DESC
+        LIMIT 10
+    ),
+    advisor_distribution AS (
+        SELECT
+            a.name as advisor_name,
+            a.advisor_id,
+            COUNT(DISTINCT ah.client_id) as client_count,
+            SUM(ah.value) as total_aum,
+            AVG(ah.value) as avg_client_portfolio,
+            COUNT(DISTINCT ah.asset_class) as asset_classes_managed,
+            COUNT(DISTINCT ah.symbol) as unique_securities,
+            COUNT(CASE WHEN ah.value >= 1000000 THEN 1 END) as high_value_clients,
+            MAX(ah.value) as largest_holding,
+            MIN(ah.value) as smallest_holding,
+            STDDEV(ah.value) as portfolio_volatility
+        FROM advisor_holdings ah
+        JOIN {advisors} a ON a.advisor_id = ah.advisor_id
+        GROUP BY a.advisor_id, a.name
+    ),
+    risk_analysis AS (
+        SELECT
+            asset_class,
+            COUNT(*) as positions,
+            SUM(value) as exposure,
+            STDDEV(value) as volatility,
+            COUNT(DISTINCT client_id) as clients_exposed
+        FROM advisor_holdings
+        GROUP BY asset_class
+    ),
+    activity_summary AS (
+        SELECT
+            DATE(t.date) as activity_date,
+            COUNT(*) as transaction_count,
+            SUM(CASE WHEN t.amount > 0 THEN t.amount ELSE 0 END) as inflows,
+            SUM(CASE WHEN t.amount < 0 THEN ABS(t.amount) ELSE 0 END) as outflows,
+            COUNT(DISTINCT c.client_id) as active_clients
+        FROM {transactions} t
+        JOIN {accounts} a ON t.account_id = a.account_id
+        JOIN {clients} c ON a.client_id = c.client_id
+        WHERE c.advisor_id = @advisor_id
+        AND (@client_id IS NULL OR c.client_id = @client_id)
+        AND t.date >= DATE_SUB(CURRENT_DATE(), INTERVAL 7 DAY)
+        GROUP BY DATE(t.date)
+        ORDER BY activity_date DESC
+        LIMIT 5
+    )
+    SELECT
+        ARRAY(SELECT AS STRUCT * FROM portfolio_overview ORDER BY total_value DESC) as portfolio_overview,
+        ARRAY(SELECT AS STRUCT * FROM top_holdings ORDER BY value DESC) as top_holdings,
+        ARRAY(SELECT AS STRUCT * FROM advisor_distribution) as advisor_distribution,
+        ARRAY(SELECT AS STRUCT * FROM risk_analysis ORDER BY exposure DESC) as risk_analysis,
+        ARRAY(SELECT AS STRUCT * FROM activity_summary ORDER BY activity_date DESC) as activity_summary
+""", advisor_id="STRING", client_id="STRING", cache_ttl=ACTIVITY_READ_TTL)
+
+# ---------------------------------------------------------------------------
+# Chat context
+# ---------------------------------------------------------------------------
+
+register("chat_clients", """
+    SELECT c.name, c.client_id,
+           COALESCE(SUM(h.value), 0) as portfolio_value
+    FROM {clients} c
+    LEFT JOIN {holdings} h ON c.client_id = h.client_id
+    WHERE c.advisor_id = @advisor_id
+    GROUP BY c.client_id, c.name
+    ORDER BY portfolio_value DESC
+""", advisor_id="STRING", cache_ttl=ADVISOR_READ_TTL)
+
+register("chat_transactions", """
+    SELECT t.amount, t.category, t.date, c.name as client_name
+    FROM {transactions} t
+    JOIN {accounts} a ON t.account_id = a.account_id
+    JOIN {clients} c ON a.client_id = c.client_id
+    WHERE c.advisor_id = @advisor_id
+    ORDER BY t.date DESC LIMIT 10
+""", advisor_id="STRING", cache_ttl=ACTIVITY_READ_TTL)
+
+register("chat_portfolio", """
+    SELECT h.asset_class, COUNT(*) as count, SUM(h.value) as total_value
+    FROM {holdings} h
+    JOIN {clients} c ON h.client_id = c.client_id
+    WHERE c.advisor_id = @advisor_id
+    GROUP BY h.asset_class
+    ORDER BY total_value DESC
+""", advisor_id="STRING", cache_ttl=ADVISOR_READ_TTL)
+
+# ---------------------------------------------------------------------------
+# Portfolio snapshots (see backend/snapshots.py)
+# Precomputed per-client and per-advisor totals, allocation, holding counts and
+# last-contact date. An empty @client_ids array means "every client"; otherwise
+# only those clients (and their advisors) are recomputed. Rows are rewritten only
+# when their source_hash changes.
+# ---------------------------------------------------------------------------
+
+CLIENT_SNAPSHOT_SOURCE = """
+    WITH scoped_clients AS (
+        SELECT * FROM {clients} c
+        WHERE ARRAY_LENGTH(@client_ids) = 0 OR c.client_id IN UNNEST(@client_ids)
+    ),
+    holding_totals AS (
+        SELECT h.client_id, h.asset_class, SUM(h.value) as total_value, COUNT(*) as holdings_count
+        FROM {holdings} h
+        JOIN scoped_clients c ON h.client_id = c.client_id
+        GROUP BY h.client_id, h.asset_class
+    ),
+    contacts AS (
+        SELECT ci.client_id, MAX(ci.date) as last_contact_date
+        FROM {client_interactions} ci
+        JOIN scoped_clients c ON ci.client_id = c.client_id
+        GROUP BY ci.client_id
+    ),
+    client_rows AS (
+        SELECT
+            c.client_id,
+            ANY_VALUE(c.advisor_id) as advisor_id,
+            ANY_VALUE(c.name) as name,
+            ANY_VALUE(c.email) as email,
+            ANY_VALUE(c.phone) as phone,
+            ANY_VALUE(c.client_tier) as client_tier,
+            ANY_VALUE(c.net_worth) as net_worth,
+            ANY_VALUE(c.risk_tolerance) as risk_tolerance,
+            ANY_VALUE(c.investment_objective) as investment_objective,
+            ANY_VALUE(c.location) as location,
+            ANY_VALUE(c.onboarding_date) as onboarding_date,
+            COALESCE(SUM(ht.total_value), 0) as portfolio_value,
+            COALESCE(SUM(ht.holdings_count), 0) as total_holdings,
+            COUNT(ht.asset_class) as asset_classes,
+            ANY_VALUE(ct.last_contact_date) as last_contact_date,
+            ARRAY_AGG(
+                IF(ht.client_id IS NULL, NULL,
+                   STRUCT(ht.asset_class, ht.total_value, ht.holdings_count))
+                IGNORE NULLS ORDER BY ht.total_value DESC
+            ) as allocation
+        FROM scoped_clients c
+        LEFT JOIN holding_totals ht ON c.client_id = ht.client_id
+        LEFT JOIN contacts ct ON c.client_id = ct.client_id
+        GROUP BY c.client_id
+    )
+    SELECT r.*, FARM_FINGERPRINT(TO_JSON_STRING(r)) as source_hash, CURRENT_TIMESTAMP() as refreshed_at
+    FROM client_rows r
+"""
+
+ADVISOR_SNAPSHOT_SOURCE = """
+    WITH scoped_advisors AS (
+        SELECT DISTINCT advisor_id FROM {clients}
+        WHERE ARRAY_LENGTH(@client_ids) = 0 OR client_id IN UNNEST(@client_ids)
+    ),
+    advisor_holdings AS (
+        SELECT c.advisor_id, h.client_id, h.asset_class, h.symbol, h.value
+        FROM {holdings} h
+        JOIN {clients} c ON h.client_id = c.client_id
+        WHERE c.advisor_id IN (SELECT advisor_id FROM scoped_advisors)
+    ),
+    allocation AS (
+        SELECT advisor_id, ARRAY_AGG(STRUCT(
+            asset_class, holdings_count, total_value, avg_holding_value,
+            min_holding, max_holding, clients_count, volatility
+        ) ORDER BY total_value DESC) as allocation
+        FROM (
+            SELECT
+                advisor_id,
+                asset_class,
+                COUNT(*) as holdings_count,
+                SUM(value) as total_value,
+                AVG(value) as avg_holding_value,
+                MIN(value) as min_holding,
+                MAX(value) as max_holding,
+                COUNT(DISTINCT client_id) as clients_count,
+                STDDEV(value) as volatility
+            FROM advisor_holdings
+            GROUP BY advisor_id, asset_class
+        )
+        GROUP BY advisor_id
+    ),
+    totals AS (
+        SELECT
+            advisor_id,
+            COUNT(DISTINCT client_id) as client_count,
+            SUM(value) as total_aum,
+            AVG(value) as avg_client_portfolio,
+            COUNT(*) as total_holdings,
+            COUNT(DISTINCT asset_class) as asset_classes_managed,
+            COUNT(DISTINCT symbol) as unique_securities,
+            COUNTIF(value >= 1000000) as high_value_clients,
+            MAX(value) as largest_holding,
+            MIN(value) as smallest_holding,
+            STDDEV(value) as portfolio_volatility
+        FROM advisor_holdings
+        GROUP BY advisor_id
+    ),
+    contacts AS (
+        SELECT c.advisor_id, MAX(ci.date) as last_contact_date
+        FROM {client_interactions} ci
+        JOIN {clients} c ON ci.client_id = c.client_id
+        WHERE c.advisor_id IN (SELECT advisor_id FROM scoped_advisors)
+        GROUP BY c.advisor_id
+    ),
+    advisor_rows AS (
+        SELECT
+            t.advisor_id,
+            a.name as advisor_name,
+            t.client_count,
+            t.total_aum,
+            t.avg_client_portfolio,
+            t.total_holdings,
+            t.asset_classes_managed,
+            t.unique_securities,
+            t.high_value_clients,
+            t.largest_holding,
+            t.smallest_holding,
+            t.portfolio_volatility,
+            ct.last_contact_date,
+            al.allocation
+        FROM totals t
+        JOIN {advisors} a ON a.advisor_id = t.advisor_id
+        JOIN allocation al ON al.advisor_id = t.advisor_id
+        LEFT JOIN contacts ct ON ct.advisor_id = t.advisor_id
+    )
+    SELECT r.*, FARM_FINGERPRINT(TO_JSON_STRING(r)) as source_hash, CURRENT_TIMESTAMP() as refreshed_at
+    FROM advisor_rows r
+"""
+
+CLIENT_SNAPSHOT_COLUMNS = [
+    "advisor_id", "name", "email", "phone", "client_tier", "net_worth", "risk_tolerance",
+    "investment_objective", "location", "onboarding_date", "portfolio_value",
+    "total_holdings", "asset_classes", "last_contact_date", "allocation",
+    "source_hash", "refreshed_at",
+]
+
+ADVISOR_SNAPSHOT_COLUMNS = [
+    "advisor_name", "client_count", "total_aum", "avg_client_portfolio", "total_holdings",
+    "asset_classes_managed", "unique_securities", "high_value_clients", "largest_holding",
+    "smallest_holding", "portfolio_volatility", "last_contact_date", "allocation",
+    "source_hash", "refreshed_at",
+]
+
+
+def _merge_snapshot(table, key, source, columns, delete_scope):
+    updates = ",\n            ".join(f"{column} = S.{column}" for column in columns)
+    return f"""
+    MERGE {{{table}}} T
+    USING ({source}) S
+    ON T.{key} = S.{key}
+    WHEN MATCHED AND T.source_hash != S.source_hash THEN
+        UPDATE SET
+            {updates}
+    WHEN NOT MATCHED THEN
+        INSERT ROW
+    WHEN NOT MATCHED BY SOURCE AND ({delete_scope}) THEN
+        DELETE
+    """
+
+
+register("snapshot_create_client", f"""
+    CREATE TABLE IF NOT EXISTS {{client_portfolio_snapshot}}
+    CLUSTER BY advisor_id, client_id
+    AS {CLIENT_SNAPSHOT_SOURCE}
+""", client_ids="ARRAY<STRING>")
+
+register("snapshot_create_advisor", f"""
+    CREATE TABLE IF NOT EXISTS {{advisor_portfolio_snapshot}}
+    CLUSTER BY advisor_id
+    AS {ADVISOR_SNAPSHOT_SOURCE}
+""", client_ids="ARRAY<STRING>")
+
+register("snapshot_merge_client", _merge_snapshot(
+    "client_portfolio_snapshot", "client_id", CLIENT_SNAPSHOT_SOURCE, CLIENT_SNAPSHOT_COLUMNS,
+    "ARRAY_LENGTH(@client_ids) = 0 OR T.client_id IN UNNEST(@client_ids)",
+), client_ids="ARRAY<STRING>")
+
+# Scoped clients whose snapshot row names another advisor than clients does now,
+# or who are gone from clients. The advisor they left still counts them, and a
+# scoped advisor merge only sees current advisors, so snapshots.refresh() merges
+# every advisor instead. Run before snapshot_merge_client rewrites the rows.
+register("snapshot_moved_clients", """
+    SELECT COUNT(*) as moved_clients
+    FROM {client_portfolio_snapshot} s
+    LEFT JOIN {clients} c ON c.client_id = s.client_id
+    WHERE s.client_id IN UNNEST(@client_ids)
+      AND (c.client_id IS NULL OR c.advisor_id != s.advisor_id)
+""", client_ids="ARRAY<STRING>")
+
+# Advisors are only removed on a full refresh
+register("snapshot_merge_advisor", _merge_snapshot(
+    "advisor_portfolio_snapshot", "advisor_id", ADVISOR_SNAPSHOT_SOURCE, ADVISOR_SNAPSHOT_COLUMNS,
+    "ARRAY_LENGTH(@client_ids) = 0",
+), client_ids="ARRAY<STRING>")
+
+# Snapshot-backed reads used in place of the live joins once the tables exist
+
+register("clients_for_advisor_snapshot", """
+    SELECT
+        client_id, name, email, phone, client_tier, net_worth, risk_tolerance,
+        investment_objective, location, onboarding_date, portfolio_value,
+        total_holdings, asset_classes, last_contact_date
+    FROM {client_portfolio_snapshot}
+    WHERE advisor_id = @advisor_id
+    ORDER BY portfolio_value DESC
+""", advisor_id="STRING", cache_ttl=ADVISOR_READ_TTL)
+
+register("chat_clients_snapshot", """
+    SELECT name, client_id, portfolio_value
+    FROM {client_portfolio_snapshot}
+    WHERE advisor_id = @advisor_id
+    ORDER BY portfolio_value DESC
+""", advisor_id="STRING", cache_ttl=ADVISOR_READ_TTL)
+
+register("chat_portfolio_snapshot", """
+    SELECT a.asset_class, a.holdings_count as count, a.total_value
+    FROM {advisor_portfolio_snapshot} s, UNNEST(s.allocation) a
+    WHERE s.advisor_id = @advisor_id
+    ORDER BY a.total_value DESC
+""", advisor_id="STRING", cache_ttl=ADVISOR_READ_TTL)
+
+# Whole-book /aggregation: overview, distribution and risk come from the advisor's
+# snapshot row; only top holdings and recent activity touch the raw tables
+register("aggregation_snapshot", """
+    WITH advisor AS (
+        SELECT * FROM {advisor_portfolio_snapshot} WHERE advisor_id = @advisor_id
+    ),
+    top_holdings AS (
+        SELECT
+            h.symbol,
+            h.asset_class,
+            h.client_id,
+            c.name as client_name,
+            h.value,
+            h.quantity,
+            h.current_price,
+            ROUND((h.current_price - h.purchase_price) / NULLIF(h.purchase_price, 0) * 100, 2) as performance_pct
+        FROM {holdings} h
+        JOIN {clients} c ON h.client_id = c.client_id
+        WHERE c.advisor_id = @advisor_id
+        ORDER BY h.value DESC
+        LIMIT 10
+    ),
+    activity_summary AS (
+        SELECT
+            DATE(t.date) as activity_date,
+            COUNT(*) as transaction_count,
+            SUM(CASE WHEN t.amount > 0 THEN t.amount ELSE 0 END) as inflows,
+            SUM(CASE WHEN t.amount < 0 THEN ABS(t.amount) ELSE 0 END) as outflows,
+            COUNT(DISTINCT c.client_id) as active_clients
+        FROM {transactions} t
+        JOIN {accounts} a ON t.account_id = a.account_id
+        JOIN {clients} c ON a.client_id = c.client_id
+        WHERE c.advisor_id = @advisor_id
+        AND t.date >= DATE_SUB(CURRENT_DATE(), INTERVAL 7 DAY)
+        GROUP BY DATE(t.date)
+        ORDER BY activity_date DESC
+        LIMIT 5
+    )
+    SELECT
+        ARRAY(
+            SELECT AS STRUCT a.asset_class, a.holdings_count, a.total_value, a.avg_holding_value,
+                   a.min_holding, a.max_holding, a.clients_count
+            FROM advisor, UNNEST(advisor.allocation) a
+            ORDER BY a.total_value DESC
+        ) as portfolio_overview,
+        ARRAY(SELECT AS STRUCT * FROM top_holdings ORDER BY value DESC) as top_holdings,
+        ARRAY(
+            SELECT AS STRUCT advisor_name, advisor_id, client_count, total_aum, avg_client_portfolio,
+                   asset_classes_managed, unique_securities, high_value_clients, largest_holding,
+                   smallest_holding, portfolio_volatility
+            FROM advisor
+        ) as advisor_distribution,
+        ARRAY(
+            SELECT AS STRUCT a.asset_class, a.holdings_count as positions, a.total_value as exposure,
+                   a.volatility, a.clients_count as clients_exposed
+            FROM advisor, UNNEST(advisor.allocation) a
+            ORDER BY a.total_value DESC
+        ) as risk_analysis,
+        ARRAY(SELECT AS STRUCT * FROM activity_summary ORDER BY activity_date DESC) as activity_summary
+""", advisor_id="STRING", cache_ttl=ACTIVITY_READ_TTL)
+
+# ---------------------------------------------------------------------------
+# Nightly next-best-actions (see backend/nba_batch.py)
+# Client profiles and recent activity are read in bulk for the whole book (or
+# the advisors in @advisor_ids); generated actions are published per client and
+# /nba reads them back with an advisor lookup.
+# ---------------------------------------------------------------------------
+
+register("nba_client_profiles", """
+    SELECT
+        c.client_id,
+        c.advisor_id,
+        c.name as client_name,
+        c.net_worth,
+        c.risk_tolerance,
+        c.investment_objective,
+        COALESCE(SUM(h.value), 0) as portfolio_value
+    FROM {clients} c
+    LEFT JOIN {holdings} h ON h.client_id = c.client_id
+    WHERE ARRAY_LENGTH(@advisor_ids) = 0 OR c.advisor_id IN UNNEST(@advisor_ids)
+    GROUP BY c.client_id, c.advisor_id, c.name, c.net_worth, c.risk_tolerance, c.investment_objective
+    ORDER BY portfolio_value DESC
+""", advisor_ids="ARRAY<STRING>")
+
+register("nba_recent_activity", """
+    SELECT client_id, date, category, amount
+    FROM (
+        SELECT
+            a.client_id,
+            t.date,
+            t.category,
+            t.amount,
+            ROW_NUMBER() OVER (PARTITION BY a.client_id ORDER BY t.date DESC) as recency
+        FROM {transactions} t
+        JOIN {accounts} a ON t.account_id = a.account_id
+        JOIN {clients} c ON a.client_id = c.client_id
+        WHERE ARRAY_LENGTH(@advisor_ids) = 0 OR c.advisor_id IN UNNEST(@advisor_ids)
+    )
+    WHERE recency <= @per_client
+    ORDER BY client_id, date DESC
+""", advisor_ids="ARRAY<STRING>", per_client="INT64")
+
+register("nba_create_table", """
+    CREATE TABLE IF NOT EXISTS {nba_recommendations} (
+        advisor_id STRING,
+        client_id STRING,
+        client_name STRING,
+        rank INT64,
+        action STRING,
+        rationale STRING,
+        expected_outcome STRING,
+        priority STRING,
+        timeline STRING,
+        model STRING,
+        run_id STRING,
+        generated_at TIMESTAMP
+    )
+    CLUSTER BY advisor_id, client_id
+""")
+
+# Replaces the rows of every client in @client_ids with the actions in @payload
+# (a JSON array of objects), atomically, so /nba never sees a half-written client
+register("nba_publish", """
+    BEGIN TRANSACTION;
+    DELETE FROM {nba_recommendations} WHERE client_id IN UNNEST(@client_ids);
+    INSERT INTO {nba_recommendations} (
+        advisor_id, client_id, client_name, rank, action, rationale,
+        expected_outcome, priority, timeline, model, run_id, generated_at
+    )
+    SELECT
+        JSON_VALUE(r, '$.advisor_id'),
+        JSON_VALUE(r, '$.client_id'),
+        JSON_VALUE(r, '$.client_name'),
+        CAST(JSON_VALUE(r, '$.rank') AS INT64),
+        JSON_VALUE(r, '$.action'),
+        JSON_VALUE(r, '$.rationale'),
+        JSON_VALUE(r, '$.expected_outcome'),
+        JSON_VALUE(r, '$.priority'),
+        JSON_VALUE(r, '$.timeline'),
+        JSON_VALUE(r, '$.model'),
+        @run_id,
+        CURRENT_TIMESTAMP()
+    FROM UNNEST(JSON_QUERY_ARRAY(@payload)) r;
+    COMMIT TRANSACTION;
+""", client_ids="ARRAY<STRING>", payload="STRING", run_id="STRING")
+
+register("nba_for_advisor", """
+    SELECT
+        client_id, client_name, rank, action, rationale, expected_outcome,
+        priority, timeline, generated_at
+    FROM {nba_recommendations}
+    WHERE advisor_id = @advisor_id
+    AND (@client_id IS NULL OR client_id = @client_id)
+    ORDER BY CASE priority WHEN 'High' THEN 0 WHEN 'Medium' THEN 1 ELSE 2 END, rank, client_name
+    LIMIT @max_actions
+""", advisor_id="STRING", client_id="STRING", max_actions="INT64", cache_ttl=ADVISOR_READ_TTL)
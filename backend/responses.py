@@ -0,0 +1,186 @@
+# JSON rendering and response compression
+#
+# FastJSONResponse is the app's default response class: it renders with orjson
+# when installed (several times faster than the stdlib json that JSONResponse
+# uses), falling back to JSONResponse for anything orjson rejects. FastAPI still
+# runs jsonable_encoder over a returned dict before rendering it, so the largest
+# endpoints return a FastJSONResponse themselves and skip that pass; types
+# orjson doesn't know natively (Decimal, bigquery.Row) go through
+# jsonable_encoder one value at a time.
+#
+# CompressionMiddleware compresses any buffered body of at least
+# COMPRESS_MIN_BYTES with brotli or gzip, whichever the client prefers of those
+# it accepts; brotli needs the brotli package. Streamed responses (/chat/stream)
+# pass through untouched so their chunks are not held back.
+#
+# Payloads that depend only on configuration are serialized once, compressed
+# ahead of time and served with a strong ETag per encoding (Prebuilt). A request
+# then costs two header lookups: 304 Not Modified when If-None-Match matches,
+# else the stored bytes for the best encoding the client accepts.
+
+import gzip
+import hashlib
+import json
+import os
+
+from fastapi.encoders import jsonable_encoder
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import JSONResponse, Response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Smaller bodies are sent uncompressed: below about a packet the CPU isn't worth it
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+# Per-request levels: fast settings with most of the size win on JSON
+COMPRESS_GZIP_LEVEL = int(os.getenv("COMPRESS_GZIP_LEVEL", "6"))
+COMPRESS_BROTLI_QUALITY = int(os.getenv("COMPRESS_BROTLI_QUALITY", "4"))
+
+COMPRESSIBLE_TYPES = ("application/json", "text/", "application/javascript", "application/xml")
+
+# Preferred first when the client accepts several
+ENCODINGS = ("br", "gzip")
+
+
+def _orjson_default(value):
+    """Types orjson can't serialize natively, converted the way FastAPI would"""
+    return jsonable_encoder(value)
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson when it is installed"""
+
+    def render(self, content):
+        if orjson is not None:
+            try:
+                return orjson.dumps(content, default=_orjson_default, option=orjson.OPT_NON_STR_KEYS)
+            except TypeError:
+                # e.g. integers past 64 bits
+                pass
+        return super().render(jsonable_encoder(content))
+
+
+def accepted_encodings(header):
+    """Content codings an Accept-Encoding header allows (q=0 excluded)"""
+    accepted = set()
+    for item in (header or "").split(","):
+        coding, *params = item.split(";")
+        quality = 1.0
+        for param in params:
+            name, _, value = param.strip().partition("=")
+            if name.lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if coding.strip() and quality > 0:
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+def negotiate(accept_encoding, available=ENCODINGS):
+    """Best encoding in available the client accepts, or None"""
+    accepted = accepted_encodings(accept_encoding)
+    for encoding in ENCODINGS:
+        if encoding in available and (encoding in accepted or "*" in accepted) and (encoding != "br" or brotli):
+            return encoding
+    return None
+
+
+def compress(body, encoding, gzip_level=COMPRESS_GZIP_LEVEL, brotli_quality=COMPRESS_BROTLI_QUALITY):
+    if encoding == "br":
+        return brotli.compress(body, quality=brotli_quality)
+    return gzip.compress(body, compresslevel=gzip_level, mtime=0)
+
+
+def _etag_matches(header, etags):
+    """If-None-Match against our ETags (weak comparison, as RFC 9110 specifies for it)"""
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") in etags for tag in header.split(","))
+
+
+class Prebuilt:
+    """A JSON payload serialized and compressed once, served with ETag revalidation"""
+
+    def __init__(self, content, cache_control="no-cache"):
+        # Same bytes FastAPI's JSONResponse would render for this content
+        body = json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        self.cache_control = cache_control
+        # encoding -> (body, ETag); each encoding is its own representation with its own strong ETag
+        self.variants = {"identity": (body, f'"{digest}"')}
+        if len(body) >= COMPRESS_MIN_BYTES:
+            # Compressed once, so at the slowest, smallest settings
+            self.variants["gzip"] = (compress(body, "gzip", gzip_level=9), f'"{digest}-gzip"')
+            if brotli is not None:
+                self.variants["br"] = (compress(body, "br", brotli_quality=11), f'"{digest}-br"')
+        self.etags = {etag for _, etag in self.variants.values()}
+
+    def response(self, request):
+        """304 when the client's copy is current, else the stored bytes for its best encoding"""
+        encoding = negotiate(request.headers.get("accept-encoding"), self.variants) or "identity"
+        body, etag = self.variants[encoding]
+        headers = {"ETag": etag, "Cache-Control": self.cache_control, "Vary": "Accept-Encoding"}
+        if _etag_matches(request.headers.get("if-none-match"), self.etags):
+            return Response(status_code=304, headers=headers)
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return Response(body, media_type="application/json", headers=headers)
+
+    def stats(self):
+        return {encoding: len(body) for encoding, (body, _) in self.variants.items()}
+
+
+class CompressionMiddleware:
+    """Compress buffered responses of at least min_bytes with the client's preferred encoding"""
+
+    def __init__(self, app, min_bytes=COMPRESS_MIN_BYTES):
+        self.app = app
+        self.min_bytes = min_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate(Headers(scope=scope).get("accept-encoding"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        start = None
+
+        async def send_compressed(message):
+            nonlocal start
+            if message["type"] == "http.response.start":
+                # Held until the first body chunk shows whether the response is buffered
+                start = message
+                return
+            if start is None:
+                await send(message)
+                return
+            head, start = start, None
+            body = message.get("body", b"")
+            headers = MutableHeaders(raw=head["headers"])
+            if (message.get("more_body") or len(body) < self.min_bytes or "content-encoding" in headers
+                    or not headers.get("content-type", "").startswith(COMPRESSIBLE_TYPES)):
+                await send(head)
+                await send(message)
+                return
+            body = compress(body, encoding)
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(body))
+            headers.add_vary_header("Accept-Encoding")
+            head["headers"] = headers.raw
+            await send(head)
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, send_compressed)
@@ -0,0 +1,177 @@
+# Advisor and client portfolio snapshots
+#
+# client_portfolio_snapshot and advisor_portfolio_snapshot hold precomputed
+# totals, allocation, holding counts and last-contact dates, so /clients,
+# /aggregation and /chat do key lookups instead of aggregating holdings,
+# clients and interactions on every request. The SQL lives in backend/queries.py.
+#
+# Refresh is incremental: pass the client_ids whose source data changed and only
+# those clients and their advisors are recomputed (every advisor when one of them
+# moved to another advisor or was removed), and rows whose source_hash is
+# unchanged are left alone. The tables themselves are always created from the
+# whole book, so the first refresh builds everything whatever its scope. Once
+# they exist, a full query-cache invalidation (ingest, admin invalidation)
+# refreshes them in the background. Run a full refresh on a schedule with
+#   python -m backend.snapshots
+
+import asyncio
+import os
+import sys
+import threading
+import time
+
+from backend import data_access, local_engine
+from backend.config import project_id, dataset_name
+
+PORTFOLIO_SNAPSHOTS_ENABLED = os.getenv("PORTFOLIO_SNAPSHOTS_ENABLED", "true").lower() == "true"
+
+SNAPSHOT_TABLES = ["client_portfolio_snapshot", "advisor_portfolio_snapshot"]
+
+# Live query -> snapshot-backed query that returns the same columns
+SNAPSHOT_READS = {
+    "clients_for_advisor": "clients_for_advisor_snapshot",
+    "chat_clients": "chat_clients_snapshot",
+    "chat_portfolio": "chat_portfolio_snapshot",
+}
+# Reads served from the snapshot tables, dropped from the result cache after a refresh
+SNAPSHOT_QUERIES = [*SNAPSHOT_READS.values(), "aggregation_snapshot"]
+
+_ready = None
+_refresh_lock = threading.Lock()
+_pending = set()  # scopes of queued background refreshes; None is the whole book
+_pending_lock = threading.Lock()
+last_refresh = {}
+
+
+def _tables_exist():
+    """Whether both snapshot tables exist; raises on transient/auth failures"""
+    from google.api_core.exceptions import NotFound
+    client = data_access.get_client()
+    try:
+        for table in SNAPSHOT_TABLES:
+            client.get_table(f"{project_id}.{dataset_name}.{table}")
+    except NotFound:
+        return False
+    return True
+
+
+def ready():
+    """True once both snapshot tables exist; checked once, then after each refresh"""
+    global _ready
+    if not PORTFOLIO_SNAPSHOTS_ENABLED or local_engine.ENABLED:
+        # The local engine mirrors only the base tables, where the live joins are cheap
+        return False
+    if _ready is None:
+        try:
+            _ready = _tables_exist()
+            if not _ready:
+                print("Portfolio snapshot tables not found; endpoints read live tables until the first refresh")
+        except Exception as e:
+            # Transient/auth failure: use live tables now and check again next time
+            print(f"Portfolio snapshot check failed: {e}")
+            return False
+    return _ready
+
+
+async def aready():
+    """ready() for async endpoints; until the answer is known the table check runs on a worker thread"""
+    if _ready is not None or not PORTFOLIO_SNAPSHOTS_ENABLED or local_engine.ENABLED:
+        return ready()
+    return await asyncio.get_running_loop().run_in_executor(None, ready)
+
+
+def pick(query_name):
+    """Name of the snapshot-backed variant of a live query, when snapshots are ready"""
+    if query_name in SNAPSHOT_READS and ready():
+        return SNAPSHOT_READS[query_name]
+    return query_name
+
+
+async def apick(query_name):
+    """pick() for async endpoints"""
+    if query_name in SNAPSHOT_READS and await aready():
+        return SNAPSHOT_READS[query_name]
+    return query_name
+
+
+def refresh(client_ids=None):
+    """Create the snapshot tables if needed and merge in changed rows.
+
+    client_ids limits the refresh to those clients and their advisors, or all
+    advisors if one of the clients changed advisor or was deleted; None
+    recomputes the whole book. While the tables don't exist yet they are built
+    from the whole book regardless, and endpoints only switch to them after that
+    full build. Returns timing details for the refresh.
+    """
+    global _ready
+    params = {"client_ids": list(client_ids or [])}
+    with _refresh_lock:
+        started = time.perf_counter()
+        if not _tables_exist():
+            # Never create from a filtered source: advisors outside it would read empty tables
+            for name in ["snapshot_create_client", "snapshot_create_advisor"]:
+                data_access.run_named(name, {"client_ids": []}, endpoint="snapshot-refresh")
+            scope = "full build"
+        else:
+            advisor_params = params
+            if params["client_ids"]:
+                moved = data_access.run_named("snapshot_moved_clients", params, endpoint="snapshot-refresh")
+                if moved and moved[0]["moved_clients"]:
+                    # The advisors they left are outside the scope: recompute every advisor
+                    advisor_params = {"client_ids": []}
+            data_access.run_named("snapshot_merge_client", params, endpoint="snapshot-refresh")
+            data_access.run_named("snapshot_merge_advisor", advisor_params, endpoint="snapshot-refresh")
+            if not params["client_ids"]:
+                scope = "full"
+            else:
+                scope = f"{len(params['client_ids'])} clients"
+                if not advisor_params["client_ids"]:
+                    scope += ", all advisors"
+        _ready = True
+        last_refresh.update({
+            "scope": scope,
+            "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+            "completed_at": time.time(),
+        })
+    # Cached snapshot reads may predate the new rows
+    for name in SNAPSHOT_QUERIES:
+        data_access.invalidate_cache(name)
+    print(f"Portfolio snapshots refreshed: {last_refresh}")
+    return dict(last_refresh)
+
+
+def refresh_in_background(client_ids=None):
+    """Start a refresh without blocking the caller; one already queued for the
+    same scope (or the whole book) covers this one"""
+    scope = tuple(sorted(client_ids)) if client_ids else None
+    with _pending_lock:
+        if None in _pending or scope in _pending:
+            return
+        _pending.add(scope)
+
+    def run():
+        with _pending_lock:
+            _pending.discard(scope)
+        try:
+            refresh(client_ids)
+        except Exception as e:
+            print(f"Portfolio snapshot refresh error: {e}")
+    threading.Thread(target=run, name="snapshot-refresh", daemon=True).start()
+
+
+def _on_data_change(name, params):
+    """Refresh existing snapshots when cached data is invalidated across all
+    queries (name None), which means the source data changed"""
+    if name is not None or not _ready or not PORTFOLIO_SNAPSHOTS_ENABLED or local_engine.ENABLED:
+        return
+    client_id = params.get("client_id")
+    refresh_in_background([client_id] if client_id else None)
+
+
+data_access.on_invalidate(_on_data_change)
+
+
+if __name__ == "__main__":
+    # python -m backend.snapshots [client_id ...]
+    print(refresh(sys.argv[1:] or None))
+    data_access.shutdown()
@@ -0,0 +1,171 @@
+# Map-reduce summarization for long documents
+#
+# /summarize sends short content to Gemini in one call. Content over
+# SUMMARIZE_SINGLE_PASS_TOKENS (research reports, meeting transcripts) is split
+# on structural boundaries - markdown headings, then blank-line paragraphs, then
+# lines (speaker turns), then sentences - into chunks of about
+# SUMMARIZE_CHUNK_TOKENS. The chunks are summarized in parallel, at most
+# SUMMARIZE_MAX_CONCURRENCY at a time, and the partial summaries are merged by a
+# final CONTENT_SUMMARIZATION_PROMPT call. Partials that are still too long to
+# merge in one call are reduced again in groups first.
+#
+# Chunk summaries are cached by a hash of the chunk's content, and the chunk
+# prompt carries nothing but that content, so re-summarizing an edited document
+# only calls Gemini for the chunks that changed, plus the merge.
+
+import asyncio
+import hashlib
+import os
+import re
+
+from backend import llm, prompt_budget
+from backend.cache import TTLCache
+from backend.prompt_templates import CHUNK_SUMMARIZATION_PROMPT, CONTENT_SUMMARIZATION_PROMPT
+
+SUMMARIZE_MODEL = os.getenv("SUMMARIZE_MODEL", "gemini-1.5-pro")
+SUMMARIZE_SINGLE_PASS_TOKENS = int(os.getenv("SUMMARIZE_SINGLE_PASS_TOKENS", "6000"))
+SUMMARIZE_CHUNK_TOKENS = int(os.getenv("SUMMARIZE_CHUNK_TOKENS", "2500"))
+SUMMARIZE_MAX_CONCURRENCY = int(os.getenv("SUMMARIZE_MAX_CONCURRENCY", "4"))
+SUMMARIZE_CHUNK_CACHE_TTL = int(os.getenv("SUMMARIZE_CHUNK_CACHE_TTL", str(24 * 3600)))
+SUMMARIZE_CHUNK_CACHE_MAX_ENTRIES = int(os.getenv("SUMMARIZE_CHUNK_CACHE_MAX_ENTRIES", "2048"))
+
+chunk_cache = TTLCache(max_entries=SUMMARIZE_CHUNK_CACHE_MAX_ENTRIES)
+
+_HEADING = re.compile(r"^(#{1,6}\s|[A-Z][A-Z0-9 ,&/'-]{3,}:?$)")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+
+class Summary:
+    """Merged summary text plus how it was produced"""
+
+    def __init__(self, text, stats):
+        self.text = text
+        self.stats = stats
+
+
+def _blocks(text):
+    """Paragraphs split on blank lines, with each heading starting a new paragraph"""
+    blocks, current = [], []
+    for line in text.splitlines():
+        if not line.strip() or (_HEADING.match(line.strip()) and current):
+            if current:
+                blocks.append("\n".join(current))
+            current = [line] if line.strip() else []
+        else:
+            current.append(line)
+    if current:
+        blocks.append("\n".join(current))
+    return blocks
+
+
+def _split_oversized(block, max_tokens):
+    """Pieces of a block too long for one chunk: lines, then sentences, then words"""
+    for pattern in ("\n", _SENTENCE_END, " "):
+        pieces = [piece for piece in re.split(pattern, block) if piece.strip()]
+        if len(pieces) > 1:
+            parts = []
+            for piece in pieces:
+                if prompt_budget.count_tokens(piece) > max_tokens:
+                    parts.extend(_split_oversized(piece, max_tokens))
+                else:
+                    parts.append(piece)
+            return parts
+    return [prompt_budget.truncate(block, max_tokens)]
+
+
+def split(text, max_tokens=None):
+    """Chunks of about max_tokens tokens that break only on structural boundaries.
+
+    Consecutive paragraphs are packed together; a heading starts a new chunk once
+    the current one is half full, so sections stay in one piece where they fit.
+    """
+    max_tokens = max_tokens or SUMMARIZE_CHUNK_TOKENS
+    chunks, current, size = [], [], 0
+    for block in _blocks(text):
+        tokens = prompt_budget.count_tokens(block)
+        pieces = [block] if tokens <= max_tokens else _split_oversized(block, max_tokens)
+        for piece in pieces:
+            tokens = prompt_budget.count_tokens(piece)
+            heading = _HEADING.match(piece.strip()) is not None
+            if current and (size + tokens > max_tokens or (heading and size >= max_tokens // 2)):
+                chunks.append("\n\n".join(current))
+                current, size = [], 0
+            current.append(piece)
+            size += tokens + 1
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+
+def _chunk_key(chunk):
+    digest = hashlib.sha256(f"{SUMMARIZE_MODEL}\0{' '.join(chunk.split())}".encode("utf-8")).hexdigest()
+    return ("summarize_chunk", (("sha256", digest),))
+
+
+async def _summarize_chunk(chunk, semaphore, counts):
+    key = _chunk_key(chunk)
+    hit, summary = chunk_cache.get(key)
+    if hit:
+        counts["cached"] += 1
+        return summary
+    async with semaphore:
+        prompt = prompt_budget.build("summarize-chunk", CHUNK_SUMMARIZATION_PROMPT, inputs={"content": chunk})
+        response = await llm.agenerate(SUMMARIZE_MODEL, prompt, endpoint="summarize-chunk")
+    if not response.text:
+        raise RuntimeError("Empty chunk summary")
+    counts["generated"] += 1
+    chunk_cache.set(key, response.text.strip(), SUMMARIZE_CHUNK_CACHE_TTL)
+    return response.text.strip()
+
+
+async def _map(chunks, counts):
+    semaphore = asyncio.Semaphore(SUMMARIZE_MAX_CONCURRENCY)
+    return await asyncio.gather(*(_summarize_chunk(chunk, semaphore, counts) for chunk in chunks))
+
+
+def _join(partials):
+    return "\n\n".join(f"[Part {index}]\n{partial}" for index, partial in enumerate(partials, start=1))
+
+
+async def summarize(text):
+    """Summarize text with one call, or map-reduce when it is longer than a single pass.
+
+    Raises when a model call fails, so the endpoint can fall back.
+    """
+    tokens = prompt_budget.count_tokens(text)
+    if tokens <= SUMMARIZE_SINGLE_PASS_TOKENS:
+        prompt = prompt_budget.build("summarize", CONTENT_SUMMARIZATION_PROMPT, inputs={"content": text})
+        response = await llm.agenerate(SUMMARIZE_MODEL, prompt, endpoint="summarize")
+        return Summary(response.text, {"mode": "single", "content_tokens": tokens})
+
+    counts = {"generated": 0, "cached": 0}
+    chunks = split(text)
+    partials = await _map(chunks, counts)
+    levels = 1
+    # Partials too long for one merge call are summarized again in groups
+    while prompt_budget.count_tokens(_join(partials)) > SUMMARIZE_SINGLE_PASS_TOKENS and len(partials) > 1:
+        groups = split("\n\n".join(partials))
+        if len(groups) >= len(partials):
+            break
+        partials = await _map(groups, counts)
+        levels += 1
+
+    merged = "Summaries of consecutive parts of one document, in order:\n\n" + _join(partials)
+    prompt = prompt_budget.build("summarize", CONTENT_SUMMARIZATION_PROMPT, inputs={"content": merged})
+    response = await llm.agenerate(SUMMARIZE_MODEL, prompt, endpoint="summarize")
+    return Summary(response.text, {
+        "mode": "map-reduce",
+        "content_tokens": tokens,
+        "chunks": len(chunks),
+        "chunks_generated": counts["generated"],
+        "chunks_cached": counts["cached"],
+        "reduce_levels": levels,
+    })
+
+
+def invalidate_cache():
+    return chunk_cache.invalidate()
+
+
+def stats():
+    return {"ttl_seconds": SUMMARIZE_CHUNK_CACHE_TTL, **chunk_cache.stats()}
@@ -0,0 +1,272 @@
+# Query and model-call telemetry
+#
+# Every BigQuery job (and local-engine / result-cache read), every Gemini call,
+# every startup warmup step and every HTTP request is recorded here with its
+# labels, and /metrics renders the lot in the Prometheus text exposition format.
+# Set TELEMETRY_LOG_QUERIES=true to also print one line per query job.
+
+import os
+import threading
+from bisect import bisect_left
+
+TELEMETRY_LOG_QUERIES = os.getenv("TELEMETRY_LOG_QUERIES", "false").lower() == "true"
+
+# Latency buckets (seconds): cache hits and local reads land in the first few,
+# BigQuery jobs in the middle, Gemini calls at the top
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_metrics = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+class Counter:
+    """Monotonic total per label set"""
+
+    kind = "counter"
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def _key(self, labels):
+        return tuple((name, labels.get(name) or "unknown") for name in self.labelnames)
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in sorted(self._values.items())]
+
+
+class Gauge(Counter):
+    """Current value per label set"""
+
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Counter):
+    """Cumulative bucket counts, sum and count per label set"""
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            index = bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                state["buckets"][index] += 1
+            state["sum"] += value
+            state["count"] += 1
+
+    def samples(self):
+        out = []
+        with self._lock:
+            for key, state in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, state["buckets"]):
+                    cumulative += count
+                    out.append((f"{self.name}_bucket", key + (("le", repr(float(bound))),), cumulative))
+                out.append((f"{self.name}_bucket", key + (("le", "+Inf"),), state["count"]))
+                out.append((f"{self.name}_sum", key, state["sum"]))
+                out.append((f"{self.name}_count", key, state["count"]))
+        return out
+
+
+def render():
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in _metrics:
+        lines.append(f"# HELP {metric.name} {metric.help_text}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, labels, value in metric.samples():
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+# ---------------------------------------------------------------------------
+# BigQuery
+# ---------------------------------------------------------------------------
+
+QUERY_LABELS = ("query", "endpoint", "source")
+
+query_duration = Histogram(
+    "bq_query_duration_seconds",
+    "Named query latency; source is bigquery, bigquery_cached, local or result_cache",
+    QUERY_LABELS,
+)
+queries_total = Counter("bq_queries_total", "Named queries answered", QUERY_LABELS)
+query_errors = Counter("bq_query_errors_total", "Named queries that raised", ("query", "endpoint"))
+query_rows = Counter("bq_query_rows_total", "Rows returned by named queries", QUERY_LABELS)
+query_bytes = Counter("bq_query_bytes_processed_total", "Bytes processed by BigQuery jobs", ("query", "endpoint"))
+query_bytes_billed = Counter("bq_query_bytes_billed_total", "Bytes billed for BigQuery jobs", ("query", "endpoint"))
+query_slot_ms = Counter("bq_query_slot_milliseconds_total", "Slot time used by BigQuery jobs", ("query", "endpoint"))
+
+
+def _row_count(result):
+    if hasattr(result, "num_rows"):
+        # pyarrow.Table
+        return result.num_rows
+    return len(result) if isinstance(result, list) else 0
+
+
+def record_query(name, endpoint, source, duration, result=None, job=None):
+    """Record one named-query read. job is the finished QueryJob for BigQuery reads"""
+    if job is not None and getattr(job, "cache_hit", False):
+        source = "bigquery_cached"
+    labels = {"query": name, "endpoint": endpoint, "source": source}
+    query_duration.observe(duration, **labels)
+    queries_total.inc(**labels)
+    rows = _row_count(result)
+    query_rows.inc(rows, **labels)
+    if job is not None:
+        query_bytes.inc(job.total_bytes_processed or 0, query=name, endpoint=endpoint)
+        query_bytes_billed.inc(job.total_bytes_billed or 0, query=name, endpoint=endpoint)
+        query_slot_ms.inc(job.slot_millis or 0, query=name, endpoint=endpoint)
+        if TELEMETRY_LOG_QUERIES:
+            print(
+                f"BigQuery job {job.job_id}: query={name} endpoint={endpoint} "
+                f"duration_ms={duration * 1000:.1f} bytes={job.total_bytes_processed} "
+                f"slot_ms={job.slot_millis} cache_hit={job.cache_hit} rows={rows}"
+            )
+
+
+def record_query_error(name, endpoint):
+    query_errors.inc(query=name, endpoint=endpoint)
+
+
+# ---------------------------------------------------------------------------
+# Gemini
+# ---------------------------------------------------------------------------
+
+llm_duration = Histogram(
+    "gemini_request_duration_seconds", "Gemini generate_content latency", ("model", "endpoint", "status")
+)
+llm_requests = Counter("gemini_requests_total", "Gemini generate_content calls", ("model", "endpoint", "status"))
+llm_prompt_tokens = Counter("gemini_prompt_tokens_total", "Prompt tokens sent to Gemini", ("model", "endpoint"))
+llm_output_tokens = Counter("gemini_output_tokens_total", "Tokens generated by Gemini", ("model", "endpoint"))
+llm_first_token = Histogram(
+    "gemini_time_to_first_token_seconds", "Time until the first streamed chunk", ("model", "endpoint")
+)
+llm_cache_lookups = Counter(
+    "gemini_response_cache_lookups_total", "Gemini response cache lookups; result is hit or miss", ("endpoint", "result")
+)
+
+llm_circuit_rejections = Counter(
+    "gemini_circuit_rejections_total", "Calls failed fast because the model's circuit was open", ("model",)
+)
+llm_circuit_state = Gauge("gemini_circuit_state", "Circuit breaker state: 0 closed, 1 half-open, 2 open", ("model",))
+CIRCUIT_STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+
+def record_llm_cache(endpoint, hit):
+    llm_cache_lookups.inc(endpoint=endpoint, result="hit" if hit else "miss")
+
+
+def record_llm_call(model, endpoint, duration, status, response=None):
+    labels = {"model": model, "endpoint": endpoint, "status": status}
+    llm_duration.observe(duration, **labels)
+    llm_requests.inc(**labels)
+    usage = getattr(response, "usage_metadata", None)
+    if usage is not None:
+        llm_prompt_tokens.inc(usage.prompt_token_count or 0, model=model, endpoint=endpoint)
+        llm_output_tokens.inc(usage.candidates_token_count or 0, model=model, endpoint=endpoint)
+
+
+# ---------------------------------------------------------------------------
+# Prompts
+# ---------------------------------------------------------------------------
+
+TOKEN_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+
+prompt_tokens = Histogram(
+    "prompt_tokens", "Prompt size in tokens as built, system prompt included", ("endpoint",), TOKEN_BUCKETS
+)
+prompt_dropped_lines = Counter(
+    "prompt_context_lines_dropped_total", "Context lines left out to stay within the prompt budget", ("endpoint", "section")
+)
+prompt_truncations = Counter("prompt_inputs_truncated_total", "Request inputs cut to fit the prompt budget", ("endpoint",))
+prompt_over_budget = Counter("prompt_over_budget_total", "Prompts still over budget after trimming", ("endpoint",))
+
+
+def record_prompt(stats):
+    endpoint = stats["endpoint"]
+    prompt_tokens.observe(stats["total_tokens"], endpoint=endpoint)
+    for section, dropped in stats["dropped"].items():
+        prompt_dropped_lines.inc(dropped, endpoint=endpoint, section=section)
+    if stats["truncated"]:
+        prompt_truncations.inc(len(stats["truncated"]), endpoint=endpoint)
+    if stats["over_budget"]:
+        prompt_over_budget.inc(endpoint=endpoint)
+
+
+# ---------------------------------------------------------------------------
+# Insights
+# ---------------------------------------------------------------------------
+
+insights_reads = Counter(
+    "insights_reads_total", "Insight reads; state is fresh, stale or cold (generated inline)", ("kind", "state")
+)
+insights_refreshes = Counter("insights_refreshes_total", "Insight regenerations", ("kind", "status"))
+insights_refresh_duration = Histogram(
+    "insights_refresh_duration_seconds", "Time to regenerate one insight entry", ("kind", "status")
+)
+
+
+def record_insights_read(kind, state):
+    insights_reads.inc(kind=kind, state=state)
+
+
+def record_insights_refresh(kind, status, duration):
+    insights_refreshes.inc(kind=kind, status=status)
+    insights_refresh_duration.observe(duration, kind=kind, status=status)
+
+
+# ---------------------------------------------------------------------------
+# Startup warmup
+# ---------------------------------------------------------------------------
+
+warmup_step_duration = Gauge(
+    "warmup_step_duration_seconds", "Time each startup warmup step took; status is ok, skipped or error",
+    ("step", "status"),
+)
+
+
+def record_warmup_step(step, status, duration):
+    warmup_step_duration.set(duration, step=step, status=status)
+
+
+# ---------------------------------------------------------------------------
+# HTTP
+# ---------------------------------------------------------------------------
+
+http_duration = Histogram(
+    "http_request_duration_seconds", "API request latency by route", ("method", "route", "status")
+)
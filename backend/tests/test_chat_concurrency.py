@@ -0,0 +1,99 @@
+# Concurrent /chat requests finish in about the time of one
+#
+# Runs the app in-process on the fake backends (backend/fakes.py) with fixed
+# injected Gemini and BigQuery latencies and no result caches. Each case times
+# one /chat call, then fires CONCURRENCY calls at once: with the advisor's
+# context already built, and from a cold context cache where every advisor's
+# context is rebuilt by the BigQuery fan-out. With the model call awaited
+# natively and the context build on a worker thread they overlap; if anything
+# on the path blocked the event loop they would serialize and take several
+# times as long. backend/benchmarks/bench_chat_concurrency.py prints the same
+# comparison against the old blocking path.
+#
+#   python -m pytest backend/tests
+
+import os
+import tempfile
+
+os.environ["FAKE_BACKENDS"] = "true"
+os.environ.setdefault("LOCAL_ENGINE_DATA_DIR", os.path.join(tempfile.gettempdir(), "advisor-fake-fixtures"))
+os.environ["FAKE_LLM_LATENCY_MS"] = "500"
+os.environ["FAKE_LLM_JITTER_MS"] = "0"
+os.environ["FAKE_LLM_ERROR_RATE"] = "0"
+os.environ["FAKE_QUERY_LATENCY_MS"] = "400"
+os.environ["FAKE_QUERY_JITTER_MS"] = "0"
+os.environ["FAKE_QUERY_ERROR_RATE"] = "0"
+os.environ["LLM_CACHE_ENABLED"] = "false"
+os.environ["QUERY_CACHE_ENABLED"] = "false"
+
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from backend import chat_context, data_access, warmup
+from backend.main import app
+
+CONCURRENCY = 16
+# The fixture book's advisors; cold calls are spread over them so each builds its own context
+ADVISOR_IDS = ["ADV001", "ADV002", "ADV003", "ADV004", "ADV005"]
+
+
+async def _chat(client, i, advisor_id=ADVISOR_IDS[0]):
+    response = await client.post("/chat", json={"message": f"question {i}", "advisor_id": advisor_id})
+    assert response.status_code == 200
+    assert "BigQuery + Vertex AI" in response.json()["data_source"]
+
+
+async def _elapsed(calls):
+    started = time.perf_counter()
+    await asyncio.gather(*calls)
+    return time.perf_counter() - started
+
+
+async def _timings():
+    timings = {}
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        await asyncio.get_running_loop().run_in_executor(None, warmup.wait)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=60) as client:
+            # Builds the first advisor's chat context, which the warm calls reuse
+            await _chat(client, -1)
+            timings["warm"] = (
+                await _elapsed([_chat(client, 0)]),
+                await _elapsed([_chat(client, i) for i in range(1, CONCURRENCY + 1)]),
+            )
+
+            chat_context.invalidate()
+            single = await _elapsed([_chat(client, 0)])
+            chat_context.invalidate()
+            timings["cold"] = (single, await _elapsed([
+                _chat(client, i, ADVISOR_IDS[i % len(ADVISOR_IDS)]) for i in range(1, CONCURRENCY + 1)
+            ]))
+    return timings
+
+
+@pytest.fixture(scope="module")
+def timings():
+    try:
+        yield asyncio.run(_timings())
+    finally:
+        data_access.shutdown()
+
+
+def test_concurrent_chats_take_about_as_long_as_one(timings):
+    single, concurrent = timings["warm"]
+    assert single >= 0.5, f"one /chat took {single:.2f}s, less than the injected Gemini latency"
+    assert concurrent < 2 * single, (
+        f"{CONCURRENCY} concurrent /chat calls took {concurrent:.2f}s, one took {single:.2f}s"
+    )
+
+
+def test_cold_context_builds_stay_off_the_event_loop(timings):
+    single, concurrent = timings["cold"]
+    assert single >= 0.9, f"one cold /chat took {single:.2f}s, less than the injected query and Gemini latency"
+    assert concurrent < 2 * single, (
+        f"{CONCURRENCY} concurrent cold /chat calls over {len(ADVISOR_IDS)} advisors took {concurrent:.2f}s, "
+        f"one took {single:.2f}s"
+    )
@@ -0,0 +1,172 @@
+# Startup warmup and readiness
+#
+# Cloud Run sends traffic as soon as an instance answers its probe, so without
+# this the first users paid for the token exchange, the BigQuery connection
+# handshakes, the Vertex AI import and init, model handle construction and the
+# first firm-wide insight generation. start() runs those steps on a background
+# thread while the server is already listening, and /ready answers 503 until
+# they are done (or WARMUP_TIMEOUT_SECONDS have passed), then 200 with how long
+# each step took. Point the startup probe at /ready and the liveness check at /.
+#
+# Steps are registered per lane. Lanes run in parallel, the steps in a lane in
+# order; steps without a lane prime caches and run once every lane is done, so
+# they find an authenticated client and ready model handles. A failed step is
+# reported and the next one still runs, except steps that require it, which are
+# skipped; with WARMUP_STRICT=true a failure keeps the instance out of rotation.
+
+import os
+import threading
+import time
+
+from backend import data_access, llm, local_engine, nba_batch, snapshots, telemetry
+from backend.prompt_templates import BANKING_ADVISOR_SYSTEM_PROMPT
+
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "true").lower() == "true"
+# Report ready after this long even if steps are still running
+WARMUP_TIMEOUT_SECONDS = float(os.getenv("WARMUP_TIMEOUT_SECONDS", "120"))
+# Stay not-ready when a step fails instead of serving with fallbacks
+WARMUP_STRICT = os.getenv("WARMUP_STRICT", "false").lower() == "true"
+# Models whose handles are created up front (with and without the system prompt)
+WARMUP_MODELS = [
+    name.strip()
+    for name in os.getenv("WARMUP_MODELS", ",".join(["gemini-1.5-pro", *llm.FALLBACK_MODELS])).split(",")
+    if name.strip()
+]
+
+PRIME = None  # lane of the cache-priming steps, run after the others
+
+_steps = []  # (name, step, lane, requires)
+_report = {}  # name -> step result
+_lock = threading.Lock()
+_done = threading.Event()
+_started_at = None
+_duration = None
+
+
+class Skip(Exception):
+    """Raised by a step that has nothing to do in this configuration"""
+
+
+def register(name, step, lane=PRIME, requires=()):
+    """Register step() to run at startup; it may return a short detail for the
+    report. It is skipped if a step named in requires failed."""
+    _steps.append((name, step, lane, tuple(requires)))
+
+
+def _run_step(name, step, requires):
+    with _lock:
+        _report[name]["status"] = "running"
+        failed = [required for required in requires if _report[required]["status"] == "error"]
+    started = time.perf_counter()
+    try:
+        if failed:
+            raise Skip(f"{', '.join(failed)} failed")
+        status, detail = "ok", step()
+    except Skip as e:
+        status, detail = "skipped", str(e)
+    except Exception as e:
+        status, detail = "error", str(e)
+        print(f"Warmup step {name} error: {e}")
+    duration = time.perf_counter() - started
+    telemetry.record_warmup_step(name, status, duration)
+    with _lock:
+        _report[name].update(status=status, duration_ms=round(duration * 1000, 1), detail=detail)
+
+
+def _run_lane(lane):
+    for name, step, step_lane, requires in _steps:
+        if step_lane == lane:
+            _run_step(name, step, requires)
+
+
+def _run():
+    global _duration
+    started = time.perf_counter()
+    lanes = list(dict.fromkeys(lane for _, _, lane, _ in _steps if lane is not PRIME))
+    threads = [threading.Thread(target=_run_lane, args=(lane,), name=f"warmup-{lane}", daemon=True) for lane in lanes]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    _run_lane(PRIME)
+    _duration = time.perf_counter() - started
+    _done.set()
+    print(f"Warmup finished in {_duration:.1f}s: "
+          + ", ".join(f"{name} {step['status']} {step['duration_ms']:.0f}ms" for name, step in _report.items()))
+
+
+def start():
+    """Run the registered steps in the background; /ready reports when they finish"""
+    global _started_at, _duration
+    _done.clear()
+    _started_at, _duration = time.time(), None
+    with _lock:
+        _report.clear()
+        for name, _, lane, _ in _steps:
+            _report[name] = {"lane": lane or "prime", "status": "pending", "duration_ms": None, "detail": None}
+    if not WARMUP_ENABLED:
+        with _lock:
+            for step in _report.values():
+                step.update(status="skipped", detail="WARMUP_ENABLED=false")
+        _duration = 0.0
+        _done.set()
+        return
+    threading.Thread(target=_run, name="warmup", daemon=True).start()
+
+
+def wait(timeout=None):
+    """Block until warmup finishes; False if timeout passed first"""
+    return _done.wait(timeout)
+
+
+def status():
+    """Readiness plus each step's status and duration"""
+    with _lock:
+        done = _done.is_set()
+        elapsed = time.time() - _started_at if _started_at else 0.0
+        timed_out = not done and elapsed > WARMUP_TIMEOUT_SECONDS
+        failed = any(step["status"] == "error" for step in _report.values())
+        if not (done or timed_out):
+            state = "warming"
+        elif failed or timed_out:
+            state = "degraded"
+        else:
+            state = "ready"
+        return {
+            "ready": (done or timed_out) and not (WARMUP_STRICT and failed),
+            "status": state,
+            "timed_out": timed_out,
+            "duration_ms": round((_duration if done else elapsed) * 1000, 1),
+            "steps": {name: dict(step) for name, step in _report.items()},
+        }
+
+
+# ---------------------------------------------------------------------------
+# Connection and model steps (cache-priming steps are registered by backend/main.py)
+# ---------------------------------------------------------------------------
+
+def _credentials():
+    if local_engine.OFFLINE:
+        raise Skip("offline local engine")
+    data_access.authenticate()
+
+
+def _bigquery_connections():
+    if local_engine.OFFLINE:
+        raise Skip("offline local engine")
+    return f"{data_access.warm_connections()} connections"
+
+
+def _table_checks():
+    return {"portfolio_snapshots": snapshots.ready(), "nba_recommendations": nba_batch.ready()}
+
+
+def _model_handles():
+    return f"{llm.warm_models(WARMUP_MODELS, BANKING_ADVISOR_SYSTEM_PROMPT)} handles"
+
+
+register("credentials", _credentials, lane="bigquery")
+register("bigquery_connections", _bigquery_connections, lane="bigquery", requires=["credentials"])
+register("table_checks", _table_checks, lane="bigquery", requires=["credentials"])
+register("vertexai_init", llm.init_sdk, lane="vertexai")
+register("model_handles", _model_handles, lane="vertexai", requires=["vertexai_init"])
@@ -39,8 +39,9 @@ echo "🔗 Backend URL: $BACKEND_URL"
 echo "👤 Service Account: $SERVICE_ACCOUNT"
 
 echo "🧪 Testing deployed backend..."
-# Test health endpoint
+# Test health endpoint, then readiness (per-step warmup timings)
 curl "$BACKEND_URL/"
+curl "$BACKEND_URL/ready"
 curl "$BACKEND_URL/auth-check"
 
 echo "✨ Backend deployment complete!"
@@ -152,6 +152,65 @@ export async function chat(data) {
   return handleResponse(res);
 }
 
+// Streaming chat over Server-Sent Events. onToken receives each text chunk as
+// Gemini generates it; pass an AbortSignal to stop (the backend stops generating
+// when the connection closes). Resolves with the final "done" event payload.
+export async function chatStream(data, { onToken, onStart, signal } = {}) {
+  const advisorId = getCurrentAdvisorId();
+  const res = await fetch(`${API_BASE}/chat/stream`, {
+    method: 'POST',
+    headers: { ...getAuthHeaders(), 'Accept': 'text/event-stream' },
+    body: JSON.stringify({
+      ...data,
+      advisor_id: advisorId
+    }),
+    signal
+  });
+  if (!res.ok || !res.body) {
+    await handleResponse(res);
+    throw new Error('Streaming is not supported by this browser');
+  }
+
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  let result = {};
+
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    // Events are separated by a blank line
+    let boundary;
+    while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+      const raw = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+      let event = 'message';
+      let payload = '';
+      raw.split('\n').forEach(line => {
+        if (line.startsWith('event:')) event = line.slice(6).trim();
+        else if (line.startsWith('data:')) payload += line.slice(5).trim();
+      });
+      const parsed = payload ? JSON.parse(payload) : {};
+
+      if (event === 'start' && onStart) onStart(parsed);
+      else if (event === 'token' && onToken) onToken(parsed.text);
+      else if (event === 'error') throw new Error(parsed.message);
+      else if (event === 'done' || event === 'cancelled') result = { ...parsed, event };
+    }
+  }
+  return result;
+}
+
+export async function cancelChatStream(streamId) {
+  const res = await fetch(`${API_BASE}/chat/stream/${streamId}/cancel`, {
+    method: 'POST',
+    headers: getAuthHeaders()
+  });
+  return handleResponse(res);
+}
+
 export async function fetchDashboardMetrics() {
   const res = await fetch(`${API_BASE}/dashboard-metrics`, {
     headers: getAuthHeaders()
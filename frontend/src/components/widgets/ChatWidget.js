@@ -1,5 +1,5 @@
-import React, { useState } from 'react';
-import { chat } from '../../api';
+import React, { useRef, useState } from 'react';
+import { chat, chatStream, cancelChatStream } from '../../api';
 import { useAuth } from '../../AuthContextSimple';
 import './ChatWidget.css';
 
@@ -14,10 +14,31 @@ const ChatWidget = ({ expanded = false }) => {
   ]);
   const [inputMessage, setInputMessage] = useState('');
   const [loading, setLoading] = useState(false);
+  const [streaming, setStreaming] = useState(false);
+  const abortRef = useRef(null);
+  const streamIdRef = useRef(null);
+
+  // Replace the content of the last (streaming) assistant message
+  const updateLastMessage = (content) => {
+    setMessages(prev => {
+      const next = [...prev];
+      next[next.length - 1] = { ...next[next.length - 1], content };
+      return next;
+    });
+  };
+
+  const stopStreaming = () => {
+    if (streamIdRef.current) {
+      cancelChatStream(streamIdRef.current).catch(() => {});
+    }
+    if (abortRef.current) {
+      abortRef.current.abort();
+    }
+  };
 
   const sendMessage = async (e) => {
     e.preventDefault();
-    if (!inputMessage.trim() || loading) return;
+    if (!inputMessage.trim() || loading || streaming) return;
 
     const userMessage = {
       type: 'user',
@@ -29,27 +50,65 @@ const ChatWidget = ({ expanded = false }) => {
     setInputMessage('');
     setLoading(true);
 
+    // Stream the answer token by token; fall back to /chat if streaming fails
+    // before anything arrived
+    const controller = new AbortController();
+    abortRef.current = controller;
+    let streamed = '';
+
     try {
-      const response = await chat({ 
-        message: userMessage.content
-        // advisor_id is automatically added by api.js from AuthContext
-      });
-      
-      const assistantMessage = {
-        type: 'assistant',
-        content: response.response || 'I apologize, but I couldn\'t process your request right now.',
-        timestamp: new Date().toISOString()
-      };
-      
-      setMessages(prev => [...prev, assistantMessage]);
+      await chatStream(
+        { message: userMessage.content },
+        {
+          signal: controller.signal,
+          onStart: ({ stream_id }) => { streamIdRef.current = stream_id; },
+          onToken: (text) => {
+            if (!streamed) {
+              setLoading(false);
+              setStreaming(true);
+              setMessages(prev => [...prev, { type: 'assistant', content: '', timestamp: new Date().toISOString() }]);
+            }
+            streamed += text;
+            updateLastMessage(streamed);
+          }
+        }
+      );
+      if (!streamed) {
+        throw new Error('Empty response');
+      }
     } catch (error) {
-      const errorMessage = {
-        type: 'assistant',
-        content: 'I\'m sorry, I encountered an error. Please try again.',
-        timestamp: new Date().toISOString()
-      };
-      setMessages(prev => [...prev, errorMessage]);
+      if (streamed) {
+        // Keep what was received; mark it if the user stopped it
+        if (error.name === 'AbortError') {
+          updateLastMessage(`${streamed.trim()} …`);
+        }
+      } else if (error.name !== 'AbortError') {
+        try {
+          const response = await chat({ 
+            message: userMessage.content
+            // advisor_id is automatically added by api.js from AuthContext
+          });
+          
+          const assistantMessage = {
+            type: 'assistant',
+            content: response.response || 'I apologize, but I couldn\'t process your request right now.',
+            timestamp: new Date().toISOString()
+          };
+          
+          setMessages(prev => [...prev, assistantMessage]);
+        } catch (fallbackError) {
+          const errorMessage = {
+            type: 'assistant',
+            content: 'I\'m sorry, I encountered an error. Please try again.',
+            timestamp: new Date().toISOString()
+          };
+          setMessages(prev => [...prev, errorMessage]);
+        }
+      }
     } finally {
+      abortRef.current = null;
+      streamIdRef.current = null;
+      setStreaming(false);
       setLoading(false);
     }
   };
@@ -136,19 +195,32 @@ const ChatWidget = ({ expanded = false }) => {
               value={inputMessage}
               onChange={(e) => setInputMessage(e.target.value)}
               placeholder="Ask me about your clients, portfolios, or tasks..."
-              disabled={loading}
+              disabled={loading || streaming}
               className="chat-input"
             />
-            <button 
-              type="submit" 
-              disabled={!inputMessage.trim() || loading}
-              className="send-button"
-            >
-              <svg width="20" height="20" viewBox="0 0 24 24" fill="none" stroke="currentColor" strokeWidth="2">
-                <line x1="22" y1="2" x2="11" y2="13"></line>
-                <polygon points="22,2 15,22 11,13 2,9 22,2"></polygon>
-              </svg>
-            </button>
+            {loading || streaming ? (
+              <button 
+                type="button" 
+                onClick={stopStreaming}
+                className="send-button stop-button"
+                title="Stop generating"
+              >
+                <svg width="20" height="20" viewBox="0 0 24 24" fill="currentColor" stroke="none">
+                  <rect x="6" y="6" width="12" height="12" rx="2"></rect>
+                </svg>
+              </button>
+            ) : (
+              <button 
+                type="submit" 
+                disabled={!inputMessage.trim()}
+                className="send-button"
+              >
+                <svg width="20" height="20" viewBox="0 0 24 24" fill="none" stroke="currentColor" strokeWidth="2">
+                  <line x1="22" y1="2" x2="11" y2="13"></line>
+                  <polygon points="22,2 15,22 11,13 2,9 22,2"></polygon>
+                </svg>
+              </button>
+            )}
           </div>
         </form>
 
@@ -174,19 +246,32 @@ const ChatWidget = ({ expanded = false }) => {
               value={inputMessage}
               onChange={(e) => setInputMessage(e.target.value)}
               placeholder="Ask me about your clients, portfolios, or tasks..."
-              disabled={loading}
+              disabled={loading || streaming}
               className="chat-input"
             />
-            <button 
-              type="submit" 
-              disabled={!inputMessage.trim() || loading}
-              className="send-button"
-            >
-              <svg width="20" height="20" viewBox="0 0 24 24" fill="none" stroke="currentColor" strokeWidth="2">
-                <line x1="22" y1="2" x2="11" y2="13"></line>
-                <polygon points="22,2 15,22 11,13 2,9 22,2"></polygon>
-              </svg>
-            </button>
+            {loading || streaming ? (
+              <button 
+                type="button" 
+                onClick={stopStreaming}
+                className="send-button stop-button"
+                title="Stop generating"
+              >
+                <svg width="20" height="20" viewBox="0 0 24 24" fill="currentColor" stroke="none">
+                  <rect x="6" y="6" width="12" height="12" rx="2"></rect>
+                </svg>
+              </button>
+            ) : (
+              <button 
+                type="submit" 
+                disabled={!inputMessage.trim()}
+                className="send-button"
+              >
+                <svg width="20" height="20" viewBox="0 0 24 24" fill="none" stroke="currentColor" strokeWidth="2">
+                  <line x1="22" y1="2" x2="11" y2="13"></line>
+                  <polygon points="22,2 15,22 11,13 2,9 22,2"></polygon>
+                </svg>
+              </button>
+            )}
           </div>
         </form>
       </div>